@@ -0,0 +1,128 @@
+"""
+Benchmarks for the colormap editor and the exporters.
+
+These create ColormapEditor instances, so Chaco and Enable must be
+installed.  No window is opened; set ETS_TOOLKIT=null to run them on a
+machine without a display.
+"""
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from .common import POINT_COUNTS, KINDS, make_points, skip_above
+
+
+def make_editor(n, kind):
+    from chacoled.colormap_editor import ColormapEditor
+    editor = ColormapEditor()
+    with editor.batch():
+        for seed, channel in enumerate([editor.red_channel,
+                                        editor.green_channel,
+                                        editor.blue_channel]):
+            channel.unit_map.points = make_points(n, kind, seed=seed)
+    return editor
+
+
+class ConvertToSegments(object):
+    """ColormapChannel._convert_to_segments() of a channel with n points."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        from chacoled.colormap_editor import ColormapChannel
+        self.channel = ColormapChannel(points=make_points(n, kind))
+
+    def time_convert_to_segments(self, n, kind):
+        # Drop the cached result, so the conversion is timed.
+        self.channel._segments_version = -1
+        self.channel._convert_to_segments()
+
+    def time_convert_to_segments_cached(self, n, kind):
+        self.channel._convert_to_segments()
+
+    def peakmem_convert_to_segments(self, n, kind):
+        self.channel._convert_to_segments()
+
+
+class SegmentsToPoints(object):
+    """segments_to_points() of the segments of a channel with n points."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        from chacoled.unit_map import UnitMap, segments_to_points
+        self.segments_to_points = segments_to_points
+        self.segs = UnitMap(points=make_points(n, kind)).segments()
+
+    def time_segments_to_points(self, n, kind):
+        self.segments_to_points(self.segs)
+
+
+class UpdateLuminance(object):
+    """ColormapEditor._update_luminance() with n points per channel."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        skip_above(n, 10 ** 4)
+        self.editor = make_editor(n, kind)
+
+    def time_update_luminance(self, n, kind):
+        self.editor._update_luminance(None, None, None)
+
+    def peakmem_update_luminance(self, n, kind):
+        self.editor._update_luminance(None, None, None)
+
+
+class ExportChacoFile(object):
+    """write_chaco_file() of a colormap with n points per channel."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        skip_above(n, 10 ** 4)
+        from chacoled.colormap_io import write_chaco_file
+        from chacoled.unit_map import UnitMap
+        self.write = write_chaco_file
+        self.unit_maps = [UnitMap(points=make_points(n, kind, seed=seed))
+                          for seed in range(3)]
+
+    def time_export_chaco_file(self, n, kind):
+        self.write(StringIO(), 'bench', self.unit_maps)
+
+    def peakmem_export_chaco_file(self, n, kind):
+        self.write(StringIO(), 'bench', self.unit_maps)
+
+
+class ChannelSetLUT(object):
+    """ChannelSet.lut(4096) of four channels with n points each."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        from chacoled.channels import ChannelSet
+        from chacoled.unit_map import UnitMap
+        self.channels = ChannelSet(
+            names=['red', 'green', 'blue', 'alpha'],
+            unit_maps=[UnitMap(points=make_points(n, kind, seed=seed))
+                       for seed in range(4)])
+
+    def time_lut(self, n, kind):
+        # Each call computes the merged table again.
+        self.channels._table_key = None
+        self.channels.lut(4096)
+
+    def peakmem_lut(self, n, kind):
+        self.channels.lut(4096)
@@ -0,0 +1,38 @@
+"""
+Rendering benchmarks, using the headless harness in benchmarks/render.py.
+
+Chaco, Enable and kiva's image backend must be installed.
+"""
+
+from argparse import Namespace
+
+from .common import make_points
+
+
+class Render(object):
+    """One frame of a scene of benchmarks/render.py, at 400x250 pixels."""
+
+    params = [[10, 1000, 10 ** 5], ['editor', 'drag', 'colorbar'],
+              [False, True]]
+    param_names = ['n', 'scene', 'damaged']
+    timeout = 300
+
+    # Number of frames of the simulated drags; the frames are cycled.
+    frames = 50
+
+    def setup(self, n, scene, damaged):
+        from .render import SCENES, make_gc
+        args = Namespace(width=400, height=250, grid=10, points=n,
+                         kind='monotone', frames=self.frames,
+                         damaged=damaged)
+        args.points_list = make_points(n, 'monotone')
+        self.step, self.draw = SCENES[scene](args)
+        self.gc = make_gc(400, 350)
+        self.frame = 0
+        # Draw the first frame, so the cached layers exist.
+        self.draw(self.gc)
+
+    def time_frame(self, n, scene, damaged):
+        self.step(self.frame % self.frames)
+        self.draw(self.gc)
+        self.frame += 1
@@ -0,0 +1,104 @@
+"""
+Benchmarks for the UnitMap class and the point list functions.
+"""
+
+import numpy as np
+
+from chacoled.unit_map import UnitMap, clean2
+
+from .common import POINT_COUNTS, KINDS, make_points, skip_above
+
+
+class Evaluate(object):
+    """UnitMap.evaluate() at 100 x values spread over [0, 1]."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        self.um = UnitMap(points=make_points(n, kind))
+        self.x = np.linspace(0.0, 1.0, 100).tolist()
+
+    def time_evaluate(self, n, kind):
+        for x in self.x:
+            self.um.evaluate(x)
+
+    def peakmem_evaluate(self, n, kind):
+        for x in self.x:
+            self.um.evaluate(x)
+
+
+class Compose(object):
+    """UnitMap.compose() of two maps with n points each."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        skip_above(n, 1000)
+        self.f = UnitMap(points=make_points(n, kind, seed=1))
+        self.g = UnitMap(points=make_points(n, kind, seed=2))
+
+    def time_compose(self, n, kind):
+        self.f.compose(self.g)
+
+    def peakmem_compose(self, n, kind):
+        self.f.compose(self.g)
+
+
+class Clean2(object):
+    """clean2() of n points, most of which can be removed."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        skip_above(n, 10 ** 4)
+        self.points = make_points(n, kind)
+
+    def time_clean2(self, n, kind):
+        clean2(self.points, tol=1e-2)
+
+    def peakmem_clean2(self, n, kind):
+        clean2(self.points, tol=1e-2)
+
+
+class AddPoint(object):
+    """UnitMap.add_point() of a point near the end of the map."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        self.um = UnitMap(points=make_points(n, kind))
+        x = 0.5 * (self.um.points[-2][0] + 1.0)
+        self.point = (x, self.um.evaluate(x))
+
+    def time_add_point(self, n, kind):
+        self.um.add_point(self.point)
+        self.um.points.pop(-2)
+
+
+class Stream(object):
+    """UnitMap.stream() over 16 chunks of 2**16 values."""
+
+    params = [POINT_COUNTS, KINDS]
+    param_names = ['n', 'kind']
+    timeout = 300
+
+    def setup(self, n, kind):
+        self.um = UnitMap(points=make_points(n, kind))
+        rng = np.random.RandomState(0)
+        self.chunks = [rng.rand(1 << 16) for k in range(16)]
+
+    def time_stream(self, n, kind):
+        for values in self.um.stream(self.chunks):
+            pass
+
+    def peakmem_stream(self, n, kind):
+        for values in self.um.stream(self.chunks):
+            pass
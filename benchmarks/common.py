@@ -0,0 +1,44 @@
+"""
+Shared helpers for the benchmarks.
+"""
+
+import numpy as np
+
+
+# The numbers of points used by the parametrized benchmarks.
+POINT_COUNTS = [10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6]
+
+# The shapes of the maps: a monotonically increasing map, and a random walk
+# (which is not monotonic, so it exercises the code paths for reversals).
+KINDS = ['monotone', 'random_walk']
+
+
+def make_points(n, kind, seed=0):
+    """
+    Return a list of n points (x, y) that define a valid UnitMap of the
+    given kind.  The result only depends on n, kind and seed.
+    """
+    rng = np.random.RandomState(seed)
+    x = np.sort(rng.uniform(0.0, 1.0, n))
+    x[0] = 0.0
+    x[-1] = 1.0
+    if kind == 'monotone':
+        y = np.sort(rng.uniform(0.0, 1.0, n))
+    elif kind == 'random_walk':
+        y = np.cumsum(rng.normal(size=n))
+        y -= y.min()
+        if y.max() > 0:
+            y /= y.max()
+    else:
+        raise ValueError("unknown kind %r" % (kind,))
+    return list(zip(x.tolist(), y.tolist()))
+
+
+def skip_above(n, max_points):
+    """
+    Skip a benchmark (the asv convention is to raise NotImplementedError
+    in setup) when n is too large for an algorithm with superlinear cost.
+    """
+    if n > max_points:
+        raise NotImplementedError("n = %d is above the limit %d for this "
+                                  "benchmark" % (n, max_points))
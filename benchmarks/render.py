@@ -0,0 +1,274 @@
+"""
+Headless rendering benchmark.
+
+Draws UnitMapPlotter, UnitMapEditor and the colorbar of ColormapEditor on
+kiva image graphics contexts (no window, no display), optionally while a
+drag is simulated by dispatching mouse events to the editor, and reports
+the p50/p99 frame times and the number of kiva calls per frame.
+
+Usage::
+
+    python -m benchmarks.render --size 400x250 --grid 10 --points 1000 \\
+        --frames 200 --scene drag
+
+The scenes are:
+
+    plotter     full redraws of a UnitMapPlotter
+    editor      full redraws of a UnitMapEditor
+    drag        a point of a UnitMapEditor is dragged; one frame per move
+    group-drag  half of the points are selected and dragged together
+    colorbar    a point of the red channel of a ColormapEditor is dragged,
+                and the channel and the colorbar are drawn in each frame
+
+By default every frame is a full redraw, as in a window that repaints
+everything.  With --damaged the components draw only the regions they
+invalidated, as in a window with partial repaints, so the partial redraws
+of a drag are measured.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from math import sin, pi
+
+import numpy as np
+
+os.environ.setdefault('ETS_TOOLKIT', 'null')
+
+from .common import make_points
+
+
+class CountingGC(object):
+    """
+    Wraps a kiva graphics context and counts the calls of its methods.
+    """
+
+    def __init__(self, gc):
+        self.gc = gc
+        self.counts = Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self.gc, name)
+        if not callable(attr):
+            return attr
+        counts = self.counts
+
+        def method(*args, **kwargs):
+            counts[name] += 1
+            return attr(*args, **kwargs)
+
+        # Cache the wrapper, so __getattr__ is called once per method.
+        self.__dict__[name] = method
+        return method
+
+    def __enter__(self):
+        self.counts['save_state'] += 1
+        self.gc.save_state()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.gc.restore_state()
+        return False
+
+
+def make_gc(width, height):
+    from kiva.image import GraphicsContext
+    return CountingGC(GraphicsContext((width, height)))
+
+
+def mouse_event(x, y, **traits):
+    from enable.api import MouseEvent
+    return MouseEvent(x=x, y=y, **traits)
+
+
+def setup_component(component, width, height, grid, damaged):
+    component.position = [0, 0]
+    component.bounds = [width, height]
+    if hasattr(component, 'grid_resolutions'):
+        if grid not in component.grid_resolutions:
+            component.grid_resolutions = sorted(
+                component.grid_resolutions + [grid])
+        component.grid_resolution_index = \
+            component.grid_resolutions.index(grid)
+    if not damaged and hasattr(component, '_damaged_region'):
+        # Pretend that the window repaints everything: discard the damaged
+        # region before each frame.
+        draw = component.draw
+
+        def full_draw(gc, *args, **kwargs):
+            component._damaged_region = None
+            draw(gc, *args, **kwargs)
+
+        component.draw = full_draw
+
+
+#---------------------------------------------------------------------------
+# Scenes
+#
+# Each scene function returns a pair of functions (step, draw): step(i)
+# makes the change shown by frame i (it may do nothing), and draw(gc) draws
+# the frame.
+#---------------------------------------------------------------------------
+
+def scene_plotter(args):
+    from chacoled.unit_map import UnitMap
+    from chacoled.unit_map_editor import UnitMapPlotter
+    plotter = UnitMapPlotter(unit_map=UnitMap(points=args.points_list),
+                             label="Plotter")
+    setup_component(plotter, args.width, args.height, args.grid, False)
+    return (lambda i: None), plotter.draw
+
+
+def _editor(args):
+    from chacoled.unit_map import UnitMap
+    from chacoled.unit_map_editor import UnitMapEditor
+    editor = UnitMapEditor(unit_map=UnitMap(points=args.points_list),
+                           label="Editor")
+    setup_component(editor, args.width, args.height, args.grid, args.damaged)
+    return editor
+
+
+def scene_editor(args):
+    editor = _editor(args)
+    return (lambda i: None), editor.draw
+
+
+def _drag_steps(editor, k, frames, amplitude):
+    """
+    Return a function step(i) that drags the point k of the editor up and
+    down along a sine wave with the given amplitude (in pixels).
+    """
+    delta = editor.marker_size / 2
+    x0, y0 = editor._points[k] + delta
+
+    def step(i):
+        if i == 0:
+            editor.dispatch(mouse_event(x0, y0), 'mouse_move')
+            editor.dispatch(mouse_event(x0, y0, left_down=True), 'left_down')
+        y = y0 + amplitude * sin(2 * pi * i / max(frames - 1, 1))
+        editor.dispatch(mouse_event(x0, y, left_down=True), 'mouse_move')
+        if i == frames - 1:
+            editor.dispatch(mouse_event(x0, y), 'left_up')
+
+    return step
+
+
+def scene_drag(args):
+    editor = _editor(args)
+    k = len(editor.unit_map.points) // 2
+    step = _drag_steps(editor, k, args.frames, args.height / 4.0)
+    return step, editor.draw
+
+
+def scene_group_drag(args):
+    editor = _editor(args)
+    n = len(editor.unit_map.points)
+    # Select the middle half of the points with a rubber band.
+    delta = editor.marker_size / 2
+    xs = editor._points[:, 0] + delta
+    x0, x1 = xs[n // 4], xs[(3 * n) // 4]
+    editor.dispatch(mouse_event(x0, -1), 'left_down')
+    editor.dispatch(mouse_event(x1, args.height + 1), 'mouse_move')
+    editor.dispatch(mouse_event(x1, args.height + 1), 'left_up')
+    step = _drag_steps(editor, n // 2, args.frames, args.height / 8.0)
+    return step, editor.draw
+
+
+def scene_colorbar(args):
+    from chacoled.colormap_editor import ColormapEditor
+    cme = ColormapEditor()
+    with cme.batch():
+        for seed, channel in enumerate([cme.red_channel, cme.green_channel,
+                                        cme.blue_channel]):
+            channel.unit_map.points = make_points(args.points, args.kind,
+                                                  seed=seed)
+    red = cme.red_channel
+    setup_component(red, args.width, args.height, args.grid, args.damaged)
+    colorbar = cme.colorbar
+    colorbar.position = [0, args.height]
+    colorbar.bounds = [args.width, 100]
+    k = len(red.unit_map.points) // 2
+    step = _drag_steps(red, k, args.frames, args.height / 4.0)
+
+    def draw(gc):
+        red.draw(gc)
+        colorbar.draw(gc)
+
+    return step, draw
+
+
+SCENES = {
+    'plotter': scene_plotter,
+    'editor': scene_editor,
+    'drag': scene_drag,
+    'group-drag': scene_group_drag,
+    'colorbar': scene_colorbar,
+}
+
+
+def run_scene(args):
+    """
+    Render args.frames frames of the scene args.scene.  Returns a tuple
+    (frame_times, draw_times, counts): the times (in seconds) of the whole
+    frames and of the drawing alone, and the total kiva call counts.
+    """
+    step, draw = SCENES[args.scene](args)
+    extra = 100 if args.scene == 'colorbar' else 0
+    gc = make_gc(args.width, args.height + extra)
+    frame_times = []
+    draw_times = []
+    for i in range(args.frames):
+        t0 = time.time()
+        step(i)
+        t1 = time.time()
+        draw(gc)
+        t2 = time.time()
+        frame_times.append(t2 - t0)
+        draw_times.append(t2 - t1)
+    return np.array(frame_times), np.array(draw_times), gc.counts
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scene', choices=sorted(SCENES), default='drag')
+    parser.add_argument('--size', type=parse_size, default=(400, 250),
+                        help='WIDTHxHEIGHT of the components in pixels')
+    parser.add_argument('--grid', type=int, default=10,
+                        help='number of grid divisions')
+    parser.add_argument('--points', type=int, default=100,
+                        help='number of points of the unit maps')
+    parser.add_argument('--kind', choices=['monotone', 'random_walk'],
+                        default='monotone')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--damaged', action='store_true',
+                        help='redraw only the damaged regions, as a window '
+                             'with partial repaints would')
+    args = parser.parse_args(argv)
+    args.width, args.height = args.size
+    args.points_list = make_points(args.points, args.kind)
+
+    frame_times, draw_times, counts = run_scene(args)
+    print("scene %s, %dx%d, grid %d, %d points, %d frames%s" %
+          (args.scene, args.width, args.height, args.grid, args.points,
+           args.frames, ", damaged regions only" if args.damaged else ""))
+    for label, times in [('frame', frame_times), ('draw', draw_times)]:
+        p50, p99 = np.percentile(times, [50, 99])
+        print("  %-6s p50 %8.3f ms   p99 %8.3f ms" %
+              (label, 1e3 * p50, 1e3 * p99))
+    print("  kiva calls per frame:")
+    for name, count in counts.most_common():
+        print("    %-20s %10.1f" % (name, count / float(args.frames)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
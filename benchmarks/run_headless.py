@@ -0,0 +1,223 @@
+"""
+Run the benchmarks without asv, and compare the results with a stored
+baseline.
+
+The benchmark classes follow the asv conventions (`params`, `setup`,
+`time_*` and `peakmem_*` methods), so they can also be run with
+``asv run`` using the asv.conf.json at the top of the repository.  This
+script needs nothing but the packages required by chacoled itself, and
+never opens a window.
+
+Usage::
+
+    python -m benchmarks.run_headless --save baseline.json
+    ... change the code ...
+    python -m benchmarks.run_headless --compare baseline.json
+
+With --compare, the exit status is 1 if any benchmark is slower, or uses
+more memory, than the baseline by more than --factor.  Only the benchmarks
+that are in both runs are compared.
+
+benchmarks/baseline.json is the stored baseline of the repository, used
+by --compare without a file name.  It was recorded with --max-points
+100000 on a machine without Enable, so it has no rendering benchmarks.
+Timings only compare meaningfully on similar hardware; on another
+machine, record a baseline of the reference commit with --save first.
+
+Each peakmem_ benchmark runs in a new interpreter, so its peak memory
+does not depend on the benchmarks that ran before it.
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import timeit
+
+
+# Make Enable and Pyface work without a display.
+os.environ.setdefault('ETS_TOOLKIT', 'null')
+
+BENCHMARK_MODULES = ['benchmarks.bench_unit_map', 'benchmarks.bench_colormap',
+                     'benchmarks.bench_render']
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+# The program run by peakmem_benchmark(), with the JSON list [module, class,
+# method, params] as its argument.
+_PEAKMEM_PROGRAM = ("import sys, json\n"
+                    "from benchmarks.run_headless import peakmem_child\n"
+                    "peakmem_child(*json.loads(sys.argv[1]))\n")
+
+
+def iter_benchmarks(pattern, max_points):
+    """
+    Yield (name, cls, method_name, params) for each benchmark whose name
+    matches the regular expression `pattern`.
+    """
+    regex = re.compile(pattern)
+    for module_name in BENCHMARK_MODULES:
+        module = __import__(module_name, fromlist=['*'])
+        for cls_name in sorted(dir(module)):
+            cls = getattr(module, cls_name)
+            if not isinstance(cls, type) or not hasattr(cls, 'params'):
+                continue
+            methods = [m for m in sorted(dir(cls))
+                       if m.startswith(('time_', 'peakmem_'))]
+            for params in itertools.product(*cls.params):
+                if params[0] > max_points:
+                    continue
+                for method_name in methods:
+                    name = '%s.%s.%s%r' % (module_name.split('.')[-1],
+                                           cls_name, method_name, params)
+                    if regex.search(name):
+                        yield name, cls, method_name, params
+
+
+def time_benchmark(cls, method_name, params, repeat=3, min_time=0.2):
+    """Return the best time per call of a time_ benchmark, in seconds."""
+    bench = cls()
+    bench.setup(*params)
+    func = getattr(bench, method_name)
+    timer = timeit.Timer(lambda: func(*params))
+    # Choose the number of calls so that each repetition takes at least
+    # min_time.
+    number = 1
+    while True:
+        t = timer.timeit(number)
+        if t >= min_time:
+            break
+        number *= 10
+    times = [t] + timer.repeat(repeat - 1, number)
+    return min(times) / number
+
+
+def peakmem_child(module_name, cls_name, method_name, params):
+    """Run a peakmem_ benchmark, and print its status and peak memory as
+    the last line of the output.  This runs in the new interpreter."""
+    try:
+        module = __import__(module_name, fromlist=['*'])
+        bench = getattr(module, cls_name)()
+        bench.setup(*params)
+        getattr(bench, method_name)(*params)
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            rss *= 1024
+        result = ('ok', rss)
+    except NotImplementedError as e:
+        result = ('skip', str(e))
+    except ImportError as e:
+        result = ('import', str(e))
+    except Exception as e:
+        result = ('error', repr(e))
+    print()
+    print(json.dumps(result))
+
+
+def peakmem_benchmark(cls, method_name, params):
+    """
+    Return the peak resident memory, in bytes, of a new interpreter that
+    runs a peakmem_ benchmark.
+    """
+    # A forked process would start with the memory of this one, which
+    # grows with the benchmarks that have run.
+    args = json.dumps([cls.__module__, cls.__name__, method_name,
+                       list(params)])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen([sys.executable, '-c', _PEAKMEM_PROGRAM, args],
+                            cwd=root, stdout=subprocess.PIPE)
+    output = proc.communicate()[0].decode('utf-8', 'replace')
+    lines = output.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError("the benchmark process failed with status %d" %
+                           proc.returncode)
+    status, value = json.loads(lines[-1])
+    if status == 'skip':
+        raise NotImplementedError(value)
+    if status == 'import':
+        raise ImportError(value)
+    if status == 'error':
+        raise RuntimeError(value)
+    return value
+
+
+def run(pattern, max_points):
+    results = {}
+    for name, cls, method_name, params in iter_benchmarks(pattern,
+                                                          max_points):
+        try:
+            if method_name.startswith('time_'):
+                value = time_benchmark(cls, method_name, params)
+                text = '%12.3g s' % value
+            else:
+                value = peakmem_benchmark(cls, method_name, params)
+                text = '%10.1f MB' % (value / 1e6)
+        except NotImplementedError:
+            text = '     skipped'
+            value = None
+        except ImportError as e:
+            text = '     skipped (%s)' % e
+            value = None
+        print('%-70s %s' % (name, text))
+        sys.stdout.flush()
+        if value is not None:
+            results[name] = value
+    return results
+
+
+def compare(results, baseline, factor):
+    """Print the benchmarks that regressed, and return their number."""
+    regressions = 0
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name] / float(baseline[name])
+        if ratio > factor:
+            regressions += 1
+            print('REGRESSION %-60s %6.2fx' % (name, ratio))
+    print('%d regression%s (factor %g)' % (regressions,
+                                            's' * (regressions != 1),
+                                            factor))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks whose name matches '
+                             'this regular expression')
+    parser.add_argument('--max-points', type=int, default=10 ** 6,
+                        help='skip parameter sets with more points')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', nargs='?',
+                        const=BASELINE,
+                        help='compare the results with a saved baseline '
+                             '(by default, benchmarks/baseline.json)')
+    parser.add_argument('--factor', type=float, default=1.5,
+                        help='slowdown (or memory growth) factor that '
+                             'counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.max_points)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.factor) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+Perceptual analysis of a library of colormaps.
+
+Each colormap is loaded the same way as ColormapApp loads it (with
+colormap_io.read_colormap_file() and color_mapper_points()), sampled at
+equally spaced points, and measured for:
+
+    lightness_monotonic     True if L* is monotonic
+    lightness_backtrack     the total decrease of L* against its overall
+                            direction (0 for a monotonic lightness)
+    delta_e_cv              the coefficient of variation of the CIE76
+                            color differences between adjacent samples
+                            (0 for perceptually uniform steps)
+    luminance_reversals     the number of changes of direction of the
+                            luminance that ColormapEditor plots
+    cvd_separability        the smallest, over protanopia, deuteranopia
+                            and tritanopia, of the ratio of the
+                            perceptual length of the simulated colormap to
+                            that of the original (1 if nothing is lost)
+    penalty                 a combination of the above; lower is better
+
+The colormaps are analyzed in a process pool, and the results are written
+as CSV or JSON, sorted by any of the columns.  For example, to rank the
+Chaco colormaps and all the colormaps exported to a directory:
+
+    python -m chacoled.analysis --chaco exports/*.cmap exports/*.py \\
+        --csv report.csv --sort penalty
+"""
+
+from __future__ import print_function
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from unit_map import UnitMap, srgb_curve
+from channels import ChannelSet
+from color_space import srgb_to_lab
+
+
+# The default luminance coefficients of ColormapEditor.
+LUMINANCE_WEIGHTS = np.array([0.3, 0.59, 0.11])
+
+# Changes of direction of L* or luminance smaller than these are not
+# counted.
+LIGHTNESS_TOL = 0.5
+LUMINANCE_TOL = 1e-3
+
+# Simulation of color vision deficiencies (Machado, Oliveira and
+# Fernandes, 2009, severity 1), applied to linear RGB values.
+CVD_MATRICES = {
+    'protanopia': np.array([[0.152286, 1.052583, -0.204868],
+                            [0.114503, 0.786281, 0.099216],
+                            [-0.003882, -0.048116, 1.051998]]),
+    'deuteranopia': np.array([[0.367322, 0.860646, -0.227968],
+                              [0.280085, 0.672501, 0.047413],
+                              [-0.011820, 0.042940, 0.968881]]),
+    'tritanopia': np.array([[1.255528, -0.076749, -0.178779],
+                            [-0.078411, 0.930809, 0.147602],
+                            [0.004733, 0.691367, 0.303900]]),
+}
+
+COLUMNS = ['name', 'source', 'lightness_monotonic', 'lightness_backtrack',
+           'delta_e_cv', 'luminance_reversals', 'cvd_separability',
+           'penalty', 'error']
+
+
+def channel_set(points):
+    """Return a ChannelSet of the red, green and blue channels of points,
+    a dictionary as returned by colormap_io.color_mapper_points()."""
+    names = ['red', 'green', 'blue']
+    return ChannelSet(names=names,
+                      unit_maps=[UnitMap(points=points[name])
+                                 for name in names])
+
+
+def count_reversals(values, tol):
+    """
+    Return the number of changes of direction of the sequence values.  A
+    change is only counted when the values move back by at least tol from
+    the last extreme value.
+    """
+    reversals = 0
+    direction = 0
+    extreme = values[0]
+    for v in np.asarray(values).tolist():
+        if direction == 0:
+            if abs(v - extreme) >= tol:
+                direction = 1 if v > extreme else -1
+                extreme = v
+        elif (v - extreme) * direction > 0:
+            extreme = v
+        elif (extreme - v) * direction >= tol:
+            reversals += 1
+            direction = -direction
+            extreme = v
+    return reversals
+
+
+def path_length(lab):
+    """The total CIE76 color difference along a sequence of colors."""
+    return np.sqrt((np.diff(lab, axis=0) ** 2).sum(axis=1)).sum()
+
+
+def simulate_cvd(rgb, kind):
+    """Simulate a color vision deficiency on sRGB values."""
+    linear = srgb_curve(inverse=True)(rgb)
+    linear = np.clip(np.dot(linear, CVD_MATRICES[kind].T), 0.0, 1.0)
+    return srgb_curve()(linear)
+
+
+def analyze_points(points, samples=1024):
+    """Return a dictionary of the metrics of the colormap with the given
+    channel points."""
+    rgb = channel_set(points).lut(samples)
+    lab = srgb_to_lab(rgb)
+    lightness = lab[:, 0]
+
+    dl = np.diff(lightness)
+    direction = np.sign(lightness[-1] - lightness[0]) or 1.0
+    backtrack = float(np.maximum(-direction * dl, 0.0).sum())
+
+    de = np.sqrt((np.diff(lab, axis=0) ** 2).sum(axis=1))
+    length = de.sum()
+    mean = de.mean()
+    de_cv = float(de.std() / mean) if mean > 0 else 0.0
+
+    luminance = np.dot(rgb, LUMINANCE_WEIGHTS)
+    reversals = count_reversals(luminance, LUMINANCE_TOL)
+
+    if length > 0:
+        separability = min(path_length(srgb_to_lab(simulate_cvd(rgb, kind)))
+                           for kind in CVD_MATRICES) / length
+    else:
+        separability = 0.0
+
+    penalty = (backtrack / 10.0 + de_cv + 0.5 * reversals +
+               max(1.0 - separability, 0.0))
+    return dict(lightness_monotonic=count_reversals(lightness,
+                                                    LIGHTNESS_TOL) == 0,
+                lightness_backtrack=backtrack, delta_e_cv=de_cv,
+                luminance_reversals=reversals,
+                cvd_separability=float(separability), penalty=penalty)
+
+
+def load_source(source):
+    """
+    Return (name, points) for a source, which is either ('chaco', name),
+    for a colormap in Chaco's color_map_name_dict, or ('file', path).
+    """
+    from colormap_io import read_colormap_file, color_mapper_points
+    kind, value = source
+    if kind == 'chaco':
+        from chaco.api import DataRange1D
+        from chaco.default_colormaps import color_map_name_dict
+        color_mapper = color_map_name_dict[value](
+                            range=DataRange1D(low=0, high=1))
+        name = value
+    else:
+        name, color_mapper = read_colormap_file(value)
+    return name, color_mapper_points(color_mapper)
+
+
+def analyze_source(args):
+    """Load and analyze one source.  This runs in the worker processes."""
+    source, samples = args
+    result = dict(name=source[1], source='%s:%s' % source)
+    try:
+        name, points = load_source(source)
+        result['name'] = name
+        result.update(analyze_points(points, samples))
+    except Exception as e:
+        # A broken file must not stop the analysis of the library.
+        result['error'] = str(e)
+    return result
+
+
+def analyze(sources, samples=1024, processes=None, chunksize=8):
+    """Analyze the sources in a process pool, and return the results."""
+    tasks = [(source, samples) for source in sources]
+    if processes == 1:
+        return [analyze_source(task) for task in tasks]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return list(pool.imap_unordered(analyze_source, tasks, chunksize))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def sort_results(results, key, reverse=False):
+    """Sort the results by a column; those without it (errors) go last."""
+    return (sorted([r for r in results if key in r],
+                   key=lambda r: r[key], reverse=reverse) +
+            [r for r in results if key not in r])
+
+
+def write_csv(f, results):
+    writer = csv.DictWriter(f, COLUMNS)
+    writer.writeheader()
+    for result in results:
+        writer.writerow(result)
+
+
+def write_json(f, results):
+    json.dump(results, f, indent=1, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+                description="Rank colormaps by perceptual quality.")
+    parser.add_argument('files', nargs='*',
+                        help='.cmap or .py colormap files')
+    parser.add_argument('--chaco', action='store_true',
+                        help="include Chaco's colormaps")
+    parser.add_argument('--samples', type=int, default=1024)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of worker processes (default: the '
+                             'number of CPUs)')
+    parser.add_argument('--sort', default='penalty', choices=COLUMNS)
+    parser.add_argument('--reverse', action='store_true')
+    parser.add_argument('--csv', metavar='FILE')
+    parser.add_argument('--json', metavar='FILE')
+    args = parser.parse_args(argv)
+
+    sources = [('file', os.path.abspath(path)) for path in args.files]
+    if args.chaco:
+        from chaco.default_colormaps import color_map_name_dict
+        sources.extend(('chaco', name)
+                       for name in sorted(color_map_name_dict))
+    results = sort_results(analyze(sources, args.samples, args.processes),
+                           args.sort, args.reverse)
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            write_csv(f, results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            write_json(f, results)
+    if not (args.csv or args.json):
+        write_csv(sys.stdout, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
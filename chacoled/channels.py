@@ -0,0 +1,133 @@
+"""
+This module defines the ChannelSet class, which holds the UnitMaps of the
+channels of a colormap (e.g. red, green, blue and alpha) and evaluates all
+of them at once.
+
+The channels are evaluated on a merged grid that contains the breakpoints
+of every channel.  Between two consecutive grid values every channel is
+linear, so the values of all the channels at any x are found with a
+single search in the grid and a single interpolation of the rows of the
+table of values on the grid.  The table is cached, and is only computed
+again when the points of a channel change.
+"""
+
+import numpy as np
+from traits.api import HasTraits, List, Str, Instance, Any
+
+from unit_map import UnitMap, interpolate, evaluation_dtypes
+from streaming import BreakpointTable
+
+
+class ChannelSet(HasTraits):
+    """A list of named UnitMaps that are evaluated together."""
+
+    # The names of the channels, e.g. ['red', 'green', 'blue', 'alpha'].
+    # These are the keys of the segment map.
+    names = List(Str)
+
+    # The UnitMaps of the channels, in the same order as `names`.
+    unit_maps = List(Instance(UnitMap))
+
+    # The cached result of table(), and the versions of the unit maps that
+    # it was computed from.
+    _table = Any
+    _table_key = Any
+
+    def channel(self, name):
+        """Return the UnitMap of the channel `name`."""
+        return self.unit_maps[self.names.index(name)]
+
+    def table(self):
+        """
+        Return the merged grid and the values of the channels on it.
+
+        The result is a tuple (x, values), where x is a nondecreasing array
+        of the x values of the points of all the channels, and values is an
+        array with shape (len(x), len(names)).  Where a channel has a jump,
+        x has two equal consecutive values, and the rows give the values on
+        the left and on the right of the jump.
+
+        The arrays are shared with the cache, and must not be modified.
+        """
+        if any(um._batch_depth > 0 for um in self.unit_maps):
+            # Inside a batch() block the versions are not updated, so the
+            # cache can not be used.
+            return merged_table([um.arrays() for um in self.unit_maps])
+        key = [(id(um), um.version) for um in self.unit_maps]
+        if key != self._table_key:
+            self._table = merged_table([um.arrays() for um in self.unit_maps])
+            self._table_key = key
+        return self._table
+
+    def evaluate(self, x):
+        """
+        Evaluate all the channels at the values in the array x.
+
+        Returns an array with shape x.shape + (len(names),).  At a jump,
+        the value on the left is used, as in UnitMap.evaluate().  float32
+        and float16 arrays give results of the same type (see
+        unit_map.evaluation_dtypes()).
+        """
+        x = np.asarray(x, dtype=evaluation_dtypes(x)[0])
+        if x.size > 0 and (x.min() < 0.0 or x.max() > 1.0):
+            raise ValueError("evaluate(x) requires 0 <= x <= 1.")
+        grid, values = self.table()
+        return interpolate(grid, values, x)
+
+    def lut(self, size=256, dtype=np.float64):
+        """
+        Return a lookup table of the channels: an array with shape
+        (size, len(names)) and type dtype (float64, float32 or float16) of
+        the values at size equally spaced x values.
+        """
+        dtype = np.dtype(dtype)
+        # float16 can not represent the x values of large tables.
+        x = np.linspace(0.0, 1.0, size)
+        if dtype != np.float64:
+            x = x.astype(np.float32)
+        return self.evaluate(x).astype(dtype, copy=False)
+
+    def stream(self, chunks, out=None, low=0.0, high=1.0):
+        """
+        Generate the values of all the channels for each array in the
+        iterable chunks, reusing the same buffers for every chunk.  See
+        streaming.BreakpointTable.stream().
+        """
+        return BreakpointTable.from_channels(self).stream(chunks, out,
+                                                          low, high)
+
+    def segment_map(self):
+        """
+        Return the segment map of the channels, as used by
+        ColorMapper.from_segment_map().
+        """
+        return dict((name, um.segments())
+                    for name, um in zip(self.names, self.unit_maps))
+
+
+#---------------------------------------------------------------------
+# Utility functions.
+#---------------------------------------------------------------------
+
+def merged_table(arrays):
+    """
+    Compute the values of several piecewise linear functions on the merged
+    grid of their breakpoints.
+
+    `arrays` is a sequence of (x, y) pairs of arrays, e.g. as returned by
+    UnitMap.arrays().  See ChannelSet.table() for the result.
+    """
+    grid = np.unique(np.concatenate([x for x, y in arrays]))
+    left = np.column_stack([interpolate(x, y, grid, side='left')
+                            for x, y in arrays])
+    right = np.column_stack([interpolate(x, y, grid, side='right')
+                             for x, y in arrays])
+    # Every grid value gets one row, or two if some channel jumps there.
+    jump = (left != right).any(axis=1)
+    counts = 1 + jump
+    x = np.repeat(grid, counts)
+    values = np.repeat(left, counts, axis=0)
+    last = np.cumsum(counts) - 1
+    values[last[jump]] = right[jump]
+    return x, values
+
@@ -0,0 +1,59 @@
+"""
+Conversions between sRGB and CIE L*a*b* (D65 white point).
+
+The functions accept and return arrays whose last axis has length 3.
+sRGB values are in [0, 1]; L* is in [0, 100].
+"""
+
+import numpy as np
+
+from unit_map import srgb_curve
+
+
+# Linear sRGB to CIE XYZ (D65), and its inverse.
+_RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]])
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+
+# The D65 reference white.
+_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+_DELTA = 6.0 / 29.0
+
+_decode = srgb_curve(inverse=True)
+_encode = srgb_curve()
+
+
+def _f(t):
+    return np.where(t > _DELTA ** 3, np.cbrt(t),
+                    t / (3 * _DELTA ** 2) + 4.0 / 29)
+
+
+def _finv(t):
+    return np.where(t > _DELTA, t ** 3, 3 * _DELTA ** 2 * (t - 4.0 / 29))
+
+
+def srgb_to_lab(rgb):
+    """Convert sRGB values to L*a*b*."""
+    rgb = np.asarray(rgb, dtype=float)
+    xyz = np.dot(_decode(rgb), _RGB_TO_XYZ.T) / _WHITE
+    fx, fy, fz = [_f(xyz[..., k]) for k in range(3)]
+    return np.stack((116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)),
+                    axis=-1)
+
+
+def lab_to_srgb(lab, clip=True):
+    """
+    Convert L*a*b* values to sRGB.  Colors outside the sRGB gamut are
+    clipped to [0, 1] unless clip is False.
+    """
+    lab = np.asarray(lab, dtype=float)
+    fy = (lab[..., 0] + 16) / 116.0
+    fx = fy + lab[..., 1] / 500.0
+    fz = fy - lab[..., 2] / 200.0
+    xyz = np.stack((_finv(fx), _finv(fy), _finv(fz)), axis=-1) * _WHITE
+    linear = np.dot(xyz, _XYZ_TO_RGB.T)
+    if clip:
+        linear = np.clip(linear, 0.0, 1.0)
+    return _encode(linear)
@@ -10,33 +10,40 @@ from __future__ import with_statement
 
 from math import sqrt
 
-import types
+import os
 from os.path import basename
+from StringIO import StringIO
 
 from traits.api import (HasTraits, Instance, Float, Property, Str, Dict,
-        List, Bool, Int, HTML, on_trait_change, cached_property)
+        List, Bool, Int, Range, Enum, HTML, on_trait_change,
+        cached_property)
 from traitsui.api import (Item, VGroup, HGroup, View, Handler,
         InstanceEditor, EnumEditor, RangeEditor, UItem, spring)
 
 from traitsui.menu import Action, Menu, MenuBar
 from pyface.action.api import Group as ActionGroup
-from pyface.api import FileDialog, OK, error
+from pyface.api import FileDialog, OK, YES, GUI, error, confirm
 
-from chaco.api import DataRange1D, ColorMapper
+from chaco.api import DataRange1D
 from chaco.ticks import ShowAllTickGenerator
 from chaco.default_colormaps import color_map_name_dict
 
 import chacoled
 from colormap_editor import ColormapEditor
+from colormap_io import (write_chaco_file, write_chaco_python,
+        read_colormap_file, color_mapper_points, ColormapFileError,
+        write_lut, LUT_MIN_SIZE, LUT_MAX_SIZE, LUT_DTYPES)
+from image_import import (read_image_colormap, IMAGE_EXTENSIONS,
+        PALETTE_EXTENSIONS)
+from instrument import recorder
+from journal import EditJournal, JournalError, read_journal
+from session import SessionRecorder, CHANNEL_NAMES
+from tasks import TaskExecutor, snapshot
+from unit_map import UnitMap
 
 
-def segments_to_points(segs):
-    points = []
-    for seg in segs:
-        points.append((seg[0], seg[1]))
-        if seg[1] != seg[2]:
-            points.append((seg[0], seg[2]))
-    return points
+# The default path of the autosave journal.
+JOURNAL_PATH = os.path.join(os.path.expanduser('~'), '.chacoled_journal')
 
 
 class HelpDialog(HasTraits):
@@ -61,6 +68,10 @@ class HelpDialog(HasTraits):
     Click and drag points to change the shape of the curve.
     </p>
     <p>
+    Shift-click points, or drag a rectangle around them, to select several
+    points.  Dragging one of the selected points moves all of them.
+    </p>
+    <p>
     <i>Keys</i>
     <table border="1">
     <tr><td>Enter</td>
@@ -109,7 +120,20 @@ class HelpDialog(HasTraits):
         <td>Set and unset (resp.) the 'snap to grid' mode.
             When set, points released at the end of a drag
             will move to the nearest vertex of the current grid.</td>
+    </tr>
+    <tr>
+        <td>[, ]</td>
+        <td>Scale the selected points vertically (down or up, resp.) about
+            the most recently clicked selected point.</td>
+    </tr>
     <tr>
+        <td>Up, Down</td>
+        <td>Move the selected points up or down.</td>
+    </tr>
+    <tr>
+        <td>Esc</td>
+        <td>Clear the selection.</td>
+    </tr>
     </table>
     </p>
     </body>
@@ -161,6 +185,11 @@ class Preferences(HasTraits):
 
     green_max = Property(Float, depends_on=['colormap_editor.luminance_red'])
 
+    # The number of entries and the type of the lookup tables exported by
+    # "File / Export / Lookup table".
+    lut_size = Range(LUT_MIN_SIZE, LUT_MAX_SIZE, 256)
+    lut_dtype = Enum(*LUT_DTYPES)
+
     def trait_view(self, parent=None):
         view = \
             View(
@@ -194,6 +223,13 @@ class Preferences(HasTraits):
                          label='Grid color'),
                     Item('object.colormap_editor.show',
                          label='Show'),
+                    Item('object.colormap_editor.use_alpha',
+                         label='Alpha channel'),
+                ),
+                '_',
+                HGroup(
+                    Item('lut_size', label='Lookup table size'),
+                    Item('lut_dtype', label='Type'),
                 ),
                 '_',
                 VGroup(
@@ -269,7 +305,8 @@ class Preferences(HasTraits):
     def _get_unit_map_editors(self):
         unit_map_editors = [self.colormap_editor.red_channel,
                             self.colormap_editor.green_channel,
-                            self.colormap_editor.blue_channel]
+                            self.colormap_editor.blue_channel,
+                            self.colormap_editor.alpha_channel]
         return unit_map_editors
 
     def _get_green_max(self):
@@ -286,64 +323,30 @@ class ColormapAppHandler(Handler):
                             action='open',
                             title='Import colormap file')
         if dialog.open() == OK:
-            if dialog.path.endswith('.cmap'):
-                # Read the colormap data file.
-                # First read the name from the first line, then use
-                # ColorMap.from_file() to actually load the color map.
-                with open(dialog.path, 'r') as f:
-                    name = f.readline().strip()
-                color_mapper = ColorMapper.from_file(dialog.path)
-                info.object._load_color_mapper(name, color_mapper)
-            elif dialog.path.endswith('.py'):
-                # Look for a function that is a color map factory that was
-                # created by this application; these are functions with the
-                # attribute `_colormap_data`.
-
-                # Get the basename, and chop off '.py'.
-                name = basename(dialog.path)[:-3]
-
-                # Try to read the python file.
-                try:
-                    f = open(dialog.path, 'r')
-                except IOError:
-                    error(None, 'Unable to read "%s"' % dialog.path,
-                          'File Error')
-                    return
-                # Try to import the script.
-                module = types.ModuleType(str(name))
-                module.__file__ = dialog.path
-                try:
-                    exec f in module.__dict__
-                except Exception, e:
-                    error(None,
-                          ('An error occurred while importing "%s".\n\n%s' %
-                           (dialog.path, e)),
-                          'Import Error')
-                    return
-                finally:
-                    f.close()
-                for name, obj in module.__dict__.items():
-                    if isinstance(obj, types.FunctionType) and \
-                                            hasattr(obj, '_colormap_data'):
-                        # Found the function.  Call it, and load the
-                        # ColorMapper that it generates.
-                        cm = obj(range=DataRange1D(low=0, high=1))
-                        info.object._load_color_mapper(name, cm)
-                        break
-                else:
-                    msg1 = (('A ColorMapper factory function was not found'
-                             ' in "%s".\n\n') % dialog.path)
-                    msg2 = ('Such a function has the attribute '
-                            '"_colormap_data".')
-                    error(None, msg1 + msg2, 'Not found')
-            else:
-                msg = ('The file "%s" has an unknown file extension.\n\n' %
-                       dialog.path)
-                msg = msg + 'Known extensions are:\n'
-                msg = msg + '  .cmap\n        A Chaco-format colormap file\n'
-                msg = msg + '  .py \n        The python file must contain a'
-                msg = msg + ' function that was created by this program.'
-                error(None, msg, 'Unknown file extension')
+            try:
+                name, color_mapper = read_colormap_file(dialog.path)
+            except ColormapFileError, e:
+                error(None, e.message, e.title)
+                return
+            info.object._load_color_mapper(name, color_mapper)
+
+    def import_image(self, info):
+        """Implements the "File / Import image" menu item."""
+
+        wildcard = FileDialog.create_wildcard(
+                        'Images', ['*' + ext for ext in IMAGE_EXTENSIONS +
+                                   PALETTE_EXTENSIONS + ['.npy']])
+        dialog = FileDialog(parent=info.ui.control,
+                            action='open',
+                            wildcard=wildcard,
+                            title='Import colormap from image or palette')
+        if dialog.open() == OK:
+            try:
+                name, points = read_image_colormap(dialog.path)
+            except ColormapFileError, e:
+                error(None, e.message, e.title)
+                return
+            info.object._load_points(name, points)
 
     def export_chaco_file(self, info):
         """Implements the "File / Export / Chaco file format" menu item."""
@@ -353,49 +356,11 @@ class ColormapAppHandler(Handler):
                             action='save as',
                             title='Chaco colormap data file')
         if dialog.open() == OK:
-            f = open(dialog.path, 'w')
-            f.write('%s\n' % info.object.name)
-
-            # Small value used to ensure that the offset values (i.e. the `t`
-            # values in the loop below) are strictly increasing.
-            eps = 1e-8
-
-            # The colormap editor's UnitMaps.
-            red_um = info.object.colormap_editor.red_channel.unit_map
-            green_um = info.object.colormap_editor.green_channel.unit_map
-            blue_um = info.object.colormap_editor.blue_channel.unit_map
-
-            channels = [(red_um.points[:],   red_um),
-                        (green_um.points[:], green_um),
-                        (blue_um.points[:],  blue_um)]
-
-            # Build a list of 4-tuples of the form (t,r,g,b), where t
-            # increases from 0 to 1.  tstar and eps are used to add small
-            # perturbations that convert discontinuities into very steep
-            # segments. (Actually, I'm not sure this is necessary; I don't
-            # know if Chaco handles discontinuities in the file format.)
-            tprev = None
-            while len(channels[0][0]) > 0:
-                t = min(channel[0][0][0] for channel in channels)
-                if tprev and t <= tprev:
-                    tstar = tprev + eps
-                else:
-                    tstar = t
-                values = [tstar]
-                for k in range(len(channels)):
-                    points, um = channels[k]
-                    if points[0][0] == t:
-                        point = points.pop(0)
-                        values.append(point[1])
-                    else:
-                        value = um.evaluate(tstar)
-                        values.append(value)
-                fmt = ' '.join(["%.12f"] * len(values)) + '\n'
-                s = fmt % tuple(values)
-                f.write(s)
-                tprev = tstar
-
-            f.close()
+            app = info.object
+            points = snapshot(app.colormap_editor.channels.unit_maps)
+            app.task_executor.submit('Export %s' % basename(dialog.path),
+                                     _export_chaco_file,
+                                     args=(points, dialog.path, app.name))
 
     def export_chaco_python(self, info):
         """Implements the "File / Export / Chaco python code" menu item."""
@@ -405,28 +370,35 @@ class ColormapAppHandler(Handler):
                             action='save as',
                             title='Chaco python file')
         if dialog.open() == OK:
-            # The data is attached to the function as an attribute.  This
-            # will allow a program to import a module, look for functions in
-            # the module that have the _colormap_data attribute and recover
-            # the data without having to call the function.
-            f = open(dialog.path, 'w')
-            f.write('\n')
-            f.write('from enthought.chaco.api import ColorMapper\n\n')
-            f.write('def %s(range, **traits):\n' % info.object.name)
-            f.write('    """Generator for the colormap "%s"."""\n' %
-                    info.object.name)
-            f.write(('    return ColorMapper.from_segment_map('
-                     '%s._colormap_data, range=range, **traits)\n\n') %
-                    info.object.name)
-            f.write('%s._colormap_data = ' % info.object.name)
-            segment_map = info.object.colormap_editor._segment_map()
-            seg_code = '%r' % segment_map
-            seg_code = seg_code.replace("'red'", "\n        'red'")
-            seg_code = seg_code.replace("'green'", "\n        'green'")
-            seg_code = seg_code.replace("'blue'", "\n        'blue'")
-            seg_code = seg_code.replace("}", "\n        }")
-            f.write(seg_code)
-            f.close()
+            app = info.object
+            channels = app.colormap_editor.channels
+            points = dict(zip(channels.names, snapshot(channels.unit_maps)))
+            app.task_executor.submit('Export %s' % basename(dialog.path),
+                                     _export_chaco_python,
+                                     args=(points, dialog.path, app.name))
+
+    def export_lut(self, info):
+        """Implements the "File / Export / Lookup table" menu item."""
+
+        app = info.object
+        dialog = FileDialog(parent=info.ui.control,
+                            default_filename=app.name + ".clut",
+                            action='save as',
+                            wildcard=FileDialog.create_wildcard(
+                                    'Lookup tables', ['*.clut', '*.npy',
+                                                      '*.raw']),
+                            title='Lookup table')
+        if dialog.open() == OK:
+            points = snapshot(app.colormap_editor.channels.unit_maps)
+            prefs = app.preferences
+            app.task_executor.submit('Export %s' % basename(dialog.path),
+                                     _export_lut,
+                                     args=(points, dialog.path,
+                                           prefs.lut_size, prefs.lut_dtype))
+
+    def cancel_tasks(self, info):
+        """Implements the "File / Cancel background tasks" menu item."""
+        info.object.task_executor.cancel()
 
     def preferences(self, info):
         """Implements the "File / Preferences" menu item."""
@@ -460,28 +432,45 @@ class ColormapApp(HasTraits):
 
     preferences = Instance(Preferences)
 
+    # Runs the slow operations (exports, cleaning) off the GUI thread.
+    task_executor = Instance(TaskExecutor, ())
+
     status_text = Str('')
 
+    def __init__(self, **traits):
+        super(ColormapApp, self).__init__(**traits)
+        cme = self.colormap_editor
+        for editor in [cme.red_channel, cme.green_channel, cme.blue_channel,
+                       cme.alpha_channel]:
+            editor.task_executor = self.task_executor
+
     def trait_view(self, parent=None):
         file_group = ActionGroup(
                         Action(name='Import', action='import_colormap'),
+                        Action(name='Import image', action='import_image'),
                         Menu(
                             ActionGroup(
                                 Action(name='Chaco file format',
                                        action='export_chaco_file'),
                                 Action(name='Chaco python code',
                                        action='export_chaco_python'),
+                                Action(name='Lookup table',
+                                       action='export_lut'),
                                 ),
                             name='Export',
                             )
                         )
+        task_group = ActionGroup(
+                        Action(name='Cancel background tasks',
+                               action='cancel_tasks'))
         pref_group = ActionGroup(
                         Action(name='Preferences', action='preferences'))
         app_group = ActionGroup(
                         Action(name='Exit', action='exit'))
         help_group = ActionGroup(
                         Action(name='Help', action='help'))
-        file_menu = Menu(file_group, pref_group, app_group, name='File')
+        file_menu = Menu(file_group, task_group, pref_group, app_group,
+                         name='File')
         help_menu = Menu(help_group, name='Help')
         menu_bar = MenuBar(file_menu, help_menu)
         view = View(
@@ -552,35 +541,120 @@ class ColormapApp(HasTraits):
         # a Mac)?
 
         self.status_text = self.colormap_editor.status_text
+        if recorder.enabled:
+            self.status_text += "    " + recorder.summary()
+
+    @on_trait_change('task_executor.status_text')
+    def task_status_changed(self, new):
+        self.status_text = new
 
     #------------------------------------------------------------------
     # Private methods
     #------------------------------------------------------------------
 
+    def start_journal(self, journal):
+        """
+        Start autosaving the channels to `journal`, an EditJournal.  If the
+        journal of a session that was not closed normally exists, offer to
+        restore it first.
+        """
+        if os.path.exists(journal.path):
+            try:
+                channels = read_journal(journal.path)
+            except (IOError, JournalError):
+                channels = []
+            if (len(channels) == len(CHANNEL_NAMES) and
+                    confirm(None, "The last session was not closed "
+                            "normally.  Restore its colormap?",
+                            "Restore session") == YES):
+                points = dict(zip(CHANNEL_NAMES, channels))
+                if all(y == 1.0 for x, y in points['alpha']):
+                    del points['alpha']
+                self._load_points("Restored", points)
+        cme = self.colormap_editor
+        journal.attach([cme.red_channel.unit_map, cme.green_channel.unit_map,
+                        cme.blue_channel.unit_map, cme.alpha_channel.unit_map])
+
     def _load_color_mapper(self, name, color_mapper):
         """Load a ColorMapper instance into the editor."""
+        # Convert the segment data to point lists.
+        self._load_points(name, color_mapper_points(color_mapper))
+
+    def _load_points(self, name, points):
+        """
+        Load the points of the channels, a dictionary as returned by
+        color_mapper_points(), into the editor.
+        """
         self.name = name
-        # Get the dictionary of segment data.
-        segs = color_mapper._segmentdata
-        # Convert the RGB segments to point lists.
-        red_list = segments_to_points(segs['red'])
-        green_list = segments_to_points(segs['green'])
-        blue_list = segments_to_points(segs['blue'])
-        # Assign the lists to the colormap editor's channels.
-        self.colormap_editor.red_channel.unit_map.points = red_list
-        self.colormap_editor.green_channel.unit_map.points = green_list
-        self.colormap_editor.blue_channel.unit_map.points = blue_list
-        # This will trigger an update of the color bar.
-        # FIXME: This should not be necessary.  Changing `points` in any of the
-        # unit maps should propagate up to an event that causes the color bar
-        # to update.
-        self.colormap_editor.blue_channel.updated = True
+        # Assign the lists to the colormap editor's channels.  The colorbar
+        # and the luminance plot are updated once, at the end of the batch.
+        editor = self.colormap_editor
+        with editor.batch():
+            editor.red_channel.unit_map.points = points['red']
+            editor.green_channel.unit_map.points = points['green']
+            editor.blue_channel.unit_map.points = points['blue']
+            if 'alpha' in points:
+                editor.alpha_channel.unit_map.points = points['alpha']
+            else:
+                editor.alpha_channel.unit_map.reset()
+            editor.use_alpha = 'alpha' in points
         self.status_text = "Loaded %s" % name
 
 
+#----------------------------------------------------------------------
+# Background tasks
+#----------------------------------------------------------------------
+
+def _write_file(task, path, text):
+    """Write text to path, unless the task has been cancelled."""
+    task.check()
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _export_chaco_file(task, points, channel_points, path, name):
+    unit_maps = [UnitMap(points=list(p)) for p in channel_points]
+    f = StringIO()
+    write_chaco_file(f, name, unit_maps)
+    _write_file(task, path, f.getvalue())
+
+
+def _export_chaco_python(task, points, channel_points, path, name):
+    segment_map = dict((key, UnitMap(points=list(p)).segments())
+                       for key, p in channel_points.items())
+    f = StringIO()
+    write_chaco_python(f, name, segment_map)
+    _write_file(task, path, f.getvalue())
+
+
+def _export_lut(task, points, channel_points, path, size, dtype):
+    unit_maps = [UnitMap(points=list(p)) for p in channel_points]
+    task.check()
+    write_lut(path, unit_maps, size, dtype)
+
+
 def main():
     app = ColormapApp()
+    record_file = os.environ.get('CHACOLED_RECORD')
+    if record_file:
+        # Record the events sent to the channel editors (see session.py).
+        session_recorder = SessionRecorder(open(record_file, 'w'))
+        for name in CHANNEL_NAMES:
+            channel = getattr(app.colormap_editor, name + '_channel')
+            session_recorder.attach(channel, name)
+    # Autosave the channels (see journal.py), once the event loop runs, so
+    # that the restore dialog has a parent application.
+    journal = EditJournal(os.environ.get('CHACOLED_JOURNAL', JOURNAL_PATH))
+    GUI.invoke_later(app.start_journal, journal)
     app.configure_traits()
+    journal.close()
+    if record_file:
+        session_recorder.close()
+    if recorder.enabled:
+        print recorder.report()
+        trace_file = os.environ['CHACOLED_INSTRUMENT']
+        if trace_file.endswith('.json'):
+            recorder.dump_trace(trace_file)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,13 @@
 
+from contextlib import contextmanager
+
 import numpy as np
 
 # Enthought library imports
 from enable.api import ComponentEditor
 
 from traits.api import (HasTraits, Instance, Property, Event, Enum, Str,
-        Float, Range, on_trait_change)
+        Float, Range, Int, Any, Bool, List, on_trait_change, cached_property)
 from traitsui.api import Item, VGroup, View
 from traitsui.menu import Action, Menu, MenuBar
 from pyface.action.api import Group as ActionGroup
@@ -16,11 +18,25 @@ from chaco.api import ColorMapper, ColorBar, LinearMapper, DataRange1D
 # Local imports
 from unit_map import UnitMap
 from unit_map_editor import UnitMapEditor, UnitMapPlotter
+from channels import ChannelSet
+from morph import ColormapMorph
+from fitting import fit_lightness
+from inverse import InverseColormap
+from instrument import recorder
 
 
 red_bg = (1.0, 0.8, 0.8)
 green_bg = (0.8, 1.0, 0.8)
 blue_bg = (0.8, 0.8, 1.0)
+alpha_bg = (0.9, 0.9, 0.9)
+
+
+class InstrumentedColorBar(ColorBar):
+    """A ColorBar whose drawing is recorded as the 'colorbar' stage."""
+
+    def _draw(self, gc, view_bounds=None, mode="default"):
+        with recorder.stage('colorbar'):
+            super(InstrumentedColorBar, self)._draw(gc, view_bounds, mode)
 
 
 class ColormapChannel(UnitMap):
@@ -30,18 +46,15 @@ class ColormapChannel(UnitMap):
     """
 
     def _convert_to_segments(self):
-        points = self.points
-        point = points[0]
-        segs = [(point[0], point[1], point[1])]
-        for k in range(1, len(points)):
-            point = points[k]
-            if point[0] == segs[-1][0]:
-                seg = segs.pop()
-                seg = (seg[0], seg[1], point[1])
-            else:
-                seg = (point[0], point[1], point[1])
-            segs.append(seg)
-        return segs
+        return self.segments()
+
+
+class AlphaChannel(ColormapChannel):
+    """A ColormapChannel that is reset to an opaque (y = 1) map."""
+
+    def _points_default(self):
+        points = [(0.0, 1.0), (1.0, 1.0)]
+        return points
 
 
 class ColormapEditor(HasTraits):
@@ -49,8 +62,20 @@ class ColormapEditor(HasTraits):
     red_channel = Instance(UnitMapEditor)
     green_channel = Instance(UnitMapEditor)
     blue_channel = Instance(UnitMapEditor)
+    alpha_channel = Instance(UnitMapEditor)
+
+    # If True, the alpha channel is shown, and is part of the colormap.
+    use_alpha = Bool(False)
+
+    # The editors of the channels that make up the colormap: red, green,
+    # blue and, if use_alpha is True, alpha.
+    channel_editors = Property(List(Instance(UnitMapEditor)),
+                               depends_on=['use_alpha'])
+
+    # The unit maps of the channels in channel_editors.
+    channels = Property(Instance(ChannelSet), depends_on=['use_alpha'])
 
-    show = Enum('all', 'red', 'green', 'blue')
+    show = Enum('all', 'red', 'green', 'blue', 'alpha')
 
     rgb_background = Enum('RGB tint', 'white', 'black')
     rgb_line_color = Enum('black', 'RGB', 'white')
@@ -72,6 +97,14 @@ class ColormapEditor(HasTraits):
 
     updated = Event
 
+    # Nesting depth of `batch()` blocks.
+    _batch_depth = Int(0)
+
+    # The channel editor that most recently fired `updated` inside a
+    # `batch()` block (or this editor, if only use_alpha has changed), or
+    # None if nothing has changed.
+    _batch_source = Any
+
     def trait_view(self, parent=None):
         file_group = ActionGroup(
                         Action(name='Import', action='import_colormap'),
@@ -94,6 +127,11 @@ class ColormapEditor(HasTraits):
                              editor=ComponentEditor(size=(200, 125)),
                              show_label=False,
                              visible_when='show == "all" or show == "blue"'),
+                        Item('alpha_channel',
+                             editor=ComponentEditor(size=(200, 125)),
+                             show_label=False,
+                             visible_when=('use_alpha and (show == "all" or '
+                                           'show == "alpha")')),
                         Item('luminance',
                              editor=ComponentEditor(size=(200, 100)),
                              show_label=False),
@@ -129,6 +167,12 @@ class ColormapEditor(HasTraits):
                             label="Blue")
         return ume
 
+    def _alpha_channel_default(self):
+        um = AlphaChannel()
+        ume = UnitMapEditor(unit_map=um, background_color=alpha_bg,
+                            label="Alpha")
+        return ume
+
     def _luminance_default(self):
         um = UnitMap()
         ump = UnitMapPlotter(unit_map=um, label="Luminance")
@@ -140,7 +184,8 @@ class ColormapEditor(HasTraits):
 
     def _colorbar_default(self):
         # Create the colorbar
-        colorbar = ColorBar(index_mapper=LinearMapper(range=self.color_range),
+        colorbar = InstrumentedColorBar(
+                            index_mapper=LinearMapper(range=self.color_range),
                             color_mapper=self.colormapper,
                             orientation='h',
                             # resizable='v',
@@ -157,11 +202,26 @@ class ColormapEditor(HasTraits):
     #-----------------------------------------------------------------------
 
     def _get_colormapper(self):
-        segment_map = self._segment_map()
-        colormapper = ColorMapper.from_segment_map(segment_map,
-                                                   range=self.color_range)
+        with recorder.stage('colormapper'):
+            segment_map = self._segment_map()
+            colormapper = ColorMapper.from_segment_map(segment_map,
+                                                       range=self.color_range)
         return colormapper
 
+    @cached_property
+    def _get_channel_editors(self):
+        editors = [self.red_channel, self.green_channel, self.blue_channel]
+        if self.use_alpha:
+            editors.append(self.alpha_channel)
+        return editors
+
+    @cached_property
+    def _get_channels(self):
+        editors = self.channel_editors
+        names = ['red', 'green', 'blue', 'alpha'][:len(editors)]
+        return ChannelSet(names=names,
+                          unit_maps=[e.unit_map for e in editors])
+
     def _get_luminance_blue(self):
         blue = 1.0 - (self.luminance_red + self.luminance_green)
         return blue
@@ -171,15 +231,23 @@ class ColormapEditor(HasTraits):
     #-----------------------------------------------------------------------
 
     @on_trait_change('red_channel.updated, green_channel.updated, '
-                     'blue_channel.updated')
+                     'blue_channel.updated, alpha_channel.updated')
     def _update_image(self, obj, name, value):
-        # Update the colorbar.
-        if self.colorbar is not None:
-            self.colorbar.color_mapper = self.colormapper
-            self.colorbar.request_redraw()
-
-        # Update the status text.
-        self.status_text = obj.status_text
+        if self._batch_depth > 0:
+            # The update is made when the batch() block exits.
+            self._batch_source = obj
+            return
+        self._refresh_image(obj.updated_range, obj.status_text)
+
+    def _refresh_image(self, x_range, status_text):
+        with recorder.stage('image'):
+            # Update the colorbar.
+            if self.colorbar is not None:
+                self.colorbar.color_mapper = self.colormapper
+                self._redraw_colorbar(x_range)
+
+            # Update the status text.
+            self.status_text = status_text
 
         # Propagate the updated event.
         self.updated = True
@@ -187,76 +255,168 @@ class ColormapEditor(HasTraits):
     @on_trait_change('red_channel.updated, green_channel.updated, '
                      'blue_channel.updated, luminance_red, luminance_green')
     def _update_luminance(self, obj, name, value):
-        # Update the luminance unit map.
-        red_x = [x for x, y in self.red_channel.unit_map.points]
-        green_x = [x for x, y in self.green_channel.unit_map.points]
-        blue_x = [x for x, y in self.blue_channel.unit_map.points]
-        xvals = sorted(set(red_x) | set(green_x) | set(blue_x))
-        r = np.array([self.red_channel.unit_map.evaluate(x) for x in xvals])
-        g = np.array([self.green_channel.unit_map.evaluate(x) for x in xvals])
-        b = np.array([self.blue_channel.unit_map.evaluate(x) for x in xvals])
-        lum = list(self.luminance_red * r +
-                   self.luminance_green * g +
-                   self.luminance_blue * b)
-        self.luminance.unit_map.points = zip(xvals, lum)
+        if self._batch_depth > 0:
+            return
+        with recorder.stage('luminance'):
+            # Update the luminance unit map, using the values of the
+            # channels on the merged grid of their points.
+            x, values = self.channels.table()
+            lum = (self.luminance_red * values[:, 0] +
+                   self.luminance_green * values[:, 1] +
+                   self.luminance_blue * values[:, 2])
+            self.luminance.unit_map.points = zip(x.tolist(), lum.tolist())
+
+    def _use_alpha_changed(self):
+        if self._batch_depth > 0:
+            # The update is made when the batch() block exits.
+            if self._batch_source is None:
+                self._batch_source = self
+            return
+        self._refresh_image((0.0, 1.0), self.status_text)
 
     def _rgb_background_changed(self):
         if self.rgb_background == 'RGB tint':
             self.red_channel.background_color = red_bg
             self.green_channel.background_color = green_bg
             self.blue_channel.background_color = blue_bg
+            self.alpha_channel.background_color = alpha_bg
         elif self.rgb_background == 'white':
             self.red_channel.background_color = (1, 1, 1)
             self.green_channel.background_color = (1, 1, 1)
             self.blue_channel.background_color = (1, 1, 1)
+            self.alpha_channel.background_color = (1, 1, 1)
         else:
             self.red_channel.background_color = (0, 0, 0)
             self.green_channel.background_color = (0, 0, 0)
             self.blue_channel.background_color = (0, 0, 0)
+            self.alpha_channel.background_color = (0, 0, 0)
 
     def _rgb_line_color_changed(self):
         if self.rgb_line_color == 'RGB':
             self.red_channel.line_color = (1, 0, 0)
             self.green_channel.line_color = (0, 1, 0)
             self.blue_channel.line_color = (0, 0, 1)
+            self.alpha_channel.line_color = (0.5, 0.5, 0.5)
         elif self.rgb_line_color == 'white':
             self.red_channel.line_color = (1, 1, 1)
             self.green_channel.line_color = (1, 1, 1)
             self.blue_channel.line_color = (1, 1, 1)
+            self.alpha_channel.line_color = (1, 1, 1)
         else:
             self.red_channel.line_color = (0, 0, 0)
             self.green_channel.line_color = (0, 0, 0)
             self.blue_channel.line_color = (0, 0, 0)
+            self.alpha_channel.line_color = (0, 0, 0)
 
     def _grid_color_changed(self):
         if self.grid_color == 'black':
             self.red_channel.grid_color = (0, 0, 0)
             self.green_channel.grid_color = (0, 0, 0)
             self.blue_channel.grid_color = (0, 0, 0)
+            self.alpha_channel.grid_color = (0, 0, 0)
         elif self.grid_color == 'white':
             self.red_channel.grid_color = (1, 1, 1)
             self.green_channel.grid_color = (1, 1, 1)
             self.blue_channel.grid_color = (1, 1, 1)
+            self.alpha_channel.grid_color = (1, 1, 1)
 
     #-----------------------------------------------------------------------
     # Public methods
     #-----------------------------------------------------------------------
 
     def reset_arrays(self):
-        self.red_channel.unit_map.reset()
-        self.green_channel.unit_map.reset()
-        self.blue_channel.unit_map.reset()
+        with self.batch():
+            self.red_channel.unit_map.reset()
+            self.green_channel.unit_map.reset()
+            self.blue_channel.unit_map.reset()
+            self.alpha_channel.unit_map.reset()
+
+    def morph(self, other, space='rgb'):
+        """
+        Return a morph.ColormapMorph from this colormap to that of the
+        ColormapEditor `other`.  See morph.py.
+        """
+        return ColormapMorph(self.channels, other.channels, space=space)
+
+    def inverse(self, **kw):
+        """
+        Return an inverse.InverseColormap that maps the colors of this
+        colormap back to values.  See inverse.py.
+        """
+        return InverseColormap([self.red_channel.unit_map,
+                                self.green_channel.unit_map,
+                                self.blue_channel.unit_map], **kw)
+
+    def fit_lightness(self, target=None, space='luminance', **kw):
+        """
+        Change the red, green and blue channels so that the lightness
+        follows `target`, and return the fitting.FitResult.  With
+        space='luminance' the luminance plot is fitted, with the current
+        luminance coefficients.  See fitting.fit_lightness() for the other
+        arguments.
+        """
+        channels = [self.red_channel, self.green_channel, self.blue_channel]
+        result = fit_lightness([c.unit_map for c in channels], target, space,
+                               weights=(self.luminance_red,
+                                        self.luminance_green,
+                                        self.luminance_blue), **kw)
+        with self.batch():
+            for channel, points in zip(channels, result.points):
+                channel.unit_map.points = points
+        return result
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager for changing several channels at once.
+
+        The unit maps of all the channels are changed in `UnitMap.batch()`
+        blocks, and the luminance plot, the colorbar and the `updated` event
+        are updated just once, when the outermost block exits.
+        """
+        unit_maps = [self.red_channel.unit_map,
+                     self.green_channel.unit_map,
+                     self.blue_channel.unit_map,
+                     self.alpha_channel.unit_map]
+        batches = [unit_map.batch() for unit_map in unit_maps]
+        self._batch_depth += 1
+        try:
+            entered = []
+            try:
+                for b in batches:
+                    b.__enter__()
+                    entered.append(b)
+                yield self
+            finally:
+                for b in reversed(entered):
+                    b.__exit__(None, None, None)
+        finally:
+            # The changes made before an exception have been delivered by
+            # the unit maps, so the refresh is made in any case.
+            self._batch_depth -= 1
+            source = self._batch_source
+            if self._batch_depth == 0 and source is not None:
+                self._batch_source = None
+                self._update_luminance(source, 'updated', True)
+                self._refresh_image((0.0, 1.0), source.status_text)
 
     #-----------------------------------------------------------------------
     # Private methods
     #-----------------------------------------------------------------------
 
+    def _redraw_colorbar(self, x_range):
+        """Request a redraw of the part of the colorbar that shows x_range."""
+        colorbar = self.colorbar
+        if tuple(x_range) == (0.0, 1.0):
+            colorbar.request_redraw()
+            return
+        x0, x1 = colorbar.index_mapper.map_screen(np.array(x_range))
+        region = [x0 - 2, colorbar.y, x1 - x0 + 4, colorbar.height]
+        colorbar.invalidate_draw(damaged_regions=[region])
+        colorbar.request_redraw()
+
     def _segment_map(self):
-        red_list = self.red_channel.unit_map._convert_to_segments()
-        green_list = self.green_channel.unit_map._convert_to_segments()
-        blue_list = self.blue_channel.unit_map._convert_to_segments()
-        segment_map = dict(red=red_list, green=green_list, blue=blue_list)
-        return segment_map
+        return self.channels.segment_map()
 
 
 if __name__ == "__main__":
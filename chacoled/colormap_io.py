@@ -0,0 +1,284 @@
+"""
+Functions for reading colormaps from files and writing them to files.
+
+These functions do not depend on the user interface, so they can be used
+by scripts, benchmarks and the analyzer as well as by the ColormapApp
+import and export actions.
+"""
+
+import os
+import struct
+import types
+from os.path import basename, splitext
+
+import numpy as np
+
+from unit_map import segments_to_points, interpolate
+from channels import merged_table
+
+
+# The sizes, types and formats of the lookup tables written by write_lut().
+LUT_MIN_SIZE = 256
+LUT_MAX_SIZE = 65536
+LUT_DTYPES = ['uint8', 'uint16']
+LUT_FORMATS = ['clut', 'npy', 'raw']
+
+# The header of a .clut file: the magic string 'CLUT', the format version,
+# the number of channels (3 or 4), the number of bytes per value (1 or 2),
+# a pad byte and the number of entries, little endian.  The table follows
+# the header as little endian unsigned integers, one row per entry, so it
+# can be read with np.fromfile(path, dtype, offset=LUT_HEADER.size).
+LUT_MAGIC = b'CLUT'
+LUT_VERSION = 1
+LUT_HEADER = struct.Struct('<4sBBBxI')
+
+
+class ColormapFileError(Exception):
+    """
+    An error reading a colormap file.  `title` is a short description, for
+    use as the title of an error dialog.
+    """
+
+    def __init__(self, message, title):
+        Exception.__init__(self, message)
+        self.message = message
+        self.title = title
+
+
+def read_colormap_file(path):
+    """
+    Read a colormap from a Chaco colormap file (.cmap), or from a Python
+    file (.py) written by write_chaco_python().
+
+    Returns a tuple (name, color_mapper).  Raises ColormapFileError if the
+    file can not be read, or does not contain a colormap.
+    """
+    from chaco.api import ColorMapper, DataRange1D
+
+    if path.endswith('.cmap'):
+        # Read the colormap data file.
+        # First read the name from the first line, then use
+        # ColorMap.from_file() to actually load the color map.
+        with open(path, 'r') as f:
+            name = f.readline().strip()
+        color_mapper = ColorMapper.from_file(path)
+        return name, color_mapper
+
+    if path.endswith('.py'):
+        # Look for a function that is a color map factory that was
+        # created by this application; these are functions with the
+        # attribute `_colormap_data`.
+
+        # Get the basename, and chop off '.py'.
+        name = basename(path)[:-3]
+
+        # Try to read the python file.
+        try:
+            f = open(path, 'r')
+        except IOError:
+            raise ColormapFileError('Unable to read "%s"' % path,
+                                    'File Error')
+        # Try to import the script.
+        module = types.ModuleType(str(name))
+        module.__file__ = path
+        try:
+            exec(compile(f.read(), path, 'exec'), module.__dict__)
+        except Exception as e:
+            raise ColormapFileError(
+                'An error occurred while importing "%s".\n\n%s' % (path, e),
+                'Import Error')
+        finally:
+            f.close()
+        for name, obj in module.__dict__.items():
+            if (isinstance(obj, types.FunctionType) and
+                    hasattr(obj, '_colormap_data')):
+                # Found the function.  Call it to create the ColorMapper.
+                return name, obj(range=DataRange1D(low=0, high=1))
+        msg1 = (('A ColorMapper factory function was not found'
+                 ' in "%s".\n\n') % path)
+        msg2 = 'Such a function has the attribute "_colormap_data".'
+        raise ColormapFileError(msg1 + msg2, 'Not found')
+
+    msg = 'The file "%s" has an unknown file extension.\n\n' % path
+    msg = msg + 'Known extensions are:\n'
+    msg = msg + '  .cmap\n        A Chaco-format colormap file\n'
+    msg = msg + '  .py \n        The python file must contain a'
+    msg = msg + ' function that was created by this program.'
+    raise ColormapFileError(msg, 'Unknown file extension')
+
+
+def color_mapper_points(color_mapper):
+    """
+    Return a dictionary of the points of the channels of a ColorMapper,
+    with the keys 'red', 'green', 'blue' and, if the colormap has an alpha
+    channel, 'alpha'.
+    """
+    segs = color_mapper._segmentdata
+    names = ['red', 'green', 'blue']
+    if 'alpha' in segs:
+        names.append('alpha')
+    return dict((name, segments_to_points(segs[name])) for name in names)
+
+
+def write_chaco_file(f, name, unit_maps):
+    """
+    Write a colormap in the Chaco colormap file format.
+
+    `f` is an open file, `name` is the name of the colormap and `unit_maps`
+    is the sequence of the red, green, blue and (optionally) alpha UnitMaps.
+    The file can be read with ColorMapper.from_file().
+    """
+    f.write('%s\n' % name)
+
+    # Small value used to ensure that the offset values (i.e. the `t`
+    # values in the loop below) are strictly increasing.
+    eps = 1e-8
+
+    channels = [(um.points[:], um) for um in unit_maps]
+
+    # Build a list of tuples of the form (t,r,g,b) or (t,r,g,b,a), where t
+    # increases from 0 to 1.  tstar and eps are used to add small
+    # perturbations that convert discontinuities into very steep
+    # segments. (Actually, I'm not sure this is necessary; I don't
+    # know if Chaco handles discontinuities in the file format.)
+    tprev = None
+    while len(channels[0][0]) > 0:
+        t = min(channel[0][0][0] for channel in channels)
+        if tprev and t <= tprev:
+            tstar = tprev + eps
+        else:
+            tstar = t
+        values = [tstar]
+        for k in range(len(channels)):
+            points, um = channels[k]
+            if points[0][0] == t:
+                point = points.pop(0)
+                values.append(point[1])
+            else:
+                value = um.evaluate(tstar)
+                values.append(value)
+        fmt = ' '.join(["%.12f"] * len(values)) + '\n'
+        s = fmt % tuple(values)
+        f.write(s)
+        tprev = tstar
+
+
+def write_chaco_python(f, name, segment_map):
+    """
+    Write a colormap as a Python module that defines a Chaco colormap
+    factory function called `name`.
+
+    `segment_map` is the segment data of the colormap, as returned by
+    ColormapEditor._segment_map().
+    """
+    # The segments are written as lists of tuples.
+    segment_map = dict((key, [tuple(seg) for seg in np.asarray(segs).tolist()])
+                       for key, segs in segment_map.items())
+    # The data is attached to the function as an attribute.  This
+    # will allow a program to import a module, look for functions in
+    # the module that have the _colormap_data attribute and recover
+    # the data without having to call the function.
+    f.write('\n')
+    f.write('from enthought.chaco.api import ColorMapper\n\n')
+    f.write('def %s(range, **traits):\n' % name)
+    f.write('    """Generator for the colormap "%s"."""\n' % name)
+    f.write(('    return ColorMapper.from_segment_map('
+             '%s._colormap_data, range=range, **traits)\n\n') % name)
+    f.write('%s._colormap_data = ' % name)
+    seg_code = '%r' % segment_map
+    seg_code = seg_code.replace("'red'", "\n        'red'")
+    seg_code = seg_code.replace("'green'", "\n        'green'")
+    seg_code = seg_code.replace("'blue'", "\n        'blue'")
+    seg_code = seg_code.replace("'alpha'", "\n        'alpha'")
+    seg_code = seg_code.replace("}", "\n        }")
+    f.write(seg_code)
+
+
+def lut_table(unit_maps, size=256, dtype='uint8'):
+    """
+    Return a lookup table of the channels `unit_maps`: an array with shape
+    (size, len(unit_maps)) of their values at `size` equally spaced x
+    values, scaled to the full range of the unsigned integer `dtype` and
+    rounded.
+    """
+    if not LUT_MIN_SIZE <= size <= LUT_MAX_SIZE:
+        raise ValueError("The size of a lookup table must be between %d "
+                         "and %d, not %d" % (LUT_MIN_SIZE, LUT_MAX_SIZE, size))
+    dtype = np.dtype(dtype)
+    if dtype.name not in LUT_DTYPES:
+        raise ValueError("The type of a lookup table must be one of %s, "
+                         "not %s" % (', '.join(LUT_DTYPES), dtype.name))
+    x, values = merged_table([um.arrays() for um in unit_maps])
+    table = interpolate(x, values, np.linspace(0.0, 1.0, size))
+    scale = np.iinfo(dtype).max
+    np.clip(table, 0.0, 1.0, out=table)
+    return np.rint(table * scale).astype(dtype.newbyteorder('<'))
+
+
+def write_lut(path, unit_maps, size=256, dtype='uint8', format=None):
+    """
+    Write a lookup table of the channels `unit_maps` (see lut_table()).
+
+    `format` is 'raw' (just the table, row by row, little endian), 'npy'
+    (numpy's .npy format, which np.load() can memory map) or 'clut' (the
+    table after a LUT_HEADER).  By default it is given by the extension of
+    `path`: .npy, .clut, or raw for any other.
+
+    The table is written to a temporary file that is renamed to `path`, so
+    an existing file is only replaced by a complete table.
+    """
+    if format is None:
+        format = {'.npy': 'npy', '.clut': 'clut'}.get(
+                        splitext(path)[1].lower(), 'raw')
+    if format not in LUT_FORMATS:
+        raise ValueError("Unknown lookup table format %r" % (format,))
+    table = lut_table(unit_maps, size, dtype)
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            if format == 'npy':
+                np.save(f, table)
+            elif format == 'clut':
+                f.write(LUT_HEADER.pack(LUT_MAGIC, LUT_VERSION,
+                                        table.shape[1], table.dtype.itemsize,
+                                        size))
+                table.tofile(f)
+            else:
+                table.tofile(f)
+        if os.name == 'nt' and os.path.exists(path):
+            # os.rename() does not replace files on Windows.
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_lut(path, mmap_mode=None):
+    """
+    Read a lookup table written by write_lut() in the 'npy' or 'clut'
+    format, optionally memory mapped.  Raises ColormapFileError if the file
+    is not a lookup table.
+    """
+    if path.lower().endswith('.npy'):
+        return np.load(path, mmap_mode=mmap_mode)
+    with open(path, 'rb') as f:
+        header = f.read(LUT_HEADER.size)
+        if len(header) == LUT_HEADER.size:
+            magic, version, channels, itemsize, size = \
+                LUT_HEADER.unpack(header)
+        if (len(header) < LUT_HEADER.size or magic != LUT_MAGIC or
+                version != LUT_VERSION or itemsize not in (1, 2)):
+            raise ColormapFileError('"%s" is not a lookup table' % path,
+                                    'Invalid lookup table')
+        dtype = np.dtype('<u%d' % itemsize)
+        shape = (size, channels)
+        if mmap_mode is not None:
+            return np.memmap(path, dtype=dtype, mode=mmap_mode,
+                             offset=LUT_HEADER.size, shape=shape)
+        table = np.fromfile(f, dtype=dtype, count=size * channels)
+    if table.size != size * channels:
+        raise ColormapFileError('"%s" is truncated' % path,
+                                'Invalid lookup table')
+    return table.reshape(shape)
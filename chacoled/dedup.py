@@ -0,0 +1,303 @@
+"""
+Detection of near-duplicate colormaps in large libraries.
+
+Each colormap is reduced to a signature: its lookup table (see
+ChannelSet.lut()) with `size` entries, quantized to uint16.  Two maps are
+duplicates when the largest difference of any channel at any entry of
+their tables is at most `tol` (on the 0-1 scale).
+
+Comparing every pair is O(n**2), so the signatures are first bucketed
+with locality-sensitive hashing for the L-infinity distance: each of
+`tables` hash tables picks `k` random entries of the signature, shifts
+them by random offsets and quantizes them with a cell width w (4 * tol by
+default); only the entries that vary across the library are picked.
+A pair within tol lands in the same bucket of a table with a
+probability of at least (1 - tol / w)**k, so it is found by some table
+with a probability of at least
+
+    1 - (1 - (1 - tol / w)**k)**tables
+
+(see recall_bound(); about 0.999 with the defaults), while maps that
+differ by more than w in the chosen entries never share a bucket.  The
+pairs that share a bucket are then confirmed with an exact, vectorized
+comparison of their tables, and the confirmed pairs are merged into
+clusters (single linkage: the members of a cluster are connected by
+chains of duplicates).
+
+From the command line, e.g. to find the duplicates among the Chaco
+colormaps and a directory of exports:
+
+    python -m chacoled.dedup --chaco exports/*.cmap --tol 0.01 \\
+        --json clusters.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from unit_map import UnitMap
+from channels import ChannelSet
+
+
+SCALE = np.iinfo(np.uint16).max
+
+# The number of candidate pairs compared at a time.
+CONFIRM_BATCH = 1 << 14
+
+
+def signature(points, size=128, channels=4):
+    """
+    Return the signature of a colormap with the given channel points (a
+    dictionary as returned by colormap_io.color_mapper_points()): a uint16
+    array with shape (size, channels).  A missing alpha channel is opaque.
+    """
+    names = ['red', 'green', 'blue', 'alpha'][:channels]
+    unit_maps = [UnitMap(points=points[name]) if name in points
+                 else UnitMap(points=[(0.0, 1.0), (1.0, 1.0)])
+                 for name in names]
+    lut = ChannelSet(names=names, unit_maps=unit_maps).lut(size)
+    return np.rint(np.clip(lut, 0.0, 1.0) * SCALE).astype(np.uint16)
+
+
+def recall_bound(tol, width, k, tables):
+    """The smallest probability that a pair within tol is a candidate."""
+    p = (1.0 - min(tol / width, 1.0)) ** k
+    return 1.0 - (1.0 - p) ** tables
+
+
+class DedupIndex(object):
+    """Finds the pairs of signatures within a tolerance of each other."""
+
+    def __init__(self, signatures, tol=0.01, tables=64, k=8, width=None,
+                 seed=0):
+        """
+        signatures is an array with shape (n, size, channels) of the
+        signatures of n colormaps (see signature()).
+        """
+        if tol <= 0:
+            raise ValueError("The tolerance must be positive, got %r" % tol)
+        self.signatures = np.asarray(signatures)
+        n = len(self.signatures)
+        self.tol = tol
+        self.width = 4.0 * tol if width is None else width
+        self.k = k
+        self.tables = tables
+        size, channels = self.signatures.shape[1:]
+        self._flat = self.signatures.reshape(n, size * channels)
+        rng = np.random.RandomState(seed)
+        # Entries that are (nearly) the same in all the maps, e.g. an
+        # opaque alpha channel, put every map in the same bucket.
+        if n > 0:
+            spread = self._flat.max(axis=0) - self._flat.min(axis=0)
+            varying = np.flatnonzero(spread > self.width * SCALE)
+        if n == 0 or len(varying) < k:
+            varying = np.arange(self._flat.shape[1])
+        self._coords = [rng.choice(varying, min(k, len(varying)),
+                                   replace=False)
+                        for t in range(tables)]
+        self._offsets = [rng.uniform(0.0, self.width, len(c))
+                         for c in self._coords]
+
+    def recall(self):
+        """See recall_bound()."""
+        return recall_bound(self.tol, self.width, self.k, self.tables)
+
+    def candidates(self):
+        """
+        Return the pairs of indices that share a bucket of some hash table,
+        as two arrays (i, j) with i < j, without repetitions.
+        """
+        n = len(self._flat)
+        codes = np.zeros(0, dtype=np.int64)
+        for coords, offsets in zip(self._coords, self._offsets):
+            values = self._flat[:, coords] / float(SCALE)
+            cells = np.floor((values + offsets) / self.width).astype(np.int64)
+            # Combine the cells into one key; collisions only add
+            # candidates, which the confirmation removes.
+            multipliers = 1000003 ** np.arange(len(coords), dtype=np.int64)
+            keys = cells.dot(multipliers)
+            i, j = _bucket_pairs(keys)
+            codes = np.union1d(codes, np.minimum(i, j) * n + np.maximum(i, j))
+        return codes // n, codes % n
+
+    def confirm(self, i, j):
+        """
+        Return the subset of the pairs (i, j) whose largest difference is
+        at most tol, and those differences, as (i, j, deviation).
+        """
+        limit = int(np.floor(self.tol * SCALE + 0.5))
+        keep = []
+        deviations = []
+        for start in range(0, len(i), CONFIRM_BATCH):
+            a = self._flat[i[start:start + CONFIRM_BATCH]].astype(np.int32)
+            b = self._flat[j[start:start + CONFIRM_BATCH]]
+            d = np.abs(a - b).max(axis=1)
+            ok = np.flatnonzero(d <= limit)
+            keep.append(start + ok)
+            deviations.append(d[ok])
+        if not keep:
+            return i, j, np.zeros(0)
+        keep = np.concatenate(keep)
+        deviations = np.concatenate(deviations) / float(SCALE)
+        return i[keep], j[keep], deviations
+
+    def duplicates(self):
+        """Return the confirmed pairs, as (i, j, deviation)."""
+        return self.confirm(*self.candidates())
+
+    def clusters(self):
+        """
+        Return the clusters of duplicates, as a list of (members,
+        deviation), where members is a sorted list of indices and deviation
+        the largest difference of the confirmed pairs in the cluster.
+        """
+        i, j, deviations = self.duplicates()
+        parent = {}
+
+        def find(a):
+            root = a
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while a != root:
+                parent[a], a = root, parent.get(a, a)
+            return root
+
+        for a, b in zip(i.tolist(), j.tolist()):
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+        members = {}
+        worst = {}
+        for a, b, d in zip(i.tolist(), j.tolist(), deviations.tolist()):
+            root = find(a)
+            members.setdefault(root, set()).update((a, b))
+            worst[root] = max(worst.get(root, 0.0), d)
+        return sorted(((sorted(m), worst[root])
+                       for root, m in members.items()),
+                      key=lambda c: (-len(c[0]), c[0][0]))
+
+
+def _bucket_pairs(keys):
+    """Return all the pairs of indices (i, j) with equal keys."""
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    n = len(keys)
+    if n < 2:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    # The start and the size of the group of each sorted position.
+    new = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    group = np.cumsum(new) - 1
+    starts = np.flatnonzero(new)
+    sizes = np.diff(np.r_[starts, n])
+    end = (starts + sizes)[group]
+    i = []
+    j = []
+    # Pair each position with the positions d further in its group, while
+    # any group is larger than d; the work is proportional to the number
+    # of pairs.
+    active = np.flatnonzero(sizes[group] > 1)
+    d = 1
+    while len(active) > 0:
+        active = active[active + d < end[active]]
+        i.append(order[active])
+        j.append(order[active + d])
+        d += 1
+    return np.concatenate(i), np.concatenate(j)
+
+
+#---------------------------------------------------------------------
+# Libraries of colormap files.
+#---------------------------------------------------------------------
+
+def signature_source(args):
+    """Load a source and compute its signature.  Runs in the workers."""
+    from analysis import load_source
+    source, size = args
+    try:
+        name, points = load_source(source)
+        return source, name, signature(points, size), None
+    except Exception as e:
+        # A broken file must not stop the processing of the library.
+        return source, source[1], None, str(e)
+
+
+def load_signatures(sources, size=128, processes=None, chunksize=64):
+    """
+    Compute the signatures of the sources (see analysis.load_source()) in
+    a process pool.  Returns (names, sources, signatures, errors), where
+    errors is a list of (source, message).
+    """
+    tasks = [(source, size) for source in sources]
+    if processes == 1:
+        results = [signature_source(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = list(pool.imap(signature_source, tasks, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    ok = [r for r in results if r[3] is None]
+    errors = [(r[0], r[3]) for r in results if r[3] is not None]
+    signatures = np.array([r[2] for r in ok]).reshape(len(ok), size, 4)
+    return [r[1] for r in ok], [r[0] for r in ok], signatures, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+                description="Find near-duplicate colormaps.")
+    parser.add_argument('files', nargs='*',
+                        help='.cmap or .py colormap files')
+    parser.add_argument('--chaco', action='store_true',
+                        help="include Chaco's colormaps")
+    parser.add_argument('--tol', type=float, default=0.01,
+                        help='the largest difference of the channels of '
+                             'duplicates, from 0 to 1 (default: 0.01)')
+    parser.add_argument('--size', type=int, default=128,
+                        help='the number of entries of the signatures')
+    parser.add_argument('--tables', type=int, default=64,
+                        help='the number of hash tables')
+    parser.add_argument('-k', type=int, default=8,
+                        help='the number of entries hashed by each table')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--json', metavar='FILE')
+    args = parser.parse_args(argv)
+
+    sources = [('file', os.path.abspath(path)) for path in args.files]
+    if args.chaco:
+        from chaco.default_colormaps import color_map_name_dict
+        sources.extend(('chaco', name)
+                       for name in sorted(color_map_name_dict))
+    names, sources, signatures, errors = load_signatures(
+                        sources, args.size, args.processes)
+    for source, message in errors:
+        print('%s:%s: %s' % (source + (message,)), file=sys.stderr)
+    if not names:
+        print('No colormaps were loaded.', file=sys.stderr)
+        return 1
+    index = DedupIndex(signatures, args.tol, args.tables, args.k)
+    clusters = [dict(names=[names[m] for m in members],
+                     sources=['%s:%s' % sources[m] for m in members],
+                     deviation=deviation)
+                for members, deviation in index.clusters()]
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(tol=args.tol, recall=index.recall(),
+                           clusters=clusters), f, indent=1)
+    else:
+        for cluster in clusters:
+            print('%.4f  %s' % (cluster['deviation'],
+                                ', '.join(cluster['names'])))
+        print('%d clusters of %d maps (recall >= %.3f)' %
+              (len(clusters), len(names), index.recall()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
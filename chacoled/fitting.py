@@ -0,0 +1,271 @@
+"""
+Fitting the red, green and blue channels of a colormap to a target
+lightness profile.
+
+fit_lightness() adjusts the y values of the points of the channels (the x
+values are not changed) to minimize
+
+    mean((L(x_s) - target(x_s))**2) + stiffness * mean((y - y_orig)**2)
+
+over sample values x_s, subject to 0 <= y <= 1.  L is either the
+luminance that ColormapEditor plots (a weighted sum of the channels) or
+CIE L* / 100.  The stiffness term keeps the solution close to the original
+colors, since many colormaps have the same lightness.
+
+Every channel is linear between its points, so its values at the samples
+are a fixed sparse linear function of its y values.  The weights are
+computed once, and the objective and its gradient are evaluated with a
+few array operations.  The minimization is an accelerated projected
+gradient method (FISTA with backtracking), so scipy is not needed.
+
+Optionally, points are inserted where the error remains large (e.g. where
+the channels are too coarse to follow the target), and the fit is
+repeated.
+"""
+
+import numpy as np
+
+from unit_map import interpolation_weights
+
+
+# The coefficients of the linear sRGB values in the relative luminance Y.
+_Y_COEFFS = np.array([0.2126, 0.7152, 0.0722])
+
+_DELTA = 6.0 / 29.0
+
+# The largest number of iterations of the fits after an insertion, which
+# start from the previous solution.
+REFIT_ITER = 100
+
+
+def _decode(v, derivative=True):
+    """
+    Return the linear values of the sRGB values v (as
+    srgb_curve(inverse=True) does) and, if derivative is True, their
+    derivatives; the power is only computed once.
+    """
+    linear = v <= 0.04045
+    a = (np.maximum(v, 0.04045) + 0.055) / 1.055
+    p = a ** 1.4
+    lin = np.where(linear, v / 12.92, p * a)
+    if not derivative:
+        return lin, None
+    return lin, np.where(linear, 1 / 12.92, (2.4 / 1.055) * p)
+
+
+class FitResult(object):
+    """The result of fit_lightness()."""
+
+    def __init__(self, points, rms, max_error, iterations, inserted):
+        # The new points of the channels, as lists of (x, y) tuples.
+        self.points = points
+        # The RMS and the maximum of the deviation from the target at the
+        # samples.
+        self.rms = rms
+        self.max_error = max_error
+        # The total number of iterations, and the number of x values at
+        # which points were inserted (in one or more of the channels).
+        self.iterations = iterations
+        self.inserted = inserted
+
+    def __repr__(self):
+        return ("FitResult(rms=%g, max_error=%g, iterations=%d, "
+                "inserted=%d)" % (self.rms, self.max_error, self.iterations,
+                                  self.inserted))
+
+
+class _Problem(object):
+    """The objective function of a fit, for fixed x values."""
+
+    def __init__(self, xs, ys, samples, target, space, weights, stiffness):
+        self.space = space
+        self.weights = np.asarray(weights, dtype=float)
+        self.stiffness = stiffness
+        self.target = target
+        self.sizes = [len(x) for x in xs]
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes)))
+        self.y0 = np.concatenate(ys)
+        self.samples = samples
+        # The indices and weights of the two points that each sample
+        # depends on, in each channel, as indices into the vector of all
+        # the y values.
+        # Arrays with shape (3, S).
+        lo = []
+        hi = []
+        t = []
+        for x, offset in zip(xs, self.offsets):
+            k, tk = interpolation_weights(x, samples)
+            lo.append(k - 1 + offset)
+            hi.append(k + offset)
+            t.append(tk)
+        self.lo = np.array(lo)
+        self.hi = np.array(hi)
+        self.t = np.array(t)
+        self.s = 1.0 - self.t
+        # The indices of the gradient terms of all the channels.
+        self.index = np.concatenate((self.lo.ravel(), self.hi.ravel()))
+
+    def channel_values(self, y):
+        """The values of the channels at the samples, shape (3, S)."""
+        return self.s * y[self.lo] + self.t * y[self.hi]
+
+    def lightness(self, v, derivative=True):
+        """Return the lightness at the samples, and (if derivative is True)
+        its derivatives with respect to the channel values."""
+        if self.space == 'luminance':
+            lightness = np.dot(self.weights, v)
+            dv = np.repeat(self.weights[:, None], v.shape[1], axis=1)
+        else:
+            lin, dlin = _decode(v, derivative)
+            y = np.dot(_Y_COEFFS, lin)
+            cube = y > _DELTA ** 3
+            root = np.cbrt(y)
+            f = np.where(cube, root, y / (3 * _DELTA ** 2) + 4.0 / 29)
+            lightness = 1.16 * f - 0.16
+            dv = None
+            if derivative:
+                # The derivative of y**(1/3) is y**(1/3) / (3 * y).
+                df = np.where(cube, root / (3 * np.maximum(y, 1e-12)),
+                              1.0 / (3 * _DELTA ** 2))
+                dv = (1.16 * df) * _Y_COEFFS[:, None] * dlin
+        return lightness, dv
+
+    def residuals(self, y):
+        v = self.channel_values(y)
+        return self.lightness(v, derivative=False)[0] - self.target
+
+    def value(self, y):
+        r = self.residuals(y)
+        d = y - self.y0
+        return np.mean(r ** 2) + self.stiffness * np.mean(d ** 2)
+
+    def value_and_gradient(self, y):
+        lightness, dv = self.lightness(self.channel_values(y))
+        r = lightness - self.target
+        d = y - self.y0
+        value = np.mean(r ** 2) + self.stiffness * np.mean(d ** 2)
+        g = (2.0 / len(r)) * r * dv
+        n = len(y)
+        grad = 2.0 * self.stiffness * d / n
+        grad += np.bincount(self.index,
+                            np.concatenate(((g * self.s).ravel(),
+                                            (g * self.t).ravel())),
+                            minlength=n)
+        return value, grad
+
+    def split(self, y):
+        return [y[a:b] for a, b in zip(self.offsets[:-1], self.offsets[1:])]
+
+
+def _minimize(problem, y, max_iter, ftol, lipschitz=1.0):
+    """
+    Minimize problem.value over the unit box, starting at y, with an
+    initial estimate of the Lipschitz constant of the gradient.  Returns
+    the solution, the number of iterations and the final estimate.
+    """
+    z = y.copy()
+    s = 1.0
+    f_prev = np.inf
+    for iteration in range(1, max_iter + 1):
+        f_z, g_z = problem.value_and_gradient(z)
+        while True:
+            y_new = np.clip(z - g_z / lipschitz, 0.0, 1.0)
+            d = y_new - z
+            f_new = problem.value(y_new)
+            if f_new <= f_z + np.dot(g_z, d) + 0.5 * lipschitz * np.dot(d, d):
+                break
+            lipschitz *= 2.0
+        s_new = 0.5 * (1.0 + np.sqrt(1.0 + 4.0 * s * s))
+        z = y_new + ((s - 1.0) / s_new) * (y_new - y)
+        if f_new > f_prev:
+            # Restart the momentum when the objective increases.
+            z = y_new
+            s_new = 1.0
+        y = y_new
+        s = s_new
+        if abs(f_prev - f_new) <= ftol * max(f_new, 1e-12):
+            break
+        f_prev = f_new
+        lipschitz *= 0.95
+    return y, iteration, lipschitz
+
+
+def fit_lightness(unit_maps, target=None, space='luminance',
+                  weights=(0.3, 0.59, 0.11), stiffness=1e-3, samples=512,
+                  insert=0, tol=1e-3, max_iter=1000, ftol=1e-9):
+    """
+    Fit the red, green and blue UnitMaps `unit_maps` to a lightness
+    profile, and return a FitResult.  The unit maps are not changed.
+
+    target is a function that maps an array of x values to the target
+    lightness (luminance, or L* / 100), e.g. a UnitMap's evaluate_array;
+    the default is the straight line between the current lightness at
+    x = 0 and x = 1.  space is 'luminance', for the weighted sum of the
+    channels with the given weights, or 'lab' for CIE L*.
+
+    The fit is evaluated at `samples` equally spaced x values and at the
+    points of the channels.  If insert is positive, points are added to the
+    channels at up to `insert` x values while the maximum error exceeds
+    tol: at the x with the largest error among those that are not points
+    of every channel, and then the fit is repeated (for at most
+    REFIT_ITER iterations, from the previous solution).  The insertion
+    stops when the error exceeds tol only at points of every channel.
+    """
+    if space not in ('luminance', 'lab'):
+        raise ValueError("space must be 'luminance' or 'lab', not %r" %
+                         (space,))
+    arrays = [um.arrays() for um in unit_maps]
+    xs = [x for x, y in arrays]
+    ys = [y for x, y in arrays]
+    y_orig = [y.copy() for y in ys]
+    if target is None:
+        problem = _Problem(xs, ys, np.array([0.0, 1.0]), 0.0, space,
+                           weights, stiffness)
+        ends = problem.lightness(problem.channel_values(problem.y0))[0]
+
+        def target(x):
+            return ends[0] + (ends[1] - ends[0]) * np.asarray(x)
+
+    iterations = 0
+    inserted = 0
+    lipschitz = 1.0
+    fit_iter = max_iter
+    while True:
+        sample_x = np.unique(np.concatenate(
+                        [np.linspace(0.0, 1.0, samples)] + xs))
+        problem = _Problem(xs, y_orig, sample_x, target(sample_x), space,
+                           weights, stiffness)
+        y, n, lipschitz = _minimize(problem, np.concatenate(ys), fit_iter,
+                                    ftol, lipschitz)
+        iterations += n
+        ys = problem.split(y)
+        r = problem.residuals(y)
+        if inserted >= insert or np.abs(r).max() <= tol:
+            break
+        # A point can not be added where every channel already has one.
+        shared = np.ones(len(sample_x), dtype=bool)
+        for x in xs:
+            shared &= np.in1d(sample_x, x)
+        error = np.where(shared, 0.0, np.abs(r))
+        worst = np.argmax(error)
+        if error[worst] <= tol:
+            break
+        # Add a point at the x of the largest error in every channel that
+        # does not already have one there, and fit again.  The stiffness
+        # of the new points is relative to their interpolated values.
+        x_new = sample_x[worst]
+        for c in range(len(xs)):
+            if x_new in xs[c]:
+                continue
+            k = np.searchsorted(xs[c], x_new)
+            y_new = np.interp(x_new, xs[c], ys[c])
+            y0_new = np.interp(x_new, xs[c], y_orig[c])
+            xs[c] = np.insert(xs[c], k, x_new)
+            ys[c] = np.insert(ys[c], k, y_new)
+            y_orig[c] = np.insert(y_orig[c], k, y0_new)
+        inserted += 1
+        fit_iter = min(max_iter, REFIT_ITER)
+
+    points = [list(zip(x.tolist(), y.tolist())) for x, y in zip(xs, ys)]
+    return FitResult(points, float(np.sqrt(np.mean(r ** 2))),
+                     float(np.abs(r).max()), iterations, inserted)
@@ -0,0 +1,271 @@
+"""
+Extracting a colormap from an image of a gradient, or from a palette file.
+
+The image is read as an array without converting it to floating point:
+.npy files are memory mapped, and other image files are read with PIL (if
+it is installed).  The colors are taken along a path through the image,
+either
+
+    * the average of the rows or columns of a rectangular region (by
+      default, the whole image), along its longer side, or
+    * a single row or column, or
+    * a polyline through the image, sampled with bilinear interpolation.
+
+Regions are averaged a chunk of rows at a time, so that a large image is
+never held in memory as floats.  The colors are then simplified, channel by
+channel, with unit_map.simplify(), to points that are within a tolerance of
+the sampled values and can be loaded into a ColormapEditor.
+
+A palette file is a text file with one color per line, as three or four
+numbers (0-1 or 0-255), e.g. as exported by other plotting packages.
+
+From the command line, to convert an image to a Chaco colormap file:
+
+    python -m chacoled.image_import strip.png --row 10 -o strip.cmap
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from unit_map import simplify
+from colormap_io import ColormapFileError
+
+
+CHANNEL_NAMES = ['red', 'green', 'blue', 'alpha']
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff']
+PALETTE_EXTENSIONS = ['.txt', '.csv', '.rgb']
+
+# The default tolerance of the simplification: two levels of an 8 bit
+# image, so that quantization and compression noise do not add points.
+TOL = 2.0 / 255
+
+# The number of rows of a region that are converted to floats at a time.
+CHUNK_ROWS = 256
+
+
+def read_image(path):
+    """
+    Read an image as an array with shape (height, width, channels), where
+    channels is 3 (RGB) or 4 (RGBA).  .npy files are memory mapped, and
+    the dtype of the file is kept.  Raises ColormapFileError if the file
+    can not be read.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        try:
+            image = np.load(path, mmap_mode='r')
+        except (IOError, ValueError) as e:
+            raise ColormapFileError('Unable to read "%s": %s' % (path, e),
+                                    'Error reading array')
+    else:
+        try:
+            from PIL import Image
+        except ImportError:
+            raise ColormapFileError('Reading %s files requires PIL' % ext,
+                                    'Missing package')
+        try:
+            img = Image.open(path)
+            if img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+            image = np.asarray(img)
+        except IOError as e:
+            raise ColormapFileError('Unable to read "%s": %s' % (path, e),
+                                    'Error reading image')
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    if image.ndim != 3 or image.shape[2] not in (1, 3, 4):
+        raise ColormapFileError('"%s" is not an RGB or RGBA image (shape %r)'
+                                % (path, image.shape), 'Unsupported image')
+    return image
+
+
+def read_palette(path):
+    """
+    Read a palette file, and return the colors as an array with shape
+    (n, 3) or (n, 4) of values between 0 and 1.
+    """
+    delimiter = ',' if path.endswith('.csv') else None
+    try:
+        values = np.loadtxt(path, delimiter=delimiter, ndmin=2)
+    except (IOError, ValueError) as e:
+        raise ColormapFileError('Unable to read "%s": %s' % (path, e),
+                                'Error reading palette')
+    if values.shape[1] not in (3, 4) or len(values) < 2:
+        raise ColormapFileError('"%s" must have 3 or 4 columns and at least '
+                                'two rows' % path, 'Unsupported palette')
+    if values.max() > 1.0:
+        values = values / 255.0
+    return values
+
+
+def _scale(image):
+    """The factor that converts the values of image to [0, 1]."""
+    if image.dtype.kind in 'ui':
+        return 1.0 / np.iinfo(image.dtype).max
+    return 1.0
+
+
+def _expand(colors):
+    """Convert grayscale colors, shape (n, 1), to RGB."""
+    if colors.shape[1] == 1:
+        colors = np.repeat(colors, 3, axis=1)
+    return colors
+
+
+def region_profile(image, box=None, axis=None, chunk_rows=CHUNK_ROWS):
+    """
+    Return the colors of the region box = (x0, y0, x1, y1) of image (by
+    default, the whole image), averaged over its rows (axis=0) or its
+    columns (axis=1).  The default axis averages over the shorter side.
+    Returns an array with shape (n, channels) of values between 0 and 1.
+    """
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = box if box is not None else (0, 0, width, height)
+    if not (0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height):
+        raise ValueError("The box %r is not inside the image." % (box,))
+    if axis is None:
+        axis = 0 if x1 - x0 >= y1 - y0 else 1
+    total = None
+    for start in range(y0, y1, chunk_rows):
+        chunk = image[start:min(start + chunk_rows, y1), x0:x1]
+        s = chunk.sum(axis=axis, dtype=np.float64)
+        if axis == 0:
+            total = s if total is None else total + s
+        elif total is None:
+            total = s
+        else:
+            total = np.concatenate((total, s))
+    count = (y1 - y0) if axis == 0 else (x1 - x0)
+    return _expand(total * (_scale(image) / count))
+
+
+def path_profile(image, path, samples=None):
+    """
+    Return the colors of image at `samples` equally spaced points along
+    path, a sequence of (x, y) pixel coordinates, using bilinear
+    interpolation.  The default number of samples is about one per pixel
+    of the path length.  Only the pixels next to the path are read.
+    """
+    path = np.asarray(path, dtype=float)
+    if path.ndim != 2 or path.shape[1] != 2 or len(path) < 2:
+        raise ValueError("path must be a sequence of at least two (x, y) "
+                         "points.")
+    lengths = np.sqrt((np.diff(path, axis=0) ** 2).sum(axis=1))
+    s = np.concatenate(([0.0], np.cumsum(lengths)))
+    if s[-1] == 0:
+        raise ValueError("The path has zero length.")
+    if samples is None:
+        samples = max(int(round(s[-1])) + 1, 2)
+    t = np.linspace(0.0, s[-1], samples)
+    x = np.interp(t, s, path[:, 0])
+    y = np.interp(t, s, path[:, 1])
+    height, width = image.shape[:2]
+    x = np.clip(x, 0, width - 1)
+    y = np.clip(y, 0, height - 1)
+    i = np.clip(np.floor(y).astype(int), 0, max(height - 2, 0))
+    j = np.clip(np.floor(x).astype(int), 0, max(width - 2, 0))
+    i1 = np.minimum(i + 1, height - 1)
+    j1 = np.minimum(j + 1, width - 1)
+    fy = (y - i)[:, np.newaxis]
+    fx = (x - j)[:, np.newaxis]
+    top = (1 - fx) * image[i, j] + fx * image[i, j1]
+    bottom = (1 - fx) * image[i1, j] + fx * image[i1, j1]
+    return _expand(((1 - fy) * top + fy * bottom) * _scale(image))
+
+
+def profile_points(colors, tol=TOL):
+    """
+    Simplify the colors sampled at equally spaced x values, an array with
+    shape (n, 3) or (n, 4), to a dictionary of the points of the channels,
+    in the format of colormap_io.color_mapper_points().  The points of each
+    channel are within tol of its sampled values.
+    """
+    colors = np.clip(np.asarray(colors, dtype=float), 0.0, 1.0)
+    x = np.linspace(0.0, 1.0, len(colors))
+    points = {}
+    for k in range(colors.shape[1]):
+        y = colors[:, k]
+        keep = simplify(x, y, tol)
+        points[CHANNEL_NAMES[k]] = list(zip(x[keep].tolist(),
+                                            y[keep].tolist()))
+    if 'alpha' in points and all(y == 1.0 for x, y in points['alpha']):
+        # Drop an alpha channel that is opaque everywhere.
+        del points['alpha']
+    return points
+
+
+def read_image_colormap(path, tol=TOL, box=None, axis=None, row=None,
+                        column=None, line=None, samples=None, reverse=False):
+    """
+    Read a colormap from an image or palette file, and return a tuple
+    (name, points), where points is a dictionary as returned by
+    colormap_io.color_mapper_points().
+
+    For an image, the colors are taken from the given row or column, or
+    along the polyline `line` (see path_profile()), or else are averaged
+    over the region `box` (see region_profile()).  If reverse is True, the
+    colormap goes from the end of the path to the start.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    if os.path.splitext(path)[1].lower() in PALETTE_EXTENSIONS:
+        colors = read_palette(path)
+    else:
+        image = read_image(path)
+        height, width = image.shape[:2]
+        if row is not None:
+            colors = region_profile(image, (0, row, width, row + 1), axis=0)
+        elif column is not None:
+            colors = region_profile(image, (column, 0, column + 1, height),
+                                    axis=1)
+        elif line is not None:
+            colors = path_profile(image, line, samples)
+        else:
+            colors = region_profile(image, box, axis)
+    if reverse:
+        colors = colors[::-1]
+    return name, profile_points(colors, tol)
+
+
+def main(argv=None):
+    from unit_map import UnitMap
+    from colormap_io import write_chaco_file
+
+    parser = argparse.ArgumentParser(
+                description="Extract a colormap from an image or palette.")
+    parser.add_argument('path', help='an image, .npy or palette file')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='the Chaco colormap file to write (default: '
+                             'standard output)')
+    parser.add_argument('--tol', type=float, default=TOL)
+    parser.add_argument('--row', type=int)
+    parser.add_argument('--column', type=int)
+    parser.add_argument('--box', type=int, nargs=4,
+                        metavar=('X0', 'Y0', 'X1', 'Y1'))
+    parser.add_argument('--reverse', action='store_true')
+    args = parser.parse_args(argv)
+
+    try:
+        name, points = read_image_colormap(args.path, args.tol, box=args.box,
+                                           row=args.row, column=args.column,
+                                           reverse=args.reverse)
+    except ColormapFileError as e:
+        print(e.message, file=sys.stderr)
+        return 1
+    unit_maps = [UnitMap(points=points[channel])
+                 for channel in CHANNEL_NAMES if channel in points]
+    if args.output:
+        with open(args.output, 'w') as f:
+            write_chaco_file(f, name, unit_maps)
+    else:
+        write_chaco_file(sys.stdout, name, unit_maps)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+Opt-in instrumentation of the update chain.
+
+When a point is changed, the work done to update the display is spread
+over several stages: UnitMapPlotter.data_changed, the colorbar and
+colormapper updates in ColormapEditor, the luminance plot and the kiva
+drawing.  The code of each stage is wrapped in
+
+    with recorder.stage('name'):
+        ...
+
+When `recorder.enabled` is False (the default) this costs one attribute
+lookup and a method call.  When it is True, the wall time and the number of
+calls of each stage are recorded, and, if the recorder was started with
+trace_allocations=True, the net change of memory: the memory allocated by
+Python objects, traced by tracemalloc, on Python 3, and the change of the
+resident set size of the process on Python 2 (which also counts the memory
+of C libraries, but not memory freed and reused inside the stage; not
+available on Windows, where no memory deltas are recorded).  Stages
+may nest, and their times include the nested stages ('image' includes
+'colormapper'), but the `updated` events that pass a change on to the next
+stage are fired outside of the stages.  The 'colorbar' stage is the
+drawing of the colorbar, which happens when the window is repainted.
+
+The recorder keeps the most recent durations of each stage to compute
+rolling percentiles, and a bounded list of events that can be written as a
+Chrome trace-event file (load it in chrome://tracing or Perfetto).
+
+Set the environment variable CHACOLED_INSTRUMENT to enable the recorder
+when the application starts; if its value ends with '.json', the trace is
+written to that file when the application exits.  Set
+CHACOLED_INSTRUMENT_MEMORY as well to record the memory deltas.
+"""
+
+from __future__ import with_statement
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: the memory deltas are changes of the resident set size.
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    # Windows: without tracemalloc, the memory deltas are not recorded.
+    resource = None
+
+
+def resident_memory():
+    """
+    Return the resident set size of the process, in bytes.  Where it is not
+    available (outside of Linux), the peak resident set size is returned.
+    Requires the resource module (not available on Windows).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else 1024 * rss
+
+
+def _traced_memory():
+    return tracemalloc.get_traced_memory()[0]
+
+
+class StageStats(object):
+    """The statistics of one stage."""
+
+    def __init__(self, name, window):
+        self.name = name
+        self.count = 0
+        self.total_time = 0.0
+        self.total_alloc = 0
+        # The most recent durations, in seconds.
+        self.recent = deque(maxlen=window)
+
+    def percentiles(self, q=(50, 90, 99)):
+        """Return the percentiles q of the recent durations, in seconds."""
+        if not self.recent:
+            return [0.0] * len(q)
+        return list(np.percentile(np.array(self.recent), q))
+
+
+class _Stage(object):
+
+    __slots__ = ('recorder', 'name', 'start', 'alloc')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        memory = self.recorder.memory
+        self.alloc = memory() if memory is not None else None
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.time()
+        alloc = None
+        memory = self.recorder.memory
+        if self.alloc is not None and memory is not None:
+            alloc = memory() - self.alloc
+        self.recorder.record(self.name, self.start, end - self.start, alloc)
+        return False
+
+
+class _NullStage(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class Recorder(object):
+    """Collects the timings of the stages of the update chain."""
+
+    def __init__(self, window=200, max_events=100000):
+        self.enabled = False
+        # The function that measures the memory for the deltas of the
+        # stages, or None when they are not recorded.
+        self.memory = None
+        # Number of recent durations used for the percentiles.
+        self.window = window
+        # Maximum number of events kept for the trace file; the oldest
+        # events are dropped first.
+        self.max_events = max_events
+        self.reset()
+
+    def reset(self):
+        """Discard all recorded data."""
+        self.stats = {}
+        self.events = deque(maxlen=self.max_events)
+        self._origin = time.time()
+
+    def start(self, trace_allocations=False):
+        """
+        Start recording.  If trace_allocations is True, the memory deltas
+        of the stages are recorded too: with tracemalloc where it is
+        available (this slows down the program considerably), and with
+        resident_memory() otherwise, except on Python 2 on Windows, where
+        neither is available and the memory deltas are not recorded.
+        """
+        if trace_allocations:
+            if tracemalloc is not None:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                self.memory = _traced_memory
+            elif resource is not None:
+                self.memory = resident_memory
+        self.enabled = True
+
+    def stop(self):
+        """Stop recording.  The recorded data is kept."""
+        self.enabled = False
+        self.memory = None
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def stage(self, name):
+        """Return a context manager that records the stage `name`."""
+        if not self.enabled:
+            return _null_stage
+        return _Stage(self, name)
+
+    def record(self, name, start, duration, alloc=None):
+        """Record one call of the stage `name`."""
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = StageStats(name, self.window)
+        stats.count += 1
+        stats.total_time += duration
+        stats.recent.append(duration)
+        if alloc is not None:
+            stats.total_alloc += alloc
+        self.events.append((name, start, duration, alloc,
+                            threading.current_thread().ident))
+
+    def summary(self):
+        """
+        Return a one-line summary of the median and 99th percentile times
+        of the stages, in milliseconds, e.g. "draw 1.2/3.4 ms".
+        """
+        parts = []
+        for name in sorted(self.stats):
+            p50, p99 = self.stats[name].percentiles((50, 99))
+            parts.append("%s %.1f/%.1f" % (name, 1e3 * p50, 1e3 * p99))
+        if not parts:
+            return ''
+        return "  ".join(parts) + " ms (p50/p99)"
+
+    def report(self):
+        """Return a multi-line table of the statistics of the stages."""
+        lines = ["%-20s %8s %10s %9s %9s %9s %12s" %
+                 ('stage', 'calls', 'total ms', 'p50 ms', 'p90 ms',
+                  'p99 ms', 'alloc kB')]
+        for name in sorted(self.stats):
+            stats = self.stats[name]
+            p50, p90, p99 = stats.percentiles()
+            lines.append("%-20s %8d %10.1f %9.2f %9.2f %9.2f %12.1f" %
+                         (name, stats.count, 1e3 * stats.total_time,
+                          1e3 * p50, 1e3 * p90, 1e3 * p99,
+                          stats.total_alloc / 1e3))
+        return "\n".join(lines)
+
+    def trace_events(self):
+        """Return the recorded events in the Chrome trace-event format."""
+        pid = os.getpid()
+        events = []
+        for name, start, duration, alloc, tid in self.events:
+            event = dict(name=name, cat='chacoled', ph='X', pid=pid, tid=tid,
+                         ts=1e6 * (start - self._origin), dur=1e6 * duration)
+            if alloc is not None:
+                event['args'] = dict(alloc=alloc)
+            events.append(event)
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def dump_trace(self, filename):
+        """Write the recorded events to a Chrome trace-event file."""
+        with open(filename, 'w') as f:
+            json.dump(self.trace_events(), f)
+
+
+# The recorder used by chacoled.
+recorder = Recorder()
+
+if os.environ.get('CHACOLED_INSTRUMENT'):
+    recorder.start(bool(os.environ.get('CHACOLED_INSTRUMENT_MEMORY')))
@@ -0,0 +1,464 @@
+"""
+Inverse colormap lookup: recovering the scalar values of colormapped
+images.
+
+An InverseColormap is built from the red, green and blue UnitMaps of a
+colormap (e.g. editor.channels.unit_maps[:3] of a ColormapEditor).  The
+colormap is piecewise linear on the merged grid of the breakpoints of its
+channels (see channels.merged_table()), so the colors it produces form a
+polyline in the RGB cube, and the value of a color is found exactly by
+projecting it onto the nearest segment of the polyline.
+
+To avoid testing every segment, the RGB cube is divided into cells, and
+each cell gets the list of the segments that can be nearest to a color in
+the cell (see _near()); the lookup of a color then only tests the
+candidates of its cell.  Along the colormap, the candidates of a cell are
+the segments within about a cell diagonal of the point nearest to its
+center, so their number grows with the size of the cells and the number
+of segments per unit of length.  The cube is divided into 2**bits cells
+per axis, where bits is by default chosen from the number and the total
+length of the segments (see choose_bits()), up to MAX_BITS, and the cells
+that still have more than TARGET_CANDIDATES candidates are divided again,
+down to MAX_DEPTH.  The index is built one level of cells at a time: the
+candidates of a cell are a subset of those of the cell that contains it
+at the previous level, so only those are tested.  The colors are looked up
+in blocks of at most LOOKUP_ROWS (color, candidate) pairs, so the memory
+used does not depend on the number of candidates.
+
+The distance of a color to the colormap is returned as well, and gives a
+confidence (1 for colors of the colormap, 0 for colors further than
+max_distance from it, e.g. annotations or a background).  The cells
+further than max_distance from the colormap only keep the segment nearest
+to their center, so the values of such colors are approximate, and their
+distances are at least the exact ones (and larger than max_distance).
+
+invert_image() processes an image a chunk of rows at a time, in a pool of
+threads (numpy releases the GIL for most of the work), writing into output
+arrays that may be memory mapped, so images larger than memory can be
+processed.  From the command line:
+
+    python -m chacoled.inverse colormap.cmap image.npy -o values.npy \\
+        --confidence confidence.npy
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from channels import merged_table
+
+
+# The number of pixels processed at a time by each thread.
+CHUNK_PIXELS = 1 << 18
+
+# The largest number of (color, candidate) pairs projected at a time, by
+# the lookup and by the construction of the index.
+LOOKUP_ROWS = 1 << 20
+
+# The range of the automatic choice of bits, and the number of candidates
+# per cell near the colormap that it aims at.
+MIN_BITS = 4
+MAX_BITS = 7
+TARGET_CANDIDATES = 16
+
+# The cells with more than TARGET_CANDIDATES candidates are divided, down
+# to this level.
+MAX_DEPTH = 8
+
+# The index is built in float32, with this margin on the distances.
+BUILD_MARGIN = 1e-5
+
+
+def choose_bits(lengths, target=TARGET_CANDIDATES):
+    """
+    Return the number of bits per axis of the cells of an index of
+    segments with the given lengths, so that a cell near the segments has
+    about `target` candidates.  The candidates of a cell are the segments
+    within about a diagonal of the point nearest to its center, so there
+    are about 1 + 2 * diagonal / mean_length of them.
+    """
+    mean_length = max(np.mean(lengths), 1e-12) if len(lengths) else 1.0
+    diagonal = (target - 1) * mean_length / 2.0
+    bits = int(np.ceil(np.log2(np.sqrt(3.0) / diagonal)))
+    return min(max(bits, MIN_BITS), MAX_BITS)
+
+
+class InverseColormap(object):
+    """Maps colors to the values in [0, 1] that a colormap maps to them."""
+
+    def __init__(self, unit_maps, bits=None, max_distance=0.05):
+        if len(unit_maps) != 3:
+            raise ValueError("InverseColormap requires the red, green and "
+                             "blue UnitMaps, got %d maps" % len(unit_maps))
+        self.max_distance = max_distance
+        x, values = merged_table([um.arrays() for um in unit_maps])
+        # The segments of the polyline.  Segments with equal x values are
+        # the jumps of the channels, whose colors are not in the colormap.
+        keep = x[1:] > x[:-1]
+        self.x0 = x[:-1][keep]
+        self.dx = (x[1:] - x[:-1])[keep]
+        self.p0 = values[:-1][keep]
+        self.d = (values[1:] - values[:-1])[keep]
+        dd = (self.d ** 2).sum(axis=1)
+        self.inv_dd = np.where(dd > 0, 1.0 / np.where(dd > 0, dd, 1.0), 0.0)
+        # The columns used by _project().
+        self._table = [np.ascontiguousarray(a) for a in
+                       (self.p0[:, 0], self.p0[:, 1], self.p0[:, 2],
+                        self.d[:, 0], self.d[:, 1], self.d[:, 2],
+                        self.inv_dd, self.x0, self.dx)]
+        self._table32 = [a.astype(np.float32) for a in self._table]
+        if bits is None:
+            bits = choose_bits(np.sqrt(dd))
+        self.bits = bits
+        self.levels, self.candidates = self._build_index()
+
+    def lookup(self, rgb):
+        """
+        Return the values and the distances to the colormap of the colors
+        rgb, an array with shape (..., 3) (or (..., 4); alpha is ignored)
+        of floats in [0, 1] or of unsigned integers.
+        """
+        rgb = np.asarray(rgb)
+        shape = rgb.shape[:-1]
+        rgb = rgb[..., :3].reshape(-1, 3)
+        if rgb.dtype.kind in 'ui' and rgb.dtype.itemsize <= 2:
+            # Images made with a colormap have few distinct colors, so only
+            # those are looked up.
+            bits = 8 * rgb.dtype.itemsize
+            keys = ((rgb[:, 0].astype(np.int64) << 2 * bits) |
+                    (rgb[:, 1].astype(np.int64) << bits) | rgb[:, 2])
+            keys, inverse = np.unique(keys, return_inverse=True)
+            mask = (1 << bits) - 1
+            colors = np.column_stack([(keys >> 2 * bits) & mask,
+                                      (keys >> bits) & mask, keys & mask])
+            values, distances = self._lookup(colors / float(mask))
+            values = values[inverse]
+            distances = distances[inverse]
+        else:
+            values, distances = self._lookup(_to_float(rgb))
+        return values.reshape(shape), distances.reshape(shape)
+
+    def confidence(self, distances):
+        """Convert distances returned by lookup() to confidences in [0, 1]."""
+        return np.clip(1.0 - np.asarray(distances) / self.max_distance,
+                       0.0, 1.0)
+
+    #-----------------------------------------------------------------------
+    # Private methods
+    #-----------------------------------------------------------------------
+
+    def _cells(self, p, level):
+        n = 1 << level
+        c = np.minimum((p * n).astype(np.intp), n - 1)
+        np.maximum(c, 0, out=c)
+        return (c[:, 0] * n + c[:, 1]) * n + c[:, 2]
+
+    def _project(self, p, seg, table=None):
+        """Project the colors p on the segments seg; (values, squared
+        distances).  `table` is self._table (the default) or
+        self._table32, for a faster projection in float32."""
+        px, py, pz, dx, dy, dz, inv_dd, x0, ddx = table or self._table
+        p = p.astype(px.dtype, copy=False)
+        wx = p[:, 0] - px[seg]
+        wy = p[:, 1] - py[seg]
+        wz = p[:, 2] - pz[seg]
+        dx = dx[seg]
+        dy = dy[seg]
+        dz = dz[seg]
+        t = (wx * dx + wy * dy + wz * dz) * inv_dd[seg]
+        np.clip(t, 0.0, 1.0, out=t)
+        wx -= t * dx
+        wy -= t * dy
+        wz -= t * dz
+        return x0[seg] + t * ddx[seg], wx * wx + wy * wy + wz * wz
+
+    def _build_index(self):
+        """
+        Return the levels of the index, from level self.bits down, as a list
+        of (level, cells, starts, counts, refined) tuples, and the array of
+        the candidates of their cells.  `cells` is the sorted array of the
+        cells of the level (None for level self.bits, which has all of
+        them), candidates[starts[i]:starts[i] + counts[i]] are those of
+        cells[i], and refined[i] is True if cells[i] is divided at the next
+        level instead.
+        """
+        # Level 0 is the whole cube, whose candidates are all the segments.
+        # The candidates of all the levels are kept in one list of arrays,
+        # at the offsets given by `starts`.
+        cells = np.zeros(1, dtype=np.int64)
+        starts = np.zeros(1, dtype=np.intp)
+        counts = np.array([len(self.x0)], dtype=np.intp)
+        candidates = [np.arange(len(self.x0), dtype=np.int32)]
+        size = len(self.x0)
+        levels = []
+        corners = np.array([(a >> 2, (a >> 1) & 1, a & 1) for a in range(8)])
+        max_depth = max(self.bits, MAX_DEPTH)
+        for level in range(1, max_depth + 2):
+            if level > self.bits:
+                refined = counts > TARGET_CANDIDATES
+                if level > max_depth:
+                    refined[:] = False
+                levels.append((level - 1, cells if levels else None,
+                               starts, counts, refined))
+                if not refined.any():
+                    break
+                parents = np.flatnonzero(refined)
+            else:
+                parents = np.arange(len(cells))
+            n = 1 << level
+            diagonal = np.sqrt(3.0) / n
+            all_candidates = np.concatenate(candidates)
+            # The children of the parents, in the order of the parents.
+            i, j, k = np.unravel_index(cells[parents], (n // 2,) * 3)
+            child = (2 * np.column_stack((i, j, k))[:, np.newaxis, :] +
+                     corners)
+            child_cells = (child[..., 0] * n + child[..., 1]) * n + \
+                child[..., 2]
+            # The children of cells with few candidates share them.
+            child_starts = np.repeat(starts[parents], 8).reshape(-1, 8)
+            child_counts = np.repeat(counts[parents], 8).reshape(-1, 8)
+            refine = np.flatnonzero(counts[parents] > TARGET_CANDIDATES)
+            for block in _blocks(8 * counts[parents[refine]], LOOKUP_ROWS):
+                block = refine[block]
+                parent = np.repeat(parents[block], 8)
+                near, cell_counts = self._near(
+                    (child[block].reshape(-1, 3) + 0.5) / n, starts[parent],
+                    counts[parent], all_candidates, diagonal)
+                child_starts[block] = (size + np.cumsum(cell_counts) -
+                                       cell_counts).reshape(-1, 8)
+                child_counts[block] = cell_counts.reshape(-1, 8)
+                candidates.append(near)
+                size += len(near)
+            order = np.argsort(child_cells, axis=None)
+            cells = child_cells.ravel()[order]
+            starts = child_starts.ravel()[order]
+            counts = child_counts.ravel()[order]
+        # Keep only the candidates of the leaves.
+        all_candidates = np.concatenate(candidates)
+        size = 0
+        kept = []
+        for index, (level, cells, starts, counts, refined) in \
+                enumerate(levels):
+            counts = np.where(refined, 0, counts)
+            kept.append(_expand(starts, counts, all_candidates)[1])
+            starts = size + np.cumsum(counts) - counts
+            levels[index] = (level, cells, starts, counts, refined)
+            size += len(kept[-1])
+        return levels, np.concatenate(kept)
+
+    def _near(self, centers, starts, counts, candidates, diagonal):
+        """
+        Return the candidates (for the cell) among the candidates[starts[i]:
+        starts[i] + counts[i]] of each center i, and their numbers.
+        """
+        row, seg = _expand(starts, counts, candidates)
+        d2 = self._project(centers[row], seg, self._table32)[1]
+        bounds = np.cumsum(counts) - counts
+        best = np.minimum.reduceat(d2, bounds)
+        first = np.flatnonzero(d2 == best[row])
+        first = first[np.r_[True, row[first][1:] != row[first][:-1]]]
+        # A segment is nearest to a color p of the cell (within half a
+        # diagonal h of its center c) only if a point y of it is nearer to
+        # p than q, the point of the nearest segment nearest to c, and then
+        #     |c - y|**2 <= |c - q|**2 + 2 * h * |y - q|
+        # where |y - q| is at most the distance of q to the further end of
+        # the segment.  Along the colormap, this keeps the segments within
+        # about a diagonal of q, however far the cell is.  The margin
+        # covers the rounding errors of float32, so that the candidates
+        # include those of the exact test.
+        q = self._nearest_points(centers, seg[first])
+        near = d2 <= best[row] + (diagonal * self._far_ends(q[row], seg) +
+                                  BUILD_MARGIN)
+        # The colors of a cell whose center is further than max_distance
+        # plus half a diagonal from the colormap have a zero confidence;
+        # only the segment nearest to the center is kept.
+        far = best > (self.max_distance + 0.5 * diagonal) ** 2
+        if far.any():
+            near[far[row]] = False
+            near[first[far]] = True
+        return seg[near], np.add.reduceat(near, bounds)
+
+    def _nearest_points(self, p, seg):
+        """Return the points of the segments seg nearest to the colors p."""
+        px, py, pz, dx, dy, dz, inv_dd = self._table32[:7]
+        p = p.astype(np.float32)
+        q = np.column_stack((px[seg], py[seg], pz[seg]))
+        d = np.column_stack((dx[seg], dy[seg], dz[seg]))
+        t = ((p - q) * d).sum(axis=1) * inv_dd[seg]
+        np.clip(t, 0.0, 1.0, out=t)
+        q += t[:, np.newaxis] * d
+        return q
+
+    def _far_ends(self, q, seg):
+        """Return the distances of the points q to the further ends of the
+        segments seg."""
+        px, py, pz, dx, dy, dz = self._table32[:6]
+        wx = px[seg] - q[:, 0]
+        wy = py[seg] - q[:, 1]
+        wz = pz[seg] - q[:, 2]
+        start = wx * wx + wy * wy + wz * wz
+        wx += dx[seg]
+        wy += dy[seg]
+        wz += dz[seg]
+        return np.sqrt(np.maximum(start, wx * wx + wy * wy + wz * wz))
+
+    def _leaves(self, p):
+        """Return the starts and the counts of the candidates of the
+        colors p."""
+        starts = np.empty(len(p), dtype=np.intp)
+        counts = np.empty(len(p), dtype=np.intp)
+        active = np.arange(len(p))
+        for level, cells, level_starts, level_counts, refined in self.levels:
+            index = self._cells(p[active], level)
+            if cells is not None:
+                index = np.searchsorted(cells, index)
+            leaf = ~refined[index]
+            starts[active[leaf]] = level_starts[index[leaf]]
+            counts[active[leaf]] = level_counts[index[leaf]]
+            active = active[~leaf]
+            if len(active) == 0:
+                break
+        return starts, counts
+
+    def _lookup(self, p):
+        if len(p) == 0:
+            return np.zeros(0), np.zeros(0)
+        starts, counts = self._leaves(p)
+        values = np.empty(len(p))
+        distances = np.empty(len(p))
+        for block in _blocks(counts, LOOKUP_ROWS, slices=True):
+            values[block], distances[block] = self._lookup_block(
+                p[block], starts[block], counts[block])
+        return values, distances
+
+    def _lookup_block(self, p, starts, counts):
+        # One row per (pixel, candidate) pair, grouped by pixel.
+        pixel, seg = _expand(starts, counts, self.candidates)
+        values, d2 = self._project(p[pixel], seg)
+        bounds = np.cumsum(counts) - counts
+        best = np.minimum.reduceat(d2, bounds)
+        # The first candidate of each pixel with the smallest distance.
+        is_best = np.flatnonzero(d2 == best[pixel])
+        group = pixel[is_best]
+        is_best = is_best[np.r_[True, group[1:] != group[:-1]]]
+        return values[is_best], np.sqrt(best)
+
+
+def _expand(starts, counts, candidates):
+    """
+    Return the arrays (row, seg) of the pairs (i, candidates[starts[i] + k])
+    for k < counts[i], grouped by i.
+    """
+    row = np.repeat(np.arange(len(counts)), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    offset = np.arange(len(row)) - first
+    return row, candidates[starts[row] + offset]
+
+
+def _blocks(counts, max_rows, slices=False):
+    """
+    Split range(len(counts)) into consecutive blocks whose sum of counts is
+    at most max_rows (or a single item, when it is larger).  Yields slices
+    if `slices` is True, and arrays of indices otherwise.
+    """
+    total = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = total[start - 1] if start > 0 else 0
+        stop = np.searchsorted(total, base + max_rows, side='right')
+        stop = max(stop, start + 1)
+        if slices:
+            yield slice(start, stop)
+        else:
+            yield np.arange(start, stop)
+        start = stop
+
+
+def _to_float(a):
+    if a.dtype.kind in 'ui':
+        return a / float(np.iinfo(a.dtype).max)
+    return a.astype(float)
+
+
+def invert_image(inverse, image, values=None, confidence=None,
+                 threads=None, chunk_pixels=CHUNK_PIXELS):
+    """
+    Map the colors of image, an array with shape (height, width, 3 or 4),
+    to values, with inverse, an InverseColormap.
+
+    The values and the confidences are written to the arrays `values` and
+    `confidence` (shape (height, width), e.g. memory mapped arrays), which
+    are created as float32 arrays if they are None; `confidence` is only
+    computed if it is given or values is None.  The image is processed in
+    chunks of about chunk_pixels pixels in `threads` threads (by default,
+    one per CPU).  Returns (values, confidence).
+    """
+    height, width = image.shape[:2]
+    if values is None:
+        values = np.empty((height, width), dtype=np.float32)
+        if confidence is None:
+            confidence = np.empty((height, width), dtype=np.float32)
+    rows = max(1, chunk_pixels // max(width, 1))
+
+    def work(start):
+        stop = min(start + rows, height)
+        v, d = inverse.lookup(image[start:stop])
+        values[start:stop] = v
+        if confidence is not None:
+            confidence[start:stop] = inverse.confidence(d)
+
+    pool = ThreadPool(threads)
+    try:
+        pool.map(work, range(0, height, rows), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return values, confidence
+
+
+def main(argv=None):
+    from unit_map import UnitMap
+    from colormap_io import read_colormap_file, color_mapper_points
+    from image_import import read_image
+
+    parser = argparse.ArgumentParser(
+                description="Recover the values of a colormapped image.")
+    parser.add_argument('colormap', help='a .cmap or .py colormap file')
+    parser.add_argument('image', help='an image or .npy file')
+    parser.add_argument('-o', '--output', required=True, metavar='FILE',
+                        help='the .npy file of the values')
+    parser.add_argument('--confidence', metavar='FILE',
+                        help='the .npy file of the confidences')
+    parser.add_argument('--bits', type=int, default=None,
+                        help='the number of bits per axis of the first '
+                             'level of the index (by default, chosen from '
+                             'the colormap)')
+    parser.add_argument('--max-distance', type=float, default=0.05)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    name, color_mapper = read_colormap_file(args.colormap)
+    points = color_mapper_points(color_mapper)
+    inverse = InverseColormap([UnitMap(points=points[c])
+                               for c in ['red', 'green', 'blue']],
+                              args.bits, args.max_distance)
+    image = read_image(args.image)
+    shape = image.shape[:2]
+    open_memmap = np.lib.format.open_memmap
+    values = open_memmap(args.output, 'w+', np.float32, shape)
+    confidence = None
+    if args.confidence:
+        confidence = open_memmap(args.confidence, 'w+', np.float32, shape)
+    invert_image(inverse, image, values, confidence, args.threads)
+    values.flush()
+    if confidence is not None:
+        confidence.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
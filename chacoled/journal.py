@@ -0,0 +1,187 @@
+"""
+Crash-safe autosave of the points of a colormap's channels.
+
+An EditJournal listens to the UnitMaps of the channels and appends one
+binary record per change to a journal file.  A record describes the
+change as the replacement of a slice of the points (see
+unit_map.list_change()), so its size is proportional to the size of the
+edit, not to the number of points: dragging a point writes one point, and
+a change made in a UnitMap.batch() block writes a single record with its
+net change.
+
+A record is
+
+    kind, channel, index, removed, added      struct '<BBIII'
+    added (x, y) pairs                        float64
+    CRC-32 of the above                       uint32
+
+where kind is SPLICE (replace `removed` points at `index` by the `added`
+ones) or SNAPSHOT (set all the points).  When the journal has grown
+enough, it is compacted: a new file with a SNAPSHOT record per channel is
+written, synced and renamed over the journal.  A record that was not
+completely written (e.g. by a crash) fails its CRC check, and is ignored
+along with anything after it when the journal is read.
+
+ColormapApp keeps a journal while it runs, offers to restore it when it
+is started after a crash, and removes it on a normal exit.
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from unit_map import list_change
+
+
+MAGIC = b'CLEDJNL1'
+
+SPLICE = 1
+SNAPSHOT = 2
+
+_HEADER = struct.Struct('<BBIII')
+_CRC = struct.Struct('<I')
+
+
+class JournalError(Exception):
+    """The file is not a journal."""
+    pass
+
+
+def _record(kind, channel, index, removed, added):
+    payload = np.asarray(added, dtype='<f8').reshape(-1, 2).tobytes()
+    data = _HEADER.pack(kind, channel, index, removed, len(added)) + payload
+    return data + _CRC.pack(zlib.crc32(data) & 0xffffffff)
+
+
+class EditJournal(object):
+    """
+    Journals the changes to the points of a list of UnitMaps.
+
+    `path` is the journal file.  After compaction, the journal is rewritten
+    when the records appended since then exceed `compact_bytes` and four
+    times the size of the snapshot.
+    """
+
+    def __init__(self, path, compact_bytes=1 << 20):
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self.unit_maps = []
+        self._file = None
+        # The size of the snapshot written by the last compaction, and the
+        # number of bytes appended after it.
+        self._snapshot_bytes = 0
+        self._appended = 0
+
+    def attach(self, unit_maps):
+        """
+        Start journaling the changes to unit_maps.  The journal is
+        (re)written with a snapshot of their current points.
+        """
+        self.detach()
+        self.unit_maps = list(unit_maps)
+        for um in self.unit_maps:
+            um.on_trait_change(self._points_replaced, 'points')
+            um.on_trait_change(self._points_spliced, 'points_items')
+        self.compact()
+
+    def detach(self):
+        """Stop journaling."""
+        for um in self.unit_maps:
+            um.on_trait_change(self._points_replaced, 'points', remove=True)
+            um.on_trait_change(self._points_spliced, 'points_items',
+                               remove=True)
+        self.unit_maps = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self, remove=True):
+        """Stop journaling, and remove the journal if `remove` is True."""
+        self.detach()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def compact(self):
+        """Replace the journal by a snapshot of the points."""
+        if self._file is not None:
+            self._file.close()
+        records = [_record(SNAPSHOT, k, 0, 0, um.points)
+                   for k, um in enumerate(self.unit_maps)]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.writelines(records)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == 'nt' and os.path.exists(self.path):
+            # os.rename() does not replace files on Windows.
+            os.remove(self.path)
+        os.rename(tmp_path, self.path)
+        self._file = open(self.path, 'ab')
+        self._snapshot_bytes = sum(len(r) for r in records)
+        self._appended = 0
+
+    #-----------------------------------------------------------------------
+    # Private methods
+    #-----------------------------------------------------------------------
+
+    def _append(self, record):
+        self._file.write(record)
+        self._file.flush()
+        self._appended += len(record)
+        if self._appended > max(self.compact_bytes,
+                                4 * self._snapshot_bytes):
+            self.compact()
+
+    def _points_replaced(self, obj, name, old, new):
+        event = list_change(old, new)
+        if event is not None:
+            self._points_spliced(obj, name, event)
+
+    def _points_spliced(self, obj, name, event):
+        channel = self.unit_maps.index(obj)
+        if isinstance(event.index, slice):
+            # An extended slice assignment; record all the points.
+            self._append(_record(SNAPSHOT, channel, 0, 0, obj.points))
+        else:
+            self._append(_record(SPLICE, channel, event.index,
+                                 len(event.removed), event.added))
+
+
+def read_journal(path):
+    """
+    Replay a journal, and return the list of the points of the channels
+    (lists of (x, y) tuples).  Records after a damaged or incomplete one
+    are ignored.  Raises JournalError if the file is not a journal, and
+    IOError if it can not be read.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise JournalError('"%s" is not a chacoled journal' % path)
+    channels = []
+    pos = len(MAGIC)
+    while pos + _HEADER.size <= len(data):
+        kind, channel, index, removed, added = \
+            _HEADER.unpack_from(data, pos)
+        end = pos + _HEADER.size + 16 * added
+        if end + _CRC.size > len(data):
+            break
+        crc, = _CRC.unpack_from(data, end)
+        if crc != zlib.crc32(data[pos:end]) & 0xffffffff:
+            break
+        xy = np.frombuffer(data, dtype='<f8', count=2 * added,
+                           offset=pos + _HEADER.size).reshape(-1, 2)
+        points = list(zip(xy[:, 0].tolist(), xy[:, 1].tolist()))
+        while len(channels) <= channel:
+            channels.append([])
+        if kind == SNAPSHOT:
+            channels[channel] = points
+        elif kind == SPLICE:
+            channels[channel][index:index + removed] = points
+        else:
+            break
+        pos = end + _CRC.size
+    return channels
@@ -0,0 +1,94 @@
+"""
+Batch export of lookup tables for a library of colormaps.
+
+Each colormap is loaded as by the analyzer (see analysis.load_source()),
+and written with colormap_io.write_lut() to a directory, as
+<name>.<format>, in a process pool.  For example, to write 4096 entry
+uint16 tables of the Chaco colormaps and of a directory of exports:
+
+    python -m chacoled.lut_export --chaco exports/*.cmap -o luts \\
+        --size 4096 --dtype uint16 --format clut
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+from unit_map import UnitMap
+from colormap_io import write_lut, LUT_DTYPES, LUT_FORMATS
+from analysis import load_source
+
+
+def export_source(args):
+    """Load one source and write its table.  Runs in the worker processes."""
+    source, directory, size, dtype, format = args
+    try:
+        name, points = load_source(source)
+        names = ['red', 'green', 'blue']
+        if 'alpha' in points:
+            names.append('alpha')
+        path = os.path.join(directory, '%s.%s' % (name, format))
+        write_lut(path, [UnitMap(points=points[n]) for n in names], size,
+                  dtype, format)
+        return source, path, None
+    except Exception as e:
+        # A broken file must not stop the export of the library.
+        return source, None, str(e)
+
+
+def export_library(sources, directory, size=256, dtype='uint8',
+                   format='clut', processes=None):
+    """
+    Write the lookup tables of the sources (see analysis.load_source()) to
+    directory.  Returns a list of (source, path, error) tuples, where path
+    is None if the source failed with the message error.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tasks = [(source, directory, size, dtype, format) for source in sources]
+    if processes == 1:
+        return [export_source(task) for task in tasks]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return list(pool.imap_unordered(export_source, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+                description="Write lookup tables of colormaps.")
+    parser.add_argument('files', nargs='*',
+                        help='.cmap or .py colormap files')
+    parser.add_argument('--chaco', action='store_true',
+                        help="include Chaco's colormaps")
+    parser.add_argument('-o', '--output', default='.', metavar='DIR',
+                        help='the directory of the tables')
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--dtype', default='uint8', choices=LUT_DTYPES)
+    parser.add_argument('--format', default='clut', choices=LUT_FORMATS)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    sources = [('file', os.path.abspath(path)) for path in args.files]
+    if args.chaco:
+        from chaco.default_colormaps import color_map_name_dict
+        sources.extend(('chaco', name)
+                       for name in sorted(color_map_name_dict))
+    results = export_library(sources, args.output, args.size, args.dtype,
+                             args.format, args.processes)
+    failed = 0
+    for source, path, error in results:
+        if error is not None:
+            print('%s:%s: %s' % (source + (error,)), file=sys.stderr)
+            failed += 1
+    print('%d tables written, %d failed' % (len(results) - failed, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
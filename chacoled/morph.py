@@ -0,0 +1,156 @@
+"""
+Morphing between two colormaps.
+
+A ColormapMorph is created from two ChannelSets with the same channel
+names (e.g. the `channels` of two ColormapEditors).  The breakpoints of
+both maps are merged once, and the values of the channels at the merged
+breakpoints and their differences are stored.  The map for any t in
+[0, 1] is then
+
+    start + t * delta
+
+which is a single array operation, and the same is done for lookup
+tables of a given size.
+
+With space='lab', the red, green and blue channels are interpolated in
+CIE L*a*b*, which gives transitions of more even perceived brightness.
+Other channels (e.g. alpha) are always interpolated linearly.  In that
+case the lookup tables are exact, but the maps returned by unit_maps()
+and apply() only use L*a*b* interpolation at the breakpoints, and are
+linear in RGB between them.
+
+Example::
+
+    morph = ColormapMorph(editor1.channels, editor2.channels, space='lab')
+    for lut in morph.frames(60, size=256):
+        ...
+"""
+
+import numpy as np
+
+from unit_map import UnitMap, interpolate
+from channels import merged_table
+from color_space import srgb_to_lab, lab_to_srgb
+
+
+RGB = ['red', 'green', 'blue']
+
+
+class ColormapMorph(object):
+    """Precomputed interpolation between two colormaps."""
+
+    def __init__(self, start, end, space='rgb'):
+        if list(start.names) != list(end.names):
+            raise ValueError("The colormaps must have the same channels; "
+                             "got %r and %r" % (start.names, end.names))
+        if space not in ('rgb', 'lab'):
+            raise ValueError("space must be 'rgb' or 'lab', not %r" %
+                             (space,))
+        if space == 'lab' and not set(RGB) <= set(start.names):
+            raise ValueError("space='lab' requires red, green and blue "
+                             "channels")
+        self.names = list(start.names)
+        self.space = space
+        n = len(self.names)
+        x, values = merged_table([um.arrays() for um in start.unit_maps] +
+                                 [um.arrays() for um in end.unit_maps])
+        # The merged breakpoints, and the values of the start map and the
+        # differences of the values at them.
+        self.x = x
+        self.start, self.delta = self._precompute(values[:, :n],
+                                                  values[:, n:])
+        # The values of both maps on the merged breakpoints, from which the
+        # lookup tables are computed.
+        self._table = values
+        # Lookup tables computed by lut(), by size: (start, delta).
+        self._luts = {}
+
+    def values(self, t):
+        """
+        Return the values of the channels of the map at t, at the merged
+        breakpoints self.x, as an array with shape (len(x), len(names)).
+        """
+        return self._finish(self.start + t * self.delta)
+
+    def lut(self, t, size=256):
+        """
+        Return the lookup table with `size` entries of the map at t, as an
+        array with shape (size, len(names)).
+        """
+        precomputed = self._luts.get(size)
+        if precomputed is None:
+            n = len(self.names)
+            table = interpolate(self.x, self._table,
+                                np.linspace(0.0, 1.0, size))
+            precomputed = self._precompute(table[:, :n], table[:, n:])
+            self._luts[size] = precomputed
+        lut_start, lut_delta = precomputed
+        return self._finish(lut_start + t * lut_delta)
+
+    def unit_maps(self, t):
+        """Return a dictionary of UnitMaps of the channels of the map at t."""
+        values = self.values(t)
+        return dict((name, UnitMap(points=_channel_points(self.x,
+                                                          values[:, k])))
+                    for k, name in enumerate(self.names))
+
+    def apply(self, editor, t):
+        """
+        Set the channels of a ColormapEditor to the map at t.  The alpha
+        channel of the editor is used if the maps have one.
+        """
+        values = self.values(t)
+        with editor.batch():
+            for k, name in enumerate(self.names):
+                um = getattr(editor, name + '_channel').unit_map
+                um.points = _channel_points(self.x, values[:, k])
+            editor.use_alpha = 'alpha' in self.names
+
+    def frames(self, count, size=256, ease=None):
+        """
+        Generate `count` lookup tables of `size` entries, for t equally
+        spaced from 0 to 1.  If `ease` is given, it is a function that maps
+        the equally spaced values to the t values, e.g.
+        unit_map.sigmoid_curve().
+        """
+        t = np.linspace(0.0, 1.0, count)
+        if ease is not None:
+            t = ease(t)
+        for tk in t:
+            yield self.lut(tk, size)
+
+    #-----------------------------------------------------------------------
+    # Private methods
+    #-----------------------------------------------------------------------
+
+    def _precompute(self, start, end):
+        """Return (start, delta) in the interpolation space."""
+        if self.space == 'lab':
+            start = self._to_lab(start)
+            end = self._to_lab(end)
+        return start, end - start
+
+    def _rgb_columns(self):
+        return [self.names.index(name) for name in RGB]
+
+    def _to_lab(self, values):
+        values = values.copy()
+        rgb = self._rgb_columns()
+        values[:, rgb] = srgb_to_lab(values[:, rgb])
+        return values
+
+    def _finish(self, values):
+        """Convert interpolated values back to the channel values."""
+        if self.space == 'lab':
+            rgb = self._rgb_columns()
+            values[:, rgb] = lab_to_srgb(values[:, rgb])
+        return np.clip(values, 0.0, 1.0, out=values)
+
+
+def _channel_points(x, y):
+    """
+    Return the points of a channel from its values on the merged grid,
+    without the repeated points that the jumps of other channels add.
+    """
+    keep = np.concatenate(([True], (x[1:] != x[:-1]) | (y[1:] != y[:-1])))
+    return list(zip(x[keep].tolist(), y[keep].tolist()))
@@ -0,0 +1,225 @@
+"""
+Recording and replay of interactive editing sessions.
+
+A SessionRecorder attached to UnitMapEditors writes the enable events
+dispatched to them, with timestamps, to a file with one JSON record per
+line.  Before an event, the state of the editor that the event depends on
+(its position and size, grid, snap mode and points) is written too, if it
+was changed by something else than the recorded events, e.g. by loading a
+colormap.
+
+The replay driver feeds the events back to new editors, without a window,
+either at the original pace or as fast as possible, and reports the time
+taken to handle them.  Set the environment variable CHACOLED_RECORD to a
+file name to record the sessions of the colormap application, and replay
+them with
+
+    python -m chacoled.session replay.jsonl [--speed 1] [--draw]
+                                            [--profile replay.prof]
+"""
+
+from __future__ import with_statement
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+# The traits of the enable events that are recorded.
+EVENT_TRAITS = ['x', 'y', 'alt_down', 'control_down', 'shift_down',
+                'left_down', 'middle_down', 'right_down', 'mouse_wheel',
+                'character', 'event_type']
+
+# Events that need a window (they open a menu), and are not replayed.
+SKIPPED_SUFFIXES = ['right_up']
+
+# The names of the editors of the channels of a ColormapEditor, as they
+# are recorded by the colormap application.
+CHANNEL_NAMES = ['red', 'green', 'blue', 'alpha']
+
+
+class SessionRecorder(object):
+    """Records the events dispatched to UnitMapEditors to a file."""
+
+    def __init__(self, f):
+        self.file = f
+        self.start_time = time.time()
+        # The names of the attached editors, by id.
+        self._names = {}
+        # The state of each editor after its last recorded event.
+        self._states = {}
+
+    def attach(self, editor, name):
+        """Record the events of `editor` under the given name."""
+        self._names[id(editor)] = name
+        self._states.pop(name, None)
+        editor.session_recorder = self
+
+    def detach(self, editor):
+        editor.session_recorder = None
+        self._names.pop(id(editor), None)
+
+    def close(self):
+        self.file.close()
+
+    def dispatch(self, editor, event, suffix, dispatch):
+        """
+        Record the event, and dispatch it by calling dispatch(event, suffix).
+        This is called by UnitMapEditor.dispatch().
+        """
+        name = self._names[id(editor)]
+        t = time.time() - self.start_time
+        state = self._state(editor)
+        if state != self._states.get(name):
+            self._write(dict(type='state', t=t, editor=name,
+                             position=list(editor.position),
+                             bounds=list(editor.bounds),
+                             grid_resolution_index=state[3],
+                             snap_to_grid=state[4],
+                             points=[list(p) for p in editor.unit_map.points]))
+        traits = {}
+        for trait in EVENT_TRAITS:
+            value = getattr(event, trait, None)
+            if value is not None:
+                traits[trait] = value
+        self._write(dict(type='event', t=t, editor=name, suffix=suffix,
+                         event=type(event).__name__, traits=traits))
+        try:
+            dispatch(event, suffix)
+        finally:
+            self._states[name] = self._state(editor)
+
+    def _state(self, editor):
+        return (editor.unit_map.version, tuple(editor.position),
+                tuple(editor.bounds), editor.grid_resolution_index,
+                editor.snap_to_grid)
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+
+def read_session(f):
+    """Return the list of records in a session file."""
+    return [json.loads(line) for line in f if line.strip()]
+
+
+def make_editors(names):
+    """
+    Return a dictionary of new editors for the given names.  If the names
+    are the channel names, the editors are the channels of a new
+    ColormapEditor, so that the colorbar and the luminance plot are updated
+    as in the application.
+    """
+    if set(names) <= set(CHANNEL_NAMES):
+        from colormap_editor import ColormapEditor
+        cme = ColormapEditor()
+        return dict(red=cme.red_channel, green=cme.green_channel,
+                    blue=cme.blue_channel, alpha=cme.alpha_channel)
+    from unit_map import UnitMap
+    from unit_map_editor import UnitMapEditor
+    return dict((name, UnitMapEditor(unit_map=UnitMap(), label=name))
+                for name in names)
+
+
+def _make_event(class_name, traits):
+    import enable.api
+    cls = getattr(enable.api, class_name)
+    known = cls.class_trait_names()
+    return cls(**dict((str(k), v) for k, v in traits.items() if k in known))
+
+
+def replay(records, editors, speed=None, draw=False):
+    """
+    Replay the records of a session on the given editors.
+
+    If speed is None, the events are sent as fast as possible; otherwise
+    the pace of the recording is kept, sped up by the factor `speed`.  If
+    draw is True, the editor is drawn on an image graphics context after
+    each event.  Returns a list of (suffix, seconds) with the time taken to
+    handle each event (including drawing).
+    """
+    gcs = {}
+    times = []
+    start = time.time()
+    for record in records:
+        editor = editors[record['editor']]
+        if record['type'] == 'state':
+            editor.position = record['position']
+            editor.bounds = record['bounds']
+            editor.grid_resolution_index = record['grid_resolution_index']
+            editor.snap_to_grid = record['snap_to_grid']
+            editor.unit_map.points = [tuple(p) for p in record['points']]
+            continue
+        suffix = record['suffix']
+        if suffix in SKIPPED_SUFFIXES:
+            continue
+        if speed is not None:
+            delay = start + record['t'] / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        event = _make_event(record['event'], record['traits'])
+        t0 = time.time()
+        editor.dispatch(event, suffix)
+        if draw:
+            gc = gcs.get(record['editor'])
+            size = (int(editor.width), int(editor.height))
+            if gc is None or (gc.width(), gc.height()) != size:
+                from kiva.image import GraphicsContext
+                gc = gcs[record['editor']] = GraphicsContext(size)
+            editor.draw(gc)
+        times.append((suffix, time.time() - t0))
+    return times
+
+
+def summarize(times):
+    """Return a table of the number and p50/p99 times of each suffix."""
+    import numpy as np
+    by_suffix = {}
+    for suffix, t in times:
+        by_suffix.setdefault(suffix, []).append(t)
+    lines = ["%-16s %8s %10s %10s %10s" %
+             ('event', 'count', 'total ms', 'p50 ms', 'p99 ms')]
+    for suffix in sorted(by_suffix):
+        t = np.array(by_suffix[suffix])
+        p50, p99 = np.percentile(t, [50, 99])
+        lines.append("%-16s %8d %10.1f %10.3f %10.3f" %
+                     (suffix, len(t), 1e3 * t.sum(), 1e3 * p50, 1e3 * p99))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    os.environ.setdefault('ETS_TOOLKIT', 'null')
+    parser = argparse.ArgumentParser(
+                description="Replay a recorded editing session.")
+    parser.add_argument('session', help='the file written by the recorder')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='replay at the recorded pace, sped up by this '
+                             'factor (default: as fast as possible)')
+    parser.add_argument('--draw', action='store_true',
+                        help='draw the editor after each event')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='profile the replay with cProfile, and save '
+                             'the statistics to FILE')
+    args = parser.parse_args(argv)
+
+    with open(args.session) as f:
+        records = read_session(f)
+    editors = make_editors(set(r['editor'] for r in records))
+    if args.profile:
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        times = profile.runcall(replay, records, editors, args.speed,
+                                args.draw)
+        profile.dump_stats(args.profile)
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+    else:
+        times = replay(records, editors, args.speed, args.draw)
+    print(summarize(times))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Streaming evaluation of UnitMaps and colormaps over chunked data.
+
+A BreakpointTable holds the breakpoints of one or more piecewise linear
+functions (a UnitMap, or the merged grid of the channels of a ChannelSet),
+precomputed once.  Its stream() method maps an iterable of arrays (e.g.
+blocks read from a socket or slices of an HDF5 dataset) and yields the
+mapped chunks, without allocating memory for each chunk: all the
+temporary arrays and the output are buffers that are reused, and only
+grow when a chunk larger than all the previous ones arrives.
+
+The yielded arrays are views of the output buffer, so they are only
+valid until the next chunk is requested; copy them (or pass `out` arrays
+that are written elsewhere) to keep them.  Example::
+
+    table = BreakpointTable.from_channels(editor.channels)
+    for rgba in table.stream(dataset_slices, low=vmin, high=vmax):
+        sink.write(rgba)
+
+numpy.searchsorted() can not write into a buffer, so the interval of each
+value is found with a uniform grid of cells and a branchless binary search
+instead: the number of breakpoints below the start of each cell is
+precomputed, and the breakpoints inside the cell are then searched with
+one np.take(), np.less() and np.add() per halving of the largest number
+of breakpoints in a cell.  That is one or two passes for breakpoints
+spread over [0, 1], and at most about log2(len(xp)) for breakpoints
+clustered in a few cells (e.g. the points of power_curve(0.05) near 0).
+The result is the same as that of unit_map.interpolate(), with
+side='left'.  Chunks that are not contiguous are copied.
+
+float32 and float16 data are processed in float32 and give results of
+their own type.  The breakpoints are searched in float64, as in
+unit_map.interpolate(), and only the tables used after the search are
+converted; see unit_map.evaluation_dtypes() for the error bound.
+"""
+
+import numpy as np
+
+from unit_map import evaluation_dtypes
+
+
+class BreakpointTable(object):
+    """Precomputed breakpoints of piecewise linear functions."""
+
+    def __init__(self, xp, fp, cells=None):
+        """
+        xp is the nondecreasing array of breakpoints, from 0 to 1, and fp
+        the values of the functions at them, with shape (len(xp),) or
+        (len(xp), m) for m functions.  cells is the number of cells of the
+        search grid (by default, about four per breakpoint).
+        """
+        xp = np.asarray(xp, dtype=float)
+        fp = np.asarray(fp, dtype=float)
+        n = len(xp)
+        if n < 2:
+            raise ValueError("BreakpointTable requires at least two "
+                             "breakpoints.")
+        self.shape = fp.shape[1:]
+        if cells is None:
+            cells = 4 * n
+        self.cells = cells
+        # The start, value and slope of each segment (the last one is
+        # only used at x = 1, when the last two breakpoints are equal).
+        dx = np.diff(xp)
+        slope = np.diff(fp, axis=0)
+        nonzero = dx > 0
+        slope[nonzero] /= dx[nonzero].reshape((-1,) + (1,) * len(self.shape))
+        slope[~nonzero] = 0.0
+        self._x0 = xp[:-1].copy()
+        self._f0 = fp[:-1].copy()
+        self._slope = slope
+        # The cell of a value is x * cells rounded down, and x * cells is
+        # rounded (in float32 for float32 data), so a value may be up to
+        # `margin` cells outside of its cell.  The number of breakpoints
+        # below the start of each cell, less the margin, and the steps of
+        # the binary search of the breakpoints up to its end, plus the
+        # margin: the powers of two below the smallest one larger than the
+        # largest number of such breakpoints.  The breakpoints are padded
+        # with infinities for the search.
+        margin = cells * 2.0 ** -23
+        c = np.arange(cells, dtype=float)
+        self._below = np.searchsorted(xp, (c - margin) / cells, side='left')
+        above = np.searchsorted(xp, (c + 1 + margin) / cells, side='left')
+        depth = max((above - self._below).max(), 1)
+        self._steps = [1 << i for i in
+                       reversed(range(int(depth).bit_length()))]
+        self._search = np.empty(n + 2 * self._steps[0])
+        self._search.fill(np.inf)
+        self._search[:n] = xp
+        self._n = n
+        # The tables converted to float32, by _tables().
+        self._converted = {np.dtype(np.float64): [self._x0, self._f0,
+                                                  self._slope]}
+
+    @classmethod
+    def from_unit_map(cls, unit_map, cells=None):
+        """The table of a UnitMap."""
+        return cls(*unit_map.arrays(), cells=cells)
+
+    @classmethod
+    def from_channels(cls, channel_set, cells=None):
+        """The table of all the channels of a ChannelSet."""
+        return cls(*channel_set.table(), cells=cells)
+
+    def evaluate(self, x, out=None):
+        """
+        Evaluate the functions at the values in the array x (between 0 and
+        1), into out if it is given.  The result has shape x.shape +
+        self.shape, and the type given by unit_map.evaluation_dtypes().
+        """
+        x = np.asarray(x)
+        if x.dtype.kind != 'f':
+            x = x.astype(float)
+        buffers = _Buffers(self, x.dtype, x.size)
+        if out is None:
+            out = buffers.out
+        out = out.reshape((x.size,) + self.shape)
+        return self._evaluate(x.ravel(), buffers, out,
+                              0.0, 1.0).reshape(x.shape + self.shape)
+
+    def stream(self, chunks, out=None, low=0.0, high=1.0):
+        """
+        Generate the values of the functions for each array in the iterable
+        chunks.  The data is first scaled from [low, high] to [0, 1], and
+        clipped.
+
+        Each generated array has the shape chunk.shape + self.shape, and is
+        a view of `out` (a 1-d array for one function, or an array with
+        shape (size,) + self.shape), which must be large enough for every
+        chunk if it is given; otherwise it is an array that is reused.
+        float32 and float16 chunks are evaluated in float32 and give values
+        of their own type (see unit_map.evaluation_dtypes()); other chunks
+        give float64 values.
+        """
+        # The buffers for each type of chunk.
+        buffers = {}
+        for chunk in chunks:
+            chunk = np.asarray(chunk)
+            dtype = chunk.dtype if chunk.dtype.kind == 'f' else np.float64
+            b = buffers.get(dtype)
+            if b is None:
+                b = buffers[dtype] = _Buffers(self, dtype, 0)
+            size = chunk.size
+            b.reserve(size)
+            if out is None:
+                result = b.out[:size]
+            else:
+                result = out[:size]
+            self._evaluate(chunk.reshape(-1), b, result, low, high)
+            yield result.reshape(chunk.shape + self.shape)
+
+    #-----------------------------------------------------------------------
+    # Private methods
+    #-----------------------------------------------------------------------
+
+    def _tables(self, compute):
+        """The tables used after the search, converted to the type
+        compute."""
+        tables = self._converted.get(compute)
+        if tables is None:
+            # The slopes too steep for the type are clipped, rather than
+            # becoming infinite (and giving NaNs at the start of their
+            # segments).
+            big = np.finfo(compute).max
+            tables = self._converted[compute] = \
+                [self._x0.astype(compute), self._f0.astype(compute),
+                 np.clip(self._slope, -big, big).astype(compute)]
+        return tables
+
+    def _evaluate(self, data, buffers, out, low, high):
+        size = data.size
+        x0, f0, slope = self._tables(buffers.compute)
+        x = buffers.x[:size]
+        # Scale and clip the data.
+        if low == 0.0 and high == 1.0:
+            np.clip(data, 0.0, 1.0, out=x)
+        else:
+            np.subtract(data, low, out=x)
+            np.multiply(x, 1.0 / (high - low), out=x)
+            np.clip(x, 0.0, 1.0, out=x)
+        # The cell of each value, and the number of breakpoints below it,
+        # k = searchsorted(xp, x, side='left').
+        tmp = buffers.tmp[:size]
+        cell = buffers.cell[:size]
+        k = buffers.k[:size]
+        below = buffers.below[:size]
+        np.multiply(x, self.cells, out=tmp)
+        np.copyto(cell, tmp, casting='unsafe')
+        np.minimum(cell, self.cells - 1, out=cell)
+        np.take(self._below, cell, out=k, mode='clip')
+        # k is incremented by each step that leaves a breakpoint below x;
+        # `cell` holds the index of the breakpoint tested, and `probe` (a
+        # float64 buffer) the breakpoint.
+        probe = buffers.probe[:size]
+        for step in self._steps:
+            np.add(k, step - 1, out=cell)
+            np.take(self._search, cell, out=probe, mode='clip')
+            np.less(probe, x, out=below)
+            np.add(k, step, out=k, where=below)
+        # The segment is k - 1, clipped to the segments of the table.
+        np.subtract(k, 1, out=k)
+        np.clip(k, 0, self._n - 2, out=k)
+        # result = f0[k] + (x - x0[k]) * slope[k], computed in the compute
+        # type, and written to out.
+        if out.dtype == buffers.compute:
+            result = out
+        else:
+            result = buffers.result[:size]
+        np.take(x0, k, out=tmp, mode='clip')
+        np.subtract(x, tmp, out=tmp)
+        np.take(f0, k, axis=0, out=result, mode='clip')
+        values = buffers.values[:size]
+        np.take(slope, k, axis=0, out=values, mode='clip')
+        if self.shape:
+            tmp = tmp.reshape((size,) + (1,) * len(self.shape))
+        np.multiply(values, tmp, out=values)
+        np.add(result, values, out=result)
+        if result is not out:
+            np.copyto(out, result, casting='unsafe')
+        return out
+
+
+class _Buffers(object):
+    """The temporary arrays of BreakpointTable._evaluate() for data of the
+    type dtype."""
+
+    def __init__(self, table, dtype, size):
+        self.table = table
+        self.dtype, self.compute = evaluation_dtypes(np.empty(0, dtype))
+        self.size = -1
+        self.reserve(size)
+
+    def reserve(self, size):
+        """Make the buffers large enough for size values."""
+        if size <= self.size:
+            return
+        # Grow geometrically, so that slowly growing chunks do not cause
+        # an allocation each.
+        size = max(size, 2 * self.size)
+        shape = (size,) + self.table.shape
+        self.x = np.empty(size, self.compute)
+        self.tmp = np.empty(size, self.compute)
+        # The breakpoints compared with the data, in float64.
+        if self.compute == np.float64:
+            self.probe = self.tmp
+        else:
+            self.probe = np.empty(size)
+        self.cell = np.empty(size, dtype=np.intp)
+        self.k = np.empty(size, dtype=np.intp)
+        self.below = np.empty(size, dtype=bool)
+        self.values = np.empty(shape, self.compute)
+        self.out = np.empty(shape, self.dtype)
+        # The result in the compute type, when it is not out.
+        if self.dtype == self.compute:
+            self.result = self.out
+        else:
+            self.result = np.empty(shape, self.compute)
+        self.size = size
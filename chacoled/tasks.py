@@ -0,0 +1,224 @@
+"""
+Running expensive operations off the GUI thread.
+
+A TaskExecutor runs functions in worker threads.  A task is given
+snapshots of the points of the UnitMaps it works on (tuples, which the GUI
+can not change under it), and its result is handed to a callback that is
+invoked on the GUI thread, where it can be applied to the maps in one
+step.
+
+A task is cancelled
+
+    * when cancel() is called,
+    * when a new task with the same name is submitted, or
+    * when one of the UnitMaps it was given is changed (its version is no
+      longer that of the snapshot), since its result would then be stale.
+
+Long tasks call task.check() now and then to stop early when cancelled,
+and task.progress() to report progress in the executor's status_text.
+The result of a cancelled task is discarded.  Example::
+
+    def clean(task, points, tol):
+        return clean2(list(points[0]), tol)
+
+    def apply(points):
+        editor.unit_map.points = points
+
+    executor.submit('Clean', clean, [editor.unit_map], args=(1e-3,),
+                    on_done=apply)
+
+The function is called with the task, the list of the point snapshots
+and then args.  Functions whose results do not depend on the maps staying
+unchanged (e.g. exports) can take snapshots with snapshot(), and pass them
+in args instead.
+"""
+
+import sys
+import threading
+import time
+import traceback
+from Queue import Queue
+
+from traits.api import HasTraits, Str, Int, Any
+
+
+def snapshot(unit_maps):
+    """Return copies of the points of unit_maps, as tuples."""
+    return [tuple(um.points) for um in unit_maps]
+
+
+class TaskCancelled(Exception):
+    """Raised by Task.check() in a task that has been cancelled."""
+    pass
+
+
+class Task(object):
+    """A function submitted to a TaskExecutor."""
+
+    # The minimum time between two progress reports, in seconds.
+    progress_interval = 0.1
+
+    def __init__(self, executor, name, function, unit_maps, args, on_done):
+        self.executor = executor
+        self.name = name
+        self.function = function
+        self.unit_maps = list(unit_maps)
+        # The snapshot: the versions and the points of the maps.
+        self.versions = [um.version for um in self.unit_maps]
+        self.points = snapshot(self.unit_maps)
+        self.args = args
+        self.on_done = on_done
+        self._cancelled = threading.Event()
+        self._last_progress = 0.0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def stale(self):
+        """Has one of the unit maps changed since the snapshot was taken?"""
+        return [um.version for um in self.unit_maps] != self.versions
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set() or self.stale()
+
+    def check(self):
+        """Raise TaskCancelled if the task has been cancelled."""
+        if self.cancelled:
+            raise TaskCancelled()
+
+    def progress(self, fraction, text=''):
+        """Report the progress (from 0 to 1) of the task."""
+        now = time.time()
+        if now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            self.executor._invoke(self.executor._set_status, "%s: %d%% %s" %
+                                  (self.name, 100 * fraction, text))
+
+    def run(self):
+        return self.function(self, self.points, *self.args)
+
+
+class TaskExecutor(HasTraits):
+    """Runs Tasks in a pool of worker threads."""
+
+    # The progress and the outcome of the tasks, for a status bar.
+    status_text = Str('')
+
+    # The number of tasks that are queued or running.
+    pending = Int(0)
+
+    # The number of worker threads.
+    threads = Int(1)
+
+    # The function used to call a function on the GUI thread, as
+    # invoke(f, *args).  The default is pyface's GUI.invoke_later.
+    invoke = Any
+
+    _queue = Any
+    _workers = Any
+    # The latest task submitted with each name.
+    _tasks = Any
+
+    def _invoke_default(self):
+        from pyface.api import GUI
+        return GUI.invoke_later
+
+    def __queue_default(self):
+        return Queue()
+
+    def __workers_default(self):
+        return []
+
+    def __tasks_default(self):
+        return {}
+
+    def submit(self, name, function, unit_maps=(), args=(), on_done=None):
+        """
+        Run function in a worker thread, and return the Task.  Call this on
+        the GUI thread.  When the function returns, on_done(result) is
+        called on the GUI thread, unless the task was cancelled.  An
+        earlier task with the same name is cancelled.
+        """
+        previous = self._tasks.get(name)
+        if previous is not None:
+            previous.cancel()
+        task = Task(self, name, function, unit_maps, args, on_done)
+        self._tasks[name] = task
+        self.pending += 1
+        self.status_text = "%s: started" % name
+        self._start_workers()
+        self._queue.put(task)
+        return task
+
+    def cancel(self, name=None):
+        """Cancel the task with the given name, or all of them."""
+        for task_name, task in self._tasks.items():
+            if name is None or task_name == name:
+                task.cancel()
+
+    def shutdown(self):
+        """Cancel the tasks, and stop the worker threads."""
+        self.cancel()
+        for worker in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    #-----------------------------------------------------------------------
+    # Private methods
+    #-----------------------------------------------------------------------
+
+    def _start_workers(self):
+        while len(self._workers) < self.threads:
+            worker = threading.Thread(target=self._work,
+                                      name='TaskExecutor worker')
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            result = error = None
+            if not task.cancelled:
+                try:
+                    result = task.run()
+                except TaskCancelled:
+                    pass
+                except Exception:
+                    error = traceback.format_exc()
+            self._invoke(self._finish, task, result, error)
+
+    def _invoke(self, function, *args):
+        self.invoke(function, *args)
+
+    def _set_status(self, text):
+        self.status_text = text
+
+    def _finish(self, task, result, error):
+        """Apply the result of a task.  This runs on the GUI thread."""
+        self.pending -= 1
+        if error is not None:
+            sys.stderr.write(error)
+        if self._tasks.get(task.name) is not task:
+            # The task was superseded by a newer one with the same name,
+            # which owns the status now.
+            return
+        del self._tasks[task.name]
+        if error is not None:
+            self.status_text = "%s: failed: %s" % \
+                               (task.name, error.strip().splitlines()[-1])
+        elif task.stale():
+            self.status_text = "%s: discarded (the map was changed)" % \
+                               task.name
+        elif task.cancelled:
+            self.status_text = "%s: cancelled" % task.name
+        else:
+            # on_done may set a more specific status.
+            self.status_text = "%s: done" % task.name
+            if task.on_done is not None:
+                task.on_done(result)
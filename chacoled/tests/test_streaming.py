@@ -0,0 +1,82 @@
+"""
+Tests of streaming.BreakpointTable against unit_map.interpolate().
+
+Run from the top directory with
+
+    python -m unittest discover chacoled/tests
+"""
+
+import unittest
+
+import numpy as np
+
+from chacoled.unit_map import UnitMap, interpolate, power_curve
+from chacoled.streaming import BreakpointTable
+
+
+class TestBreakpointTable(unittest.TestCase):
+
+    def check(self, xp, fp, x):
+        table = BreakpointTable(xp, fp)
+        expected = interpolate(xp, fp, x)
+        np.testing.assert_allclose(table.evaluate(x), expected,
+                                   rtol=0, atol=1e-12)
+        # Chunks of several sizes, through the reused buffers.
+        bounds = [0, 1, 10, len(x) // 3, len(x)]
+        chunks = [x[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        for chunk, values in zip(chunks, table.stream(chunks)):
+            np.testing.assert_allclose(values, interpolate(xp, fp, chunk),
+                                       rtol=0, atol=1e-12)
+
+    def values(self, xp, size=10000):
+        """Random values, the breakpoints and their neighbours."""
+        rng = np.random.RandomState(0)
+        x = np.concatenate([rng.rand(size), rng.rand(size) ** 8, xp,
+                            np.nextafter(xp, 2.0), np.nextafter(xp, -1.0)])
+        return np.clip(x, 0.0, 1.0)
+
+    def test_uniform(self):
+        xp = np.linspace(0.0, 1.0, 11)
+        fp = np.sin(xp)
+        self.check(xp, fp, self.values(xp))
+
+    def test_power_curve(self):
+        # The breakpoints are clustered near 0.
+        xp, fp = UnitMap.from_function(power_curve(0.05),
+                                       tol=1e-5).arrays()
+        self.check(xp, fp, self.values(xp))
+
+    def test_steep_ramp(self):
+        # Most of the breakpoints are in one cell of the search grid.
+        rng = np.random.RandomState(1)
+        n = 100000
+        xp = np.sort(np.concatenate([[0.0, 1.0],
+                                     0.5 + 1e-4 * rng.rand(n - 2)]))
+        fp = rng.rand(n, 3)
+        x = np.concatenate([0.5 + 3e-4 * (rng.rand(10000) - 0.5), xp])
+        self.check(xp, fp, np.clip(x, 0.0, 1.0))
+
+    def test_jumps(self):
+        # Repeated breakpoints: side='left' takes the value on the left.
+        xp = np.array([0.0, 0.25, 0.25, 0.25, 0.5, 1.0, 1.0])
+        fp = np.array([0.0, 1.0, 0.0, 0.5, 1.0, 0.0, 1.0])
+        self.check(xp, fp, self.values(xp))
+
+    def test_float32(self):
+        # The breakpoints are searched in float64, so the values next to
+        # the jumps are on the same side as in float64.
+        xp = np.array([0.0, 0.1, 0.1, 0.3, 0.7, 0.7, 1.0])
+        fp = np.array([0.0, 1.0, 0.0, 0.5, 1.0, 0.0, 1.0])
+        x = self.values(xp).astype(np.float32)
+        slope = np.abs(np.diff(fp) / np.diff(xp))[np.diff(xp) > 0].max()
+        bound = (2 * slope + 5) * 2.0 ** -24
+        expected = interpolate(xp, fp, x.astype(float))
+        for values in [interpolate(xp, fp, x),
+                       BreakpointTable(xp, fp).evaluate(x)]:
+            self.assertEqual(values.dtype, np.float32)
+            np.testing.assert_allclose(values, expected, rtol=0,
+                                       atol=bound)
+
+
+if __name__ == '__main__':
+    unittest.main()
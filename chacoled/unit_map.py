@@ -1,10 +1,15 @@
 """
-This module defines the UnitMap class, and a few utility functions for working
-with line segments.
+This module defines the UnitMap class, a few utility functions for working
+with line segments, and some standard curves that can be converted to
+UnitMaps with UnitMap.from_function().
 """
 
+from contextlib import contextmanager
+from itertools import chain
+
 import numpy as np
-from traits.api import HasTraits, List, Tuple
+from traits.api import (HasTraits, List, Tuple, Int, Any, TraitListEvent,
+        Undefined)
 
 
 def sign(x):
@@ -26,6 +31,26 @@ class UnitMap(HasTraits):
     # the list.)
     points = List(Tuple)
 
+    # Incremented each time `points` is changed.  Objects that cache data
+    # computed from the points can compare versions to tell whether their
+    # data is stale.
+    version = Int(0)
+
+    # Nesting depth of `batch()` blocks, and the list of points when the
+    # outermost block was entered.
+    _batch_depth = Int(0)
+    _batch_list = Any
+
+    # The changes made to _batch_list inside a batch() block: the points
+    # _batch_removed were replaced by the points [start:end] of the list,
+    # where _batch_range is (start, end).  None when nothing was changed.
+    _batch_range = Any
+    _batch_removed = Any
+
+    # The cached result of segments(), and the version it was computed for.
+    _segments = Any
+    _segments_version = Int(-1)
+
     #-----------------------------------------------------------------------
     # Traits interface
     #-----------------------------------------------------------------------
@@ -34,10 +59,41 @@ class UnitMap(HasTraits):
         points = [(0.0, 0.0), (1.0, 1.0)]
         return points
 
+    def _points_changed(self):
+        self.version += 1
+
+    def _points_items_changed(self):
+        self.version += 1
+
     #-----------------------------------------------------------------------
     # UnitMap public methods
     #-----------------------------------------------------------------------
 
+    @classmethod
+    def from_function(cls, f, tol=1e-3):
+        """
+        Create a UnitMap that approximates the function f on [0, 1].
+
+        `f` must accept an array of x values and return an array of y
+        values.  The function is sampled adaptively, with more samples where
+        its curvature is high, and then the samples are reduced to a small
+        set of points whose linear interpolation is within `tol` of f.  The
+        y values are clipped to [0, 1].
+
+        The functions power_curve, gamma_curve, loglike_curve,
+        sigmoid_curve and srgb_curve create some standard curves.
+
+        Example::
+
+            um = UnitMap.from_function(gamma_curve(2.2), tol=1e-4)
+        """
+        # Most of the tolerance is left for the simplification step.
+        x, y = sample_function(f, tol / 4)
+        y = np.clip(y, 0.0, 1.0)
+        keep = simplify(x, y, 3 * tol / 4)
+        points = list(zip(x[keep].tolist(), y[keep].tolist()))
+        return cls(points=points)
+
     def reset(self):
         """Reset the list of points to the initial state."""
         self.points = self._points_default()
@@ -48,6 +104,135 @@ class UnitMap(HasTraits):
     def flip(self):
         self.points = [(1 - x, y) for (x, y) in reversed(self.points)]
 
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that defers the change notifications of `points`.
+
+        Inside the `with` block, the points can be changed any number of
+        times (by item or by assigning a new list) without notifying any
+        listeners.  When the outermost block exits, a single 'points_items'
+        event is sent.  Its TraitListEvent describes the net change as the
+        replacement of points[index:index + len(removed)] by `added`.  No
+        event is sent if the points did not change.
+
+        The changes made by item are accumulated as they are made, so the
+        cost of the event is proportional to the number of points changed,
+        not to the length of the list.  If a new list is assigned, the old
+        and new lists are compared when the block exits.
+
+        Example::
+
+            with unit_map.batch():
+                for k in range(1, len(unit_map.points) - 1):
+                    x, y = unit_map.points[k]
+                    unit_map.points[k] = (x, y ** 2)
+        """
+        self._batch_depth += 1
+        if self._batch_depth == 1:
+            self._batch_list = self.points
+            self._batch_range = None
+            self._batch_removed = None
+            self._trait_change_notify(False)
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._trait_change_notify(True)
+                event = self._batch_event()
+                self._batch_list = None
+                self._batch_removed = None
+                if event is not None:
+                    self.trait_property_changed('points_items', Undefined,
+                                                event)
+
+    def trait_items_event(self, name, event, items_event):
+        # Called by the points list for each change by item.  Inside a
+        # batch() block, the change is accumulated instead of notified.
+        if self._batch_depth == 0 or name != 'points_items':
+            return super(UnitMap, self).trait_items_event(name, event,
+                                                          items_event)
+        points = self.points
+        if points is self._batch_list:
+            self._accumulate_change(points, event)
+
+    def arrays(self):
+        """Return the x and y values of the points as two new arrays."""
+        points = self.points
+        xy = np.fromiter(chain.from_iterable(points), dtype=float,
+                         count=2 * len(points)).reshape(-1, 2)
+        return xy[:, 0].copy(), xy[:, 1].copy()
+
+    def segments(self):
+        """
+        Return the points as segments (x, y0, y1), formatted for use by the
+        Chaco ColorMapper class, in an array with shape (m, 3).  Points with
+        the same x value are merged into one segment (a jump from y0 to y1).
+
+        The result is cached until the points change, and is read-only.
+        """
+        if self._batch_depth > 0:
+            # The version is not updated inside a batch() block.
+            return points_to_segments(*self.arrays())
+        if self._segments_version != self.version:
+            segs = points_to_segments(*self.arrays())
+            segs.flags.writeable = False
+            self._segments = segs
+            self._segments_version = self.version
+        return self._segments
+
+    def translate_points(self, indices, dx, dy):
+        """
+        Move the points with the given indices by (dx, dy), as a group.
+
+        dx is limited so that the x values remain nondecreasing, and the
+        first and last points only move vertically.  dy is limited so that
+        the y values remain between 0 and 1.  The points are changed with a
+        single slice assignment.  Returns the (dx, dy) that was applied.
+        """
+        indices = np.asarray(indices, dtype=int)
+        if len(indices) == 0:
+            return 0.0, 0.0
+        x, y = self.arrays()
+        moving = np.zeros(len(x), dtype=bool)
+        moving[indices] = True
+        xmoving = moving.copy()
+        xmoving[[0, -1]] = False
+
+        # Where a moving point is followed by a fixed one, the gap between
+        # them limits dx from above; where a fixed point is followed by a
+        # moving one, the gap limits dx from below.
+        gaps = np.diff(x)
+        if not xmoving.any():
+            dx = 0.0
+        dm = xmoving[:-1].astype(int) - xmoving[1:].astype(int)
+        if (dm == 1).any():
+            dx = min(dx, gaps[dm == 1].min())
+        if (dm == -1).any():
+            dx = max(dx, -gaps[dm == -1].min())
+        dy = min(max(dy, -y[moving].min()), 1.0 - y[moving].max())
+
+        x[xmoving] += dx
+        y[moving] += dy
+        # Guard against rounding breaking the order of the x values.
+        x = np.clip(np.maximum.accumulate(x), 0.0, 1.0)
+        self._set_slice(x, y, indices.min(), indices.max() + 1)
+        return dx, dy
+
+    def scale_points(self, indices, factor, anchor):
+        """
+        Scale the y values of the points with the given indices by `factor`
+        about the value `anchor`.  The results are clipped to [0, 1].
+        """
+        indices = np.asarray(indices, dtype=int)
+        if len(indices) == 0:
+            return
+        x, y = self.arrays()
+        y[indices] = np.clip(anchor + factor * (y[indices] - anchor),
+                             0.0, 1.0)
+        self._set_slice(x, y, indices.min(), indices.max() + 1)
+
     def add_point(self, point):
         """Add a point to the list of points."""
 
@@ -122,6 +307,30 @@ class UnitMap(HasTraits):
             y = (y2 - y1) / (x2 - x1) * (x - x1) + y1
         return y
 
+    def evaluate_array(self, x):
+        """
+        Evaluate the map at each value in the array x.  The result is the
+        same as that of evaluate(), but the values are computed with a
+        binary search instead of a linear scan of the points.  float32 and
+        float16 arrays give results of the same type (see
+        evaluation_dtypes()).
+        """
+        x = np.asarray(x, dtype=evaluation_dtypes(x)[0])
+        if x.size > 0 and (x.min() < 0.0 or x.max() > 1.0):
+            raise ValueError("evaluate_array(x) requires 0 <= x <= 1.")
+        xp, fp = self.arrays()
+        return interpolate(xp, fp, x)
+
+    def stream(self, chunks, out=None, low=0.0, high=1.0):
+        """
+        Generate the values of the map for each array in the iterable
+        chunks, reusing the same buffers for every chunk.  See
+        streaming.BreakpointTable.stream().
+        """
+        from streaming import BreakpointTable
+        return BreakpointTable.from_unit_map(self).stream(chunks, out,
+                                                          low, high)
+
     def compose(self, um):
         """The composition of this unit map with another.
 
@@ -160,6 +369,11 @@ class UnitMap(HasTraits):
     # UnitMap private methods
     #-----------------------------------------------------------------------
 
+    def _set_slice(self, x, y, start, stop):
+        """Replace points[start:stop] with the values from x and y."""
+        self.points[start:stop] = list(zip(x[start:stop].tolist(),
+                                           y[start:stop].tolist()))
+
     def _points_in_segment(self, x1, x2):
         decreasing = False
         if x2 < x1:
@@ -174,6 +388,68 @@ class UnitMap(HasTraits):
             pts.reverse()
         return pts
 
+    def _accumulate_change(self, points, event):
+        """Merge the change `event`, just made to points, into the range of
+        changes of the current batch."""
+        index, removed = event.index, event.removed
+        if isinstance(index, slice):
+            # An extended slice, which replaced as many points as it added:
+            # take it as the replacement of the range of points it spans.
+            positions = range(*index.indices(len(points)))
+            if len(positions) == 0:
+                return
+            i = min(positions)
+            added = max(positions) + 1 - i
+            removed = points[i:i + added]
+            for k, point in zip(positions, event.removed[0]):
+                removed[k - i] = point
+        else:
+            added = len(event.added)
+            # The index of an assignment to a slice past the end is not
+            # clipped.
+            i = min(index, len(points) - added)
+        delta = added - len(removed)
+        if self._batch_range is None:
+            self._batch_range = (i, i + added)
+            self._batch_removed = list(removed)
+            return
+        # Extend the range to cover this change, in the indices of the list
+        # before the change.  The points that it covers now but did not
+        # cover before are original points.
+        j = i + len(removed)
+
+        def before(a, b):
+            # The points [a:b] of the list before the change.
+            return (points[a:min(b, i)] +
+                    list(removed[max(a, i) - i:max(min(b, j) - i, 0)]) +
+                    points[max(a, j) + delta:max(b, j) + delta])
+
+        start, end = self._batch_range
+        new_start = min(start, i)
+        new_end = max(end, j)
+        self._batch_removed = (before(new_start, start) +
+                               self._batch_removed +
+                               before(end, new_end))
+        self._batch_range = (new_start, new_end + delta)
+
+    def _batch_event(self):
+        """Return the net change made in the current batch, or None."""
+        if self.points is not self._batch_list:
+            # A new list was assigned: compare it to the original points,
+            # restored by undoing the changes made to the old list.
+            old = self._batch_list
+            if self._batch_range is not None:
+                start, end = self._batch_range
+                old = old[:start] + self._batch_removed + old[end:]
+            return list_change(old, self.points)
+        if self._batch_range is None:
+            return None
+        start, end = self._batch_range
+        event = list_change(self._batch_removed, self.points[start:end])
+        if event is not None:
+            event.index += start
+        return event
+
     def __repr__(self):
         s = "UnitMap(points=%s)" % self.points
         return s
@@ -194,6 +470,121 @@ def eval_linear(x, p1, p2):
     return y
 
 
+def interpolate(xp, fp, x, side='left'):
+    """
+    Evaluate the piecewise linear function through the points (xp, fp) at
+    the values in the array x, which must be between xp[0] and xp[-1].
+
+    xp must be nondecreasing.  Where it has repeated values (a jump), the
+    value at the jump is the first of the repeated points if side is
+    'left' (as in UnitMap.evaluate()), or the last if side is 'right'.
+    fp may have more than one dimension, to evaluate several functions
+    with the same breakpoints: the result has shape x.shape + fp.shape[1:].
+
+    If x is a float32 or float16 array, the result has the same type; the
+    interval of each value is found with the float64 xp, and only the
+    tables used after that are converted (see evaluation_dtypes()).
+    """
+    dtype, compute = evaluation_dtypes(x)
+    fp = np.asarray(fp, dtype=float)
+    k, t = interpolation_weights(xp, x, side)
+    t = t.reshape(t.shape + (1,) * (fp.ndim - 1))
+    y1 = fp[:-1].astype(compute, copy=False)[k - 1]
+    dy = np.diff(fp, axis=0).astype(compute, copy=False)[k - 1]
+    return (y1 + t * dy).astype(dtype, copy=False)
+
+
+def evaluation_dtypes(x):
+    """
+    Return (dtype, compute): the type of the values of a map at the values
+    in the array x, and the type in which they are computed.
+
+    float32 data is evaluated in float32, and float16 data in float32 with
+    float16 results, so that the results and the intermediate arrays are
+    not float64.  Everything else is evaluated in float64.  The segment of
+    each value is found with the float64 breakpoints, so it is the same as
+    in float64 (in particular at the jumps); only the tables used after
+    that (the starts and the lengths of the segments, and the values and
+    the increments of the map) are converted to the compute type, from
+    their float64 values.
+
+    With float32, the difference from the float64 result is at most
+
+        (2 * S + 5) * 2**-24
+
+    where S is the largest absolute slope of the map (excluding jumps).
+    With float16, the result is also rounded to float16, which adds at
+    most 2**-12 for values in [0, 1]: below half a step of an 8 bit color
+    channel, so float16 is safe for colorization.
+    """
+    dtype = getattr(x, 'dtype', None)
+    if dtype == np.float32:
+        return np.dtype(np.float32), np.dtype(np.float32)
+    if dtype == np.float16:
+        return np.dtype(np.float16), np.dtype(np.float32)
+    return np.dtype(np.float64), np.dtype(np.float64)
+
+
+def interpolation_weights(xp, x, side='left'):
+    """
+    Return the arrays (k, t) such that the value at x of the piecewise
+    linear function through (xp, fp) is
+
+        (1 - t) * fp[k - 1] + t * fp[k]
+
+    See interpolate() for the arguments.  t has the type in which x is
+    evaluated (see evaluation_dtypes()).
+    """
+    dtype, compute = evaluation_dtypes(x)
+    xp = np.asarray(xp, dtype=float)
+    x = np.asarray(x, dtype=compute)
+    # The search is done with the float64 breakpoints whatever the type of
+    # x, and the tables of the segments are converted after it.
+    k = np.clip(np.searchsorted(xp, x, side=side), 1, len(xp) - 1)
+    x1 = xp[:-1].astype(compute, copy=False)[k - 1]
+    dx = np.diff(xp).astype(compute, copy=False)[k - 1]
+    # dx is 0 only at the ends, when the first (or last) two points have
+    # the same x value.
+    t = np.where(dx > 0, (x - x1) / np.where(dx > 0, dx, 1.0),
+                 0.0 if side == 'left' else 1.0)
+    if compute != np.float64:
+        # x1 is rounded, so x may be slightly outside its segment.
+        np.clip(t, 0.0, 1.0, out=t)
+    return k, t
+
+
+def points_to_segments(x, y):
+    """
+    Convert the points of a UnitMap, given as arrays of x and y values, to
+    an array of segments (x, y0, y1) with shape (m, 3).  Each run of points
+    with equal x values becomes one segment, with the y values of the first
+    and last points of the run.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    first = np.flatnonzero(np.concatenate(([True], x[1:] != x[:-1])))
+    last = np.concatenate((first[1:], [len(x)])) - 1
+    return np.column_stack((x[first], y[first], y[last]))
+
+
+def segments_to_points(segs):
+    """
+    Convert a sequence of segments (x, y0, y1) to a list of points (x, y).
+    A segment gives two points if y0 != y1, and one point otherwise.
+    """
+    if not isinstance(segs, np.ndarray):
+        segs = np.fromiter(chain.from_iterable(segs), dtype=float,
+                           count=3 * len(segs))
+    segs = np.asarray(segs, dtype=float).reshape(-1, 3)
+    jump = segs[:, 1] != segs[:, 2]
+    counts = 1 + jump
+    x = np.repeat(segs[:, 0], counts)
+    y = np.repeat(segs[:, 1], counts)
+    last = np.cumsum(counts) - 1
+    y[last[jump]] = segs[jump, 2]
+    return list(zip(x.tolist(), y.tolist()))
+
+
 def sqdistance(p1, p2):
     x1, y1 = p1
     x2, y2 = p2
@@ -253,16 +644,123 @@ def close_enough(p1, p2, tol):
 # Point list utility functions
 #---------------------------------------------------------------------
 
+def list_change(old, new):
+    """
+    Describe the difference between two lists of points as the replacement
+    of a single slice.
+
+    Returns a TraitListEvent `e` such that replacing
+    old[e.index:e.index + len(e.removed)] with `e.added` gives `new`, or
+    None if the lists are equal.
+    """
+    a = np.array(old, dtype=float).reshape(-1, 2)
+    b = np.array(new, dtype=float).reshape(-1, 2)
+    n = min(len(a), len(b))
+    differ = np.flatnonzero((a[:n] != b[:n]).any(axis=1))
+    start = differ[0] if len(differ) > 0 else n
+    if start == n and len(a) == len(b):
+        return None
+    # Length of the common tail, not overlapping the changed head.
+    m = n - start
+    differ = np.flatnonzero((a[len(a) - m:] != b[len(b) - m:]).any(axis=1))
+    tail = m - (differ[-1] + 1) if len(differ) > 0 else m
+    event = TraitListEvent(index=int(start),
+                           removed=list(old[start:len(a) - tail]),
+                           added=list(new[start:len(b) - tail]))
+    return event
+
+
+def sample_function(f, tol, max_points=2 ** 16 + 1):
+    """
+    Sample f on [0, 1] so that linear interpolation of the samples is within
+    tol of f.
+
+    Starting from a uniform grid, every interval whose linear interpolation
+    differs from f by more than tol at its quarter points is split in half.
+    f is called once per pass, with the test points of all the intervals.
+    Refinement stops when no interval is split, or when there would be more
+    than `max_points` samples.  Returns the arrays x and y.
+    """
+    x = np.linspace(0.0, 1.0, 17)
+    y = np.asarray(f(x), dtype=float)
+    t = np.array([0.25, 0.5, 0.75])
+    while len(x) < max_points:
+        a = x[:-1, np.newaxis]
+        dx = np.diff(x)[:, np.newaxis]
+        ya = y[:-1, np.newaxis]
+        dy = np.diff(y)[:, np.newaxis]
+        xt = a + t * dx
+        yt = np.asarray(f(xt.ravel()), dtype=float).reshape(xt.shape)
+        err = np.abs(yt - (ya + t * dy)).max(axis=1)
+        split = np.flatnonzero(err > tol)
+        if len(split) == 0:
+            break
+        split = split[:max_points - len(x)]
+        x = np.insert(x, split + 1, xt[split, 1])
+        y = np.insert(y, split + 1, yt[split, 1])
+    return x, y
+
+
+def simplify(x, y, tol):
+    """
+    Return the indices of a subset of the points (x, y) whose linear
+    interpolation is within tol of every y.
+
+    x must be increasing.  The first and last points are always kept.
+    Starting from the first point, each segment is extended as far as the
+    tolerance allows (the furthest reach is found by doubling and then
+    bisection), which gives few points at a cost of about O(n log n).
+    """
+    n = len(x)
+    keep = [0]
+    i = 0
+    while i < n - 1:
+        # Find the last j such that the segment from i to j is acceptable;
+        # i + 1 always is.
+        good = i + 1
+        step = 1
+        bad = None
+        while bad is None:
+            j = min(i + 2 * step, n - 1)
+            if j == good:
+                break
+            if _segment_within(x, y, i, j, tol):
+                good = j
+                step *= 2
+            else:
+                bad = j
+        if bad is not None:
+            while bad - good > 1:
+                j = (good + bad) // 2
+                if _segment_within(x, y, i, j, tol):
+                    good = j
+                else:
+                    bad = j
+        keep.append(good)
+        i = good
+    return np.array(keep)
+
+
+def _segment_within(x, y, i, j, tol):
+    """Is the segment from point i to point j within tol of the points?"""
+    xs = x[i:j + 1]
+    line = y[i] + (y[j] - y[i]) * (xs - x[i]) / (x[j] - x[i])
+    return np.abs(line - y[i:j + 1]).max() <= tol
+
+
 def errors2(x, y, xorig, yorig):
     yi = np.interp(xorig, x, y)
     err = yi - yorig
     return err
 
 
-def clean2(points, tol=1e-5):
+def clean2(points, tol=1e-5, callback=None):
     """
     Return a subset of points for which linear interpolation using the subset
     differs from interpolation using the original set by less than tol.
+
+    If callback is given, it is called as callback(k, n) before point k of
+    the n remaining points is tested, e.g. to report progress.
     """
     xlist = []
     ylist = []
@@ -277,6 +775,8 @@ def clean2(points, tol=1e-5):
     k = 1
     ndel = 0
     while k < len(x) - 1:
+        if callback is not None:
+            callback(k, len(x))
         xnew = np.hstack((x[:k], x[k + 1:]))
         ynew = np.hstack((y[:k], y[k + 1:]))
         e2 = errors2(xnew, ynew, xorig, yorig)
@@ -293,3 +793,69 @@ def clean2(points, tol=1e-5):
     #    print "Absolute value of max difference is %g" % e2max
     new_points = zip(x, y)
     return new_points
+
+
+#---------------------------------------------------------------------
+# Standard curves, for use with UnitMap.from_function().  Each function
+# returns a vectorized function that maps [0, 1] onto [0, 1].
+#---------------------------------------------------------------------
+
+def power_curve(power):
+    """y = x**power"""
+    def f(x):
+        return np.asarray(x, dtype=float) ** power
+    return f
+
+
+def gamma_curve(gamma):
+    """Gamma encoding: y = x**(1/gamma)"""
+    return power_curve(1.0 / gamma)
+
+
+def loglike_curve(scale, n=10):
+    """
+    The curve made by UnitMapEditor.make_loglike() with n + 1 points:
+    the y values k/n are at x values whose successive differences have
+    the constant ratio `scale`.
+    """
+    def f(x):
+        x = np.asarray(x, dtype=float)
+        if scale == 1.0:
+            return x
+        return np.log1p(x * (scale ** n - 1.0)) / (n * np.log(scale))
+    return f
+
+
+def sigmoid_curve(gain=10.0, center=0.5):
+    """
+    A logistic curve with the given gain and center, rescaled so that it
+    maps 0 to 0 and 1 to 1.
+    """
+    def logistic(x):
+        return 1.0 / (1.0 + np.exp(-gain * (x - center)))
+    lo = logistic(0.0)
+    hi = logistic(1.0)
+
+    def f(x):
+        return (logistic(np.asarray(x, dtype=float)) - lo) / (hi - lo)
+    return f
+
+
+def srgb_curve(inverse=False):
+    """
+    The sRGB transfer function, from linear intensity to encoded value.
+    If `inverse` is True, the decoding function is returned instead.
+    """
+    def encode(x):
+        x = np.asarray(x, dtype=float)
+        return np.where(x <= 0.0031308, 12.92 * x,
+                        1.055 * np.maximum(x, 0.0031308) ** (1 / 2.4) - 0.055)
+
+    def decode(x):
+        x = np.asarray(x, dtype=float)
+        return np.where(x <= 0.04045, x / 12.92,
+                        ((np.maximum(x, 0.04045) + 0.055) / 1.055) ** 2.4)
+
+    if inverse:
+        return decode
+    return encode
@@ -1,15 +1,19 @@
 
 from __future__ import with_statement
 
+from contextlib import contextmanager
 from math import sqrt
 
+import numpy as np
 from traits.api import List, Tuple, Int, Instance, Enum, Float, \
-            Bool, Property, Event, Str, Trait, on_trait_change
+            Bool, Property, Event, Str, Trait, Any, Array, on_trait_change
 from enable.api import Component, KeySpec, BasicEvent
+from kiva.image import GraphicsContext
 from kiva.trait_defs.api import KivaFont
 from pyface.action.api import Action, MenuManager, Separator
 
-from unit_map import UnitMap
+from unit_map import UnitMap, clean2
+from instrument import recorder
 
 
 point_fmt = "(%.3f,%.3f)"
@@ -33,107 +37,275 @@ class UnitMapPlotter(Component):
     grid_resolutions = List([1, 2, 4, 5, 8, 10, 16, 20, 40, 50])
     grid_resolution_index = Int(5)
 
-    _points = Property(List(Tuple),
-                       depends_on=['unit_map.points', 'width', 'height'])
+    updated = Event
+
+    # The interval of x values of the unit map affected by the most recent
+    # change of the points.
+    updated_range = Tuple((0.0, 1.0))
+
+    # The points of the unit map in screen coordinates (relative to the
+    # lower left corner of the grid), as an (n, 2) array.
+    _points = Property(Array)
+
+    # The cached value of `_points`; None when it must be recomputed.
+    _screen_points = Any
+
+    # The level of detail used to draw the curve and the markers, as a tuple
+    # (key, curve_indices, marker_indices).  See _level_of_detail().
+    _lod = Any
+
+    # Offscreen image of the layers that do not depend on the unit map
+    # (background, border, label and grid).  It is None when it must be
+    # rendered again.
+    _static_layer = Any
+
+    # The part of the grid that must be drawn by the next call to draw(),
+    # as a list [x, y, width, height] in the coordinates of `_points`.  None
+    # means that the whole component must be drawn.
+    _damaged_region = Any
+
+    # True while _redraw_region() requests its redraw.  Any other redraw
+    # request invalidates the whole component.
+    _redrawing_region = Bool(False)
 
     def draw(self, gc, view_bounds=None, mode="default"):
+        with recorder.stage('draw'):
+            self._draw(gc)
+
+    def _draw(self, gc):
+        if self._static_layer is None:
+            self._static_layer = self._render_static_layer()
+        region = self._damaged_region
+        self._damaged_region = None
         delta = self.marker_size / 2
-        w = self.width - 2 * delta
-        h = self.height - 2 * delta
         with gc:
             gc.translate_ctm(self.x + delta, self.y + delta)
-            # Background color.
-            gc.set_fill_color(self.background_color)
-            gc.move_to(0, 0)
-            gc.line_to(w, 0)
-            gc.line_to(w, h)
-            gc.line_to(0, h)
-            gc.line_to(0, 0)
-            gc.fill_path()
-            # Draw the border of the grid.
-            gc.set_fill_color((0.1, 0.1, 0.1))
-            gc.move_to(0, 0)
-            gc.line_to(w, 0)
-            gc.line_to(w, h)
-            gc.line_to(0, h)
-            gc.line_to(0, 0)
-            gc.stroke_path()
+            if region is None:
+                curve_indices, marker_indices = self._level_of_detail()
+            else:
+                # Only the strokes and markers that can intersect the
+                # damaged region are drawn, over the static layer.
+                gc.clip_to_rect(*region)
+                xs = self._points[:, 0]
+                lo = max(np.searchsorted(xs, region[0]) - 1, 0)
+                hi = np.searchsorted(xs, region[0] + region[2], side='right')
+                curve_indices = marker_indices = slice(lo, hi + 1)
+            gc.draw_image(self._static_layer,
+                          (-delta, -delta, self._static_layer.width(),
+                           self._static_layer.height()))
+            self._draw_curve(gc, curve_indices)
+            self._draw_markers(gc, marker_indices)
+
+    def _render_static_layer(self):
+        """Render the background, border, label and grid to an image."""
+        size = (max(int(self.width), 1), max(int(self.height), 1))
+        layer = GraphicsContext(size)
+        layer.clear((0.0, 0.0, 0.0, 0.0))
+        delta = self.marker_size / 2
+        with layer:
+            layer.translate_ctm(delta, delta)
+            self._draw_static(layer)
+        return layer
 
-            if self.label:
-                gc.set_font(self.font)
-                gc.set_fill_color(self.grid_color + (0.5,))
-                gc.show_text(self.label, (5, h - 15))
-
-            # Draw the grid.
-            res = self.grid_resolutions[self.grid_resolution_index]
-            # Vertical grid lines:
-            for k in range(1, res):
-                if 2 * k == res:
-                    gc.set_line_width(1.5)
-                    gc.set_stroke_color(self.grid_color + (0.85,))
-                else:
-                    gc.set_line_width(1.0)
-                    gc.set_stroke_color(self.grid_color + (0.5,))
-                r = k * w / float(res)
-                gc.move_to(r, 0)
-                gc.line_to(r, h)
-                gc.stroke_path()
-            # Horizontal grid lines:
-            for k in range(1, res):
-                if 2 * k == res:
-                    gc.set_line_width(1.5)
-                    gc.set_stroke_color(self.grid_color + (0.85,))
-                else:
-                    gc.set_line_width(1.0)
-                    gc.set_stroke_color(self.grid_color + (0.5,))
-                r = k * h / float(res)
-                gc.move_to(0, r)
-                gc.line_to(w, r)
-                gc.stroke_path()
-
-            # Draw the lines.
-            gc.set_stroke_color(self.line_color)
-            gc.set_line_width(3.0)
-            gc.move_to(*self._points[0])
-            for point in self._points[1:]:
-                gc.line_to(*point)
-            gc.stroke_path()
-            # Draw the point markers.
-            gc.set_line_width(1.0)
-            for k, point in enumerate(self._points):
-                x = point[0] - delta
-                y = point[1] - delta
-                gc.set_fill_color(self.line_color)
-                gc.rect(x, y, 2 * delta, 2 * delta)
-                gc.draw_path()
-
-    # @cached_property
-    def _get__points(self):
+    def _draw_static(self, gc):
         delta = self.marker_size / 2
         w = self.width - 2 * delta
         h = self.height - 2 * delta
-        _points = [(p[0] * w, p[1] * h) for p in self.unit_map.points]
-        return _points
+        # Background color.
+        gc.set_fill_color(self.background_color)
+        gc.move_to(0, 0)
+        gc.line_to(w, 0)
+        gc.line_to(w, h)
+        gc.line_to(0, h)
+        gc.line_to(0, 0)
+        gc.fill_path()
+        # Draw the border of the grid.
+        gc.set_fill_color((0.1, 0.1, 0.1))
+        gc.move_to(0, 0)
+        gc.line_to(w, 0)
+        gc.line_to(w, h)
+        gc.line_to(0, h)
+        gc.line_to(0, 0)
+        gc.stroke_path()
+
+        if self.label:
+            gc.set_font(self.font)
+            gc.set_fill_color(self.grid_color + (0.5,))
+            gc.show_text(self.label, (5, h - 15))
+
+        # Draw the grid.
+        res = self.grid_resolutions[self.grid_resolution_index]
+        # Vertical grid lines:
+        for k in range(1, res):
+            if 2 * k == res:
+                gc.set_line_width(1.5)
+                gc.set_stroke_color(self.grid_color + (0.85,))
+            else:
+                gc.set_line_width(1.0)
+                gc.set_stroke_color(self.grid_color + (0.5,))
+            r = k * w / float(res)
+            gc.move_to(r, 0)
+            gc.line_to(r, h)
+            gc.stroke_path()
+        # Horizontal grid lines:
+        for k in range(1, res):
+            if 2 * k == res:
+                gc.set_line_width(1.5)
+                gc.set_stroke_color(self.grid_color + (0.85,))
+            else:
+                gc.set_line_width(1.0)
+                gc.set_stroke_color(self.grid_color + (0.5,))
+            r = k * h / float(res)
+            gc.move_to(0, r)
+            gc.line_to(w, r)
+            gc.stroke_path()
+
+    def _draw_curve(self, gc, indices):
+        # Draw the lines.
+        gc.set_stroke_color(self.line_color)
+        gc.set_line_width(3.0)
+        gc.begin_path()
+        gc.lines(self._points[indices])
+        gc.stroke_path()
+
+    def _draw_markers(self, gc, indices):
+        # Draw the point markers.
+        delta = self.marker_size / 2
+        points = self._points[indices]
+        rects = np.empty((len(points), 4))
+        rects[:, :2] = points - delta
+        rects[:, 2:] = 2 * delta
+        gc.set_line_width(1.0)
+        gc.set_fill_color(self.line_color)
+        gc.begin_path()
+        gc.rects(rects)
+        gc.draw_path()
+
+    def _level_of_detail(self):
+        """
+        Return the indices of the points to use to draw the curve and the
+        markers at the current size of the component.
+
+        When there are more points than pixel columns, the curve is reduced
+        to the first, lowest, highest and last point in each column, which
+        draws the same pixels.  When the markers would overlap, only one
+        marker is drawn in each marker-sized cell.  The result is cached
+        until the points or the size change.
+        """
+        key = (self.unit_map.version, self.width, self.height,
+               self.marker_size)
+        if self._lod is None or self._lod[0] != key:
+            points = self._points
+            w = self.width - self.marker_size
+            if len(points) > w:
+                curve_indices = column_envelope(points)
+            else:
+                curve_indices = slice(None)
+            if len(points) * self.marker_size > w:
+                marker_indices = occupied_cells(points, self.marker_size)
+            else:
+                marker_indices = slice(None)
+            self._lod = (key, curve_indices, marker_indices)
+        return self._lod[1:]
+
+    def _redraw_region(self, lower, upper):
+        """
+        Request a redraw of the rectangle with corners `lower` and `upper`
+        (in the coordinates of `_points`), enlarged to cover the line width
+        and the markers.
+        """
+        pad = self.marker_size / 2 + 2
+        x0, y0 = np.asarray(lower) - pad
+        x1, y1 = np.asarray(upper) + pad
+        if self._damaged_region is not None:
+            # Merge with the region that has not been drawn yet.
+            rx, ry, rw, rh = self._damaged_region
+            x0, y0 = min(x0, rx), min(y0, ry)
+            x1, y1 = max(x1, rx + rw), max(y1, ry + rh)
+        self._damaged_region = [x0, y0, x1 - x0, y1 - y0]
+        delta = self.marker_size / 2
+        self._redrawing_region = True
+        try:
+            self.invalidate_draw(damaged_regions=[[x0 + delta, y0 + delta,
+                                                   x1 - x0, y1 - y0]],
+                                 self_relative=True)
+            self.request_redraw()
+        finally:
+            self._redrawing_region = False
+
+    def invalidate_draw(self, damaged_regions=None, self_relative=False):
+        # Only the redraws requested by _redraw_region() are partial; the
+        # window keeps the rest of the previous frame only when every
+        # invalidation since it was drawn was a partial one.
+        if not self._redrawing_region:
+            self._damaged_region = None
+        super(UnitMapPlotter, self).invalidate_draw(damaged_regions,
+                                                    self_relative)
+
+    def request_redraw(self):
+        if not self._redrawing_region:
+            self._damaged_region = None
+        super(UnitMapPlotter, self).request_redraw()
+
+    def _get__points(self):
+        if self._screen_points is None:
+            self._screen_points = self._to_screen(self.unit_map.points)
+        return self._screen_points
+
+    def _to_screen(self, points):
+        """Convert a sequence of unit map points to an (n, 2) array of
+        screen coordinates."""
+        delta = self.marker_size / 2
+        scale = np.array([self.width - 2 * delta, self.height - 2 * delta])
+        return np.array(points, dtype=float).reshape(-1, 2) * scale
 
     @on_trait_change('unit_map, unit_map.points')
-    def data_changed(self):
-        # self._compute_screen_points()
-        self.request_redraw()
+    def data_changed(self, obj, name, new):
+        with recorder.stage('data_changed'):
+            if (name == 'points_items' and self._screen_points is not None and
+                    isinstance(new.index, int) and
+                    len(new.added) == len(new.removed) > 0):
+                # Points were replaced (e.g. by a drag), so only those rows of
+                # the screen coordinates need to be updated, and only the
+                # segments next to them need to be redrawn.
+                k = new.index
+                m = len(new.added)
+                lo = max(k - 1, 0)
+                hi = min(k + m, len(self._screen_points) - 1)
+                old = self._screen_points[lo:hi + 1].copy()
+                self._screen_points[k:k + m] = self._to_screen(new.added)
+                changed = np.vstack((old, self._screen_points[lo:hi + 1]))
+                lower = changed.min(axis=0)
+                upper = changed.max(axis=0)
+                self._redraw_region(lower, upper)
+                w = self.width - 2 * (self.marker_size / 2)
+                self.updated_range = (max(lower[0] / w, 0.0),
+                                      min(upper[0] / w, 1.0))
+            else:
+                self._screen_points = None
+                self.updated_range = (0.0, 1.0)
+                self.request_redraw()
         self.updated = True
 
-    @on_trait_change('background_color, line_color, grid_color')
+    @on_trait_change('marker_size, bounds, bounds_items')
+    def _screen_scale_changed(self):
+        self._screen_points = None
+
+    @on_trait_change('line_color')
     def color_changed(self):
         self.request_redraw()
 
-    def _grid_resolution_index_changed(self):
+    @on_trait_change('background_color, grid_color, grid_resolution_index, '
+                     'label, font, marker_size, bounds, bounds_items')
+    def static_layer_changed(self):
+        # The cached image is rendered again by the next call to draw().
+        self._static_layer = None
         self.request_redraw()
 
 
-# FIXME: UnitMapEditor should be a subclass of UnitMapPlotter.
+class UnitMapEditor(UnitMapPlotter):
 
-class UnitMapEditor(Component):
-
-    event_state = Enum('normal', 'over', 'drag')
+    event_state = Enum('normal', 'over', 'drag', 'select', 'group_drag')
 
     reset_key = Instance(KeySpec, args=("r",))
     delete_key = Instance(KeySpec, args=("Delete",))
@@ -147,28 +319,18 @@ class UnitMapEditor(Component):
     snap_enable_key = Instance(KeySpec, args=("s",))
     snap_disable_key = Instance(KeySpec, args=("S", "Shift"))
     transpose_key = Instance(KeySpec, args=("t",))
+    scale_up_key = Instance(KeySpec, args=("]",))
+    scale_down_key = Instance(KeySpec, args=("[",))
+    offset_up_key = Instance(KeySpec, args=("Up",))
+    offset_down_key = Instance(KeySpec, args=("Down",))
+    clear_selection_key = Instance(KeySpec, args=("Esc",))
 
     menu = Instance(MenuManager)
     selected_menu = Instance(MenuManager)
 
     menu_event = Instance(BasicEvent)
 
-    unit_map = Instance(UnitMap, ())
-
-    font = KivaFont("modern 10")
-
-    # A text label drawn in the upper left corner.
-    label = Trait(None, None, Str)
-
-    marker_size = Int(7)
-
-    background_color = Tuple  # FIXME: Use a Color trait?
     selected_color = Tuple((0.0, 1.0, 1.0))
-    line_color = Tuple((0.0, 0.0, 0.0))
-    grid_color = Tuple((0.0, 0.0, 0.0))
-
-    grid_resolutions = List([1, 2, 4, 5, 8, 10, 16, 20, 40, 50])
-    grid_resolution_index = Int(5)
 
     snap_to_grid = Bool(False)
 
@@ -177,18 +339,47 @@ class UnitMapEditor(Component):
     loglike_scale = Float(sqrt(2.0))
     power = Float(2.0)
 
-    status_text = Str('')
-
-    updated = Event
+    # The factor used by the scale keys and the step used by the offset
+    # keys when they are applied to the selected points.
+    scale_step = Float(1.1)
+    offset_step = Float(0.01)
 
-    _points = Property(List(Tuple),
-                       depends_on=['unit_map.points', 'width', 'height'])
+    status_text = Str('')
 
     _near_threshold = Int(10)
 
     _drag_index = Int(0)
     _over_index = Int(-1)
 
+    # The indices of the selected points, as a sorted integer array.
+    _selected = Array(dtype=int, shape=(None,), value=np.zeros(0, dtype=int))
+
+    # The index of the point about which the selection is scaled.
+    _anchor_index = Int(-1)
+
+    # The corners of the rubber band while in the 'select' state, and
+    # whether the points inside it are added to the current selection.
+    _band = Any
+    _band_extends = Bool(False)
+
+    # The position of the pointer at the previous step of a group drag.
+    _drag_origin = Any
+
+    # A session.SessionRecorder that records the events dispatched to the
+    # editor, or None.
+    session_recorder = Any
+
+    # A tasks.TaskExecutor that runs the slow operations (e.g. Clean) in a
+    # worker thread, or None to run them directly.
+    task_executor = Any
+
+    def dispatch(self, event, suffix):
+        dispatch = super(UnitMapEditor, self).dispatch
+        if self.session_recorder is not None:
+            self.session_recorder.dispatch(self, event, suffix, dispatch)
+        else:
+            dispatch(event, suffix)
+
     def make_loglike(self):
         beta = self.loglike_scale
         n = len(self.unit_map.points) - 1
@@ -202,46 +393,58 @@ class UnitMapEditor(Component):
                 y = float(k) / n
                 x = (beta ** k - 1) / b
                 points.append((x, y))
-        self.unit_map.points = points
-        self.set_status_text("Made log-like")
-        self.updated = True
+        with self._edit():
+            self.unit_map.points = points
+            self.set_status_text("Made log-like")
 
     def make_power(self):
-        self.unit_map.points = [(x, x ** self.power)
-                                for (x, y) in self.unit_map.points]
-        self.set_status_text("Made power")
-        self.updated = True
+        with self._edit():
+            self.unit_map.points = [(x, x ** self.power)
+                                    for (x, y) in self.unit_map.points]
+            self.set_status_text("Made power")
 
     def do_transpose(self):
-        if self.unit_map.invertible():
-            if self.unit_map.points[0][1] == 1.0:
-                pts = reversed(self.unit_map.points)
+        with self._edit():
+            if self.unit_map.invertible():
+                if self.unit_map.points[0][1] == 1.0:
+                    pts = reversed(self.unit_map.points)
+                else:
+                    pts = self.unit_map.points
+                self.unit_map.points = [(y, x) for (x, y) in pts]
+                self.set_status_text("Transposed")
             else:
-                pts = self.unit_map.points
-            self.unit_map.points = [(y, x) for (x, y) in pts]
-            self.set_status_text("Transposed")
-        else:
-            self.set_status_text("Can't transpose, not invertible")
-        self.updated = True
+                self.set_status_text("Can't transpose, not invertible")
 
     def do_vertical_flip(self):
-        self.unit_map.invert()
-        self.set_status_text("Vertically flipped")
-        self.updated = True
+        with self._edit():
+            self.unit_map.invert()
+            self.set_status_text("Vertically flipped")
 
     def do_horizontal_flip(self):
-        self.unit_map.flip()
-        self.set_status_text("Horizontally flipped")
-        self.updated = True
+        with self._edit():
+            self.unit_map.flip()
+            self.set_status_text("Horizontally flipped")
 
     def do_clean(self):
-        num_deleted = self.unit_map.clean(tol=self.clean_tol)
-        if num_deleted > 0:
-            s = 's' * (num_deleted > 1)
-            self.set_status_text("%d point%s deleted" % (num_deleted, s))
-        else:
-            self.set_status_text("No points deleted")
-        self.updated = True
+        if self.task_executor is not None:
+            # Clean a snapshot of the points in a worker thread.  The result
+            # is discarded if the points are changed in the meantime.
+            self.task_executor.submit(
+                    "Clean %s" % (self.label or ''), _clean_points,
+                    [self.unit_map], args=(self.clean_tol,),
+                    on_done=self._apply_clean)
+            return
+        self._apply_clean(clean2(self.unit_map.points, self.clean_tol))
+
+    def _apply_clean(self, points):
+        with self._edit():
+            num_deleted = len(self.unit_map.points) - len(points)
+            self.unit_map.points = points
+            if num_deleted > 0:
+                s = 's' * (num_deleted > 1)
+                self.set_status_text("%d point%s deleted" % (num_deleted, s))
+            else:
+                self.set_status_text("No points deleted")
 
     def use_next_grid_size(self, increment=1):
         self.grid_resolution_index = \
@@ -249,82 +452,7 @@ class UnitMapEditor(Component):
                  len(self.grid_resolutions))
         self.request_redraw()
 
-    def draw(self, gc, view_bounds=None, mode="default"):
-        delta = self.marker_size / 2
-        w = self.width - 2 * delta
-        h = self.height - 2 * delta
-        with gc:
-            gc.translate_ctm(self.x + delta, self.y + delta)
-            # Background color.
-            gc.set_fill_color(self.background_color)
-            gc.move_to(0, 0)
-            gc.line_to(w, 0)
-            gc.line_to(w, h)
-            gc.line_to(0, h)
-            gc.line_to(0, 0)
-            gc.fill_path()
-            # Draw the border of the grid.
-            gc.set_fill_color((0.1, 0.1, 0.1))
-            gc.move_to(0, 0)
-            gc.line_to(w, 0)
-            gc.line_to(w, h)
-            gc.line_to(0, h)
-            gc.line_to(0, 0)
-            gc.stroke_path()
-
-            if self.label:
-                gc.set_font(self.font)
-                gc.set_fill_color(self.grid_color + (0.5,))
-                gc.show_text(self.label, (5, h - 15))
-
-            # Draw the grid.
-            res = self.grid_resolutions[self.grid_resolution_index]
-            # Vertical grid lines:
-            for k in range(1, res):
-                if 2 * k == res:
-                    gc.set_line_width(1.5)
-                    gc.set_stroke_color(self.grid_color + (0.85,))
-                else:
-                    gc.set_line_width(1.0)
-                    gc.set_stroke_color(self.grid_color + (0.5,))
-                r = k * w / float(res)
-                gc.move_to(r, 0)
-                gc.line_to(r, h)
-                gc.stroke_path()
-            # Horizontal grid lines:
-            for k in range(1, res):
-                if 2 * k == res:
-                    gc.set_line_width(1.5)
-                    gc.set_stroke_color(self.grid_color + (0.85,))
-                else:
-                    gc.set_line_width(1.0)
-                    gc.set_stroke_color(self.grid_color + (0.5,))
-                r = k * h / float(res)
-                gc.move_to(0, r)
-                gc.line_to(w, r)
-                gc.stroke_path()
-
-            # Draw the lines.
-            gc.set_stroke_color(self.line_color)
-            gc.set_line_width(3.0)
-            gc.move_to(*self._points[0])
-            for point in self._points[1:]:
-                gc.line_to(*point)
-            gc.stroke_path()
-            # Draw the point markers.
-            gc.set_line_width(1.0)
-            for k, point in enumerate(self._points):
-                x = point[0] - delta
-                y = point[1] - delta
-                if k == self._over_index:
-                    gc.set_fill_color(self.selected_color)
-                else:
-                    gc.set_fill_color(self.line_color)
-                gc.rect(x, y, 2 * delta, 2 * delta)
-                gc.draw_path()
-
     def normal_mouse_move(self, event):
-        #over = self._over_point(event)
         over = self._closest_within_threshold(event)
         if over is not None:
             self._over_index = over
@@ -332,15 +460,17 @@ class UnitMapEditor(Component):
             self.request_redraw()
 
     def normal_key_pressed(self, event):
+        if self._selection_key_pressed(event):
+            return
         if self.add_key.match(event):
             delta = self.marker_size / 2
             x = event.x - delta
             w = self.width - 2 * delta
             xx = float(x) / w
-            if 0.0 <= xx <= 1.0:
-                yy = self.unit_map.evaluate(xx)
-                self.unit_map.add_point((xx, yy))
-            self.updated = True
+            with self._edit():
+                if 0.0 <= xx <= 1.0:
+                    yy = self.unit_map.evaluate(xx)
+                    self.unit_map.add_point((xx, yy))
         elif self.invert_key.match(event):
             self.do_vertical_flip()
         elif self.flip_key.match(event):
@@ -350,10 +480,10 @@ class UnitMapEditor(Component):
         elif self.log_key.match(event):
             self.make_loglike()
         elif self.reset_key.match(event):
-            self.unit_map.reset()
+            with self._edit():
+                self.unit_map.reset()
             self.over_index = -1
             self.event_state = 'normal'
-            self.updated = True
         elif self.increase_grid_key.match(event):
             self.use_next_grid_size()
         elif self.decrease_grid_key.match(event):
@@ -372,11 +502,12 @@ class UnitMapEditor(Component):
         x = event.x - delta
         w = self.width - 2 * delta
         xx = float(x) / w
-        if 0.0 <= xx <= 1.0:
-            yy = self.unit_map.evaluate(xx)
-            self.unit_map.add_point((xx, yy))
-            self.set_status_text("Added a point at " + point_fmt % (xx, yy))
-        self.updated = True
+        with self._edit():
+            if 0.0 <= xx <= 1.0:
+                yy = self.unit_map.evaluate(xx)
+                self.unit_map.add_point((xx, yy))
+                self.set_status_text("Added a point at " +
+                                     point_fmt % (xx, yy))
 
     def normal_right_up(self, event):
         """Activate the menu."""
@@ -385,7 +516,6 @@ class UnitMapEditor(Component):
         menu.show(event.x, event.window._flip_y(event.y))
 
     def over_mouse_move(self, event):
-        # over = self._over_point(event)
         over = self._closest_within_threshold(event)
         if over is None:
             self._over_index = -1
@@ -396,9 +526,121 @@ class UnitMapEditor(Component):
             self._over_index = over
             self.request_redraw()
 
+    def normal_left_down(self, event):
+        """Left button down away from the points: start a rubber band."""
+        p = self._event_point(event)
+        self._band = (p, p)
+        self._band_extends = event.shift_down
+        self.event_state = 'select'
+
+    def select_mouse_move(self, event):
+        self._band = (self._band[0], self._event_point(event))
+        self.request_redraw()
+
+    def select_left_up(self, event):
+        (x0, y0), (x1, y1) = self._band[0], self._event_point(event)
+        xlo, xhi = min(x0, x1), max(x0, x1)
+        ylo, yhi = min(y0, y1), max(y0, y1)
+        xs = self._points[:, 0]
+        lo = np.searchsorted(xs, xlo, side='left')
+        hi = np.searchsorted(xs, xhi, side='right')
+        ys = self._points[lo:hi, 1]
+        inside = lo + np.flatnonzero((ys >= ylo) & (ys <= yhi))
+        if self._band_extends:
+            inside = np.union1d(self._selected, inside)
+        self._selected = inside
+        self._anchor_index = -1
+        self._band = None
+        self.event_state = 'normal'
+        self.set_status_text("%d points selected" % len(inside))
+        self.request_redraw()
+
+    def select_mouse_leave(self, event):
+        self._band = None
+        self.event_state = 'normal'
+        self.request_redraw()
+
     def over_left_down(self, event):
-        self._drag_index = self._over_index
-        self.event_state = 'drag'
+        k = self._over_index
+        if event.shift_down:
+            # Shift-click adds the point to, or removes it from, the
+            # selection.
+            if k in self._selected:
+                self._selected = np.setdiff1d(self._selected, [k])
+            else:
+                self._selected = np.union1d(self._selected, [k])
+                self._anchor_index = k
+            self.request_redraw()
+        elif k in self._selected and len(self._selected) > 1:
+            self._anchor_index = k
+            self._drag_origin = self._event_point(event)
+            self.event_state = 'group_drag'
+        else:
+            self.clear_selection()
+            self._drag_index = k
+            self.event_state = 'drag'
+
+    def group_drag_mouse_move(self, event):
+        x, y = self._event_point(event)
+        x0, y0 = self._drag_origin
+        delta = self.marker_size / 2
+        w = float(self.width - 2 * delta)
+        h = float(self.height - 2 * delta)
+        with self._edit():
+            dx, dy = self.unit_map.translate_points(self._selected,
+                                                    (x - x0) / w,
+                                                    (y - y0) / h)
+            self.set_status_text(("Moved %d points by " % len(self._selected))
+                                 + point_fmt % (dx, dy))
+        # The move may have been limited by the constraints, so only the
+        # part that was applied is consumed.
+        self._drag_origin = (x0 + dx * w, y0 + dy * h)
+
+    def group_drag_left_up(self, event):
+        over = self._closest_within_threshold(event)
+        if over is not None:
+            self.event_state = 'over'
+            self._over_index = over
+        else:
+            self.event_state = 'normal'
+            self._over_index = -1
+        self.request_redraw()
+
+    def group_drag_mouse_leave(self, event):
+        self.event_state = 'normal'
+        self._over_index = -1
+        self.request_redraw()
+
+    def offset_selected(self, dy):
+        """Move the selected points vertically by dy, as a group."""
+        with self._edit():
+            dx, dy = self.unit_map.translate_points(self._selected, 0.0, dy)
+            self.set_status_text(("Moved %d points by " % len(self._selected))
+                                 + point_fmt % (dx, dy))
+
+    def scale_selected(self, factor):
+        """
+        Scale the y values of the selected points by `factor`, about the
+        y value of the anchor point (the point most recently clicked), or
+        about their mean if there is no anchor.
+        """
+        if len(self._selected) == 0:
+            return
+        y = np.array([self.unit_map.points[k][1] for k in self._selected])
+        if self._anchor_index in self._selected:
+            anchor = self.unit_map.points[self._anchor_index][1]
+        else:
+            anchor = y.mean()
+        with self._edit():
+            self.unit_map.scale_points(self._selected, factor, anchor)
+            self.set_status_text("Scaled %d points by %.3f" %
+                                 (len(self._selected), factor))
+
+    def clear_selection(self):
+        if len(self._selected) > 0:
+            self._selected = np.zeros(0, dtype=int)
+            self._anchor_index = -1
+            self.request_redraw()
 
     def over_right_up(self, event):
         """Activate the selected menu."""
@@ -408,14 +650,16 @@ class UnitMapEditor(Component):
 
     def do_delete_selected_point(self):
         if 0 < self._over_index < len(self._points) - 1:
-            self.unit_map.points.pop(self._over_index)
-            self._over_index = -1
-            self.event_state = 'normal'
-            self.set_status_text('Deleted the selected point')
-            self.updated = True
+            with self._edit():
+                self.unit_map.points.pop(self._over_index)
+                self._over_index = -1
+                self.event_state = 'normal'
+                self.set_status_text('Deleted the selected point')
 
     def over_key_pressed(self, event):
         # FIXME: Code duplication in this function and normal_key_pressed.
+        if self._selection_key_pressed(event):
+            return
         if self.delete_key.match(event):
             self.do_delete_selected_point()
         elif self.invert_key.match(event):
@@ -478,16 +722,14 @@ class UnitMapEditor(Component):
         if y > h:
             y = h
 
-        self._points[k] = (x, y)
         w = self.width - 2 * delta
         h = self.height - 2 * delta
         xx = float(x) / w
         yy = float(y) / h
-        self.unit_map.points[k] = (xx, yy)
-        self.request_redraw()
-        self.set_status_text("Moved point to " + point_fmt %
-                             self.unit_map.points[k])
-        self.updated = True
+        with self._edit():
+            self.unit_map.points[k] = (xx, yy)
+            self.set_status_text("Moved point to " + point_fmt %
+                                 self.unit_map.points[k])
 
     def drag_mouse_leave(self, event):
 
@@ -504,7 +746,7 @@ class UnitMapEditor(Component):
         i = self._drag_index
         self.release_dragged_point(i)
 
-        over = self._over_point(event)
+        over = self._closest_within_threshold(event)
         if over is not None:
             self.event_state = 'over'
             self._over_index = over
@@ -515,21 +757,70 @@ class UnitMapEditor(Component):
         self.request_redraw()
 
     def release_dragged_point(self, i):
-        if self.snap_to_grid:
-            i = self._drag_index
-            x, y = self.unit_map.points[i]
-            res = self.grid_resolutions[self.grid_resolution_index]
-            xx = round(x * res) / res
-            yy = round(y * res) / res
-            if (i < len(self.unit_map.points) - 1 and
-                    xx > self.unit_map.points[i + 1][0]):
-                xx = self.unit_map.points[i + 1][0]
-            if i > 0 and xx < self.unit_map.points[i - 1][0]:
-                xx = self.unit_map.points[i - 1][0]
-            self.unit_map.points[i] = (xx, yy)
-        self.set_status_text("Moved point to " + point_fmt %
-                             self.unit_map.points[i])
-        self.updated = True
+        with self._edit():
+            if self.snap_to_grid:
+                i = self._drag_index
+                x, y = self.unit_map.points[i]
+                res = self.grid_resolutions[self.grid_resolution_index]
+                xx = round(x * res) / res
+                yy = round(y * res) / res
+                if (i < len(self.unit_map.points) - 1 and
+                        xx > self.unit_map.points[i + 1][0]):
+                    xx = self.unit_map.points[i + 1][0]
+                if i > 0 and xx < self.unit_map.points[i - 1][0]:
+                    xx = self.unit_map.points[i - 1][0]
+                self.unit_map.points[i] = (xx, yy)
+            self.set_status_text("Moved point to " + point_fmt %
+                                 self.unit_map.points[i])
+
+    def _selection_key_pressed(self, event):
+        """
+        Handle the keys that act on the selected points.  Returns True if
+        the event was handled.
+        """
+        if len(self._selected) == 0:
+            return False
+        if self.scale_up_key.match(event):
+            self.scale_selected(self.scale_step)
+        elif self.scale_down_key.match(event):
+            self.scale_selected(1.0 / self.scale_step)
+        elif self.offset_up_key.match(event):
+            self.offset_selected(self.offset_step)
+        elif self.offset_down_key.match(event):
+            self.offset_selected(-self.offset_step)
+        elif self.clear_selection_key.match(event):
+            self.clear_selection()
+        else:
+            return False
+        return True
+
+    def _event_point(self, event):
+        """Return the position of the event in the coordinates of _points."""
+        delta = self.marker_size / 2
+        return (event.x - delta, event.y - delta)
+
+    @on_trait_change('unit_map, unit_map.points')
+    def _check_selection(self, obj, name, new):
+        # The selection is kept only when points are replaced one for one
+        # (e.g. by moving them); otherwise the indices are no longer valid.
+        if name != 'points_items' or len(new.added) != len(new.removed):
+            self.clear_selection()
+
+    @contextmanager
+    def _edit(self):
+        """
+        Context manager for changes to the unit map that should result in
+        exactly one `updated` event.
+
+        The changes are made in a `UnitMap.batch()` block, so listeners see
+        a single change when the block exits.  If the points were not
+        changed, `updated` is fired anyway so the status text propagates.
+        """
+        version = self.unit_map.version
+        with self.unit_map.batch():
+            yield
+        if self.unit_map.version == version:
+            self.updated = True
 
     def set_status_text(self, text):
         if self.label is not None:
@@ -538,25 +829,35 @@ class UnitMapEditor(Component):
             prefix = ""
         self.status_text = prefix + text
 
-    # @cached_property
-    def _get__points(self):
-        delta = self.marker_size / 2
-        w = self.width - 2 * delta
-        h = self.height - 2 * delta
-        _points = [(p[0] * w, p[1] * h) for p in self.unit_map.points]
-        return _points
-
-    @on_trait_change('unit_map, unit_map.points')
-    def data_changed(self):
-        # self._compute_screen_points()
-        self.request_redraw()
-        self.updated = True
-
-    @on_trait_change('background_color, line_color, grid_color')
-    def color_changed(self):
-        self.request_redraw()
+    def _draw_markers(self, gc, indices):
+        super(UnitMapEditor, self)._draw_markers(gc, indices)
+        if 0 <= self._over_index < len(self._points):
+            # Draw the selected marker on top, in case it was hidden by
+            # the level of detail reduction.
+            delta = self.marker_size / 2
+            x, y = self._points[self._over_index] - delta
+            gc.set_fill_color(self.selected_color)
+            gc.rect(x, y, 2 * delta, 2 * delta)
+            gc.draw_path()
+        if len(self._selected) > 0:
+            delta = self.marker_size / 2
+            points = self._points[self._selected]
+            rects = np.empty((len(points), 4))
+            rects[:, :2] = points - delta
+            rects[:, 2:] = 2 * delta
+            gc.set_fill_color(self.selected_color)
+            gc.begin_path()
+            gc.rects(rects)
+            gc.draw_path()
+        if self._band is not None:
+            (x0, y0), (x1, y1) = self._band
+            gc.set_stroke_color(self.selected_color)
+            gc.set_line_width(1.0)
+            gc.begin_path()
+            gc.rect(min(x0, x1), min(y0, y1), abs(x1 - x0), abs(y1 - y0))
+            gc.stroke_path()
 
-    def _grid_resolution_index_changed(self):
+    def _selected_color_changed(self):
         self.request_redraw()
 
     def _menu_default(self):
@@ -584,38 +885,86 @@ class UnitMapEditor(Component):
             root.append(a)
         return root
 
-    def _is_near_point(self, point, event):
-        delta = self.marker_size / 2
-        event_point = (event.x - delta, event.y - delta)
-        near = max(abs(point[0] - event_point[0]),
-                    abs(point[1] - event_point[1])) \
-                        <= self._near_threshold
-        return near
-
-    def _over_point(self, event):
-        # This stops at the first point within the threshold.
-        # This is not correct when the points are close together.
-        for i, point in enumerate(self._points):
-            if self._is_near_point(point, event):
-                result = i
-                break
-        else:
-            result = None
-        return result
-
     def _closest_within_threshold(self, event):
         """
-        Of all the points within self.threshold of the event, return the
-        closest.
-        Returns None if no points are within self.threshold.
+        Of all the points within self._near_threshold of the event, return
+        the index of the closest.
+        Returns None if no points are within self._near_threshold.
         """
         delta = self.marker_size / 2
-        closest = None
-        for i, point in enumerate(self._points):
-            dist2 = ((point[0] - (event.x - delta)) ** 2 +
-                     (point[1] - (event.y - delta)) ** 2)
-            if dist2 < self._near_threshold ** 2:
-                if closest is None or dist2 < closest_dist2:
-                    closest = i
-                    closest_dist2 = dist2
-        return closest
+        return closest_within(self._points, (event.x - delta, event.y - delta),
+                              self._near_threshold)
+
+
+def _clean_points(task, points, tol):
+    """The Clean task of UnitMapEditor.do_clean()."""
+    def callback(k, n):
+        task.check()
+        task.progress(float(k) / n)
+    return clean2(list(points[0]), tol, callback)
+
+
+def closest_within(points, p, threshold):
+    """
+    Return the index of the point in `points` that is closest to `p`, or
+    None if no point is within the distance `threshold` of `p`.
+
+    `points` must be an (n, 2) array whose first column is nondecreasing.
+    Bisection restricts the search to the points whose x coordinate is
+    within `threshold` of p[0], so the cost depends on the number of points
+    near p rather than on the total number of points.
+    """
+    x, y = p
+    xs = points[:, 0]
+    lo = np.searchsorted(xs, x - threshold, side='left')
+    hi = np.searchsorted(xs, x + threshold, side='right')
+    if lo == hi:
+        return None
+    window = points[lo:hi]
+    dist2 = (window[:, 0] - x) ** 2 + (window[:, 1] - y) ** 2
+    k = dist2.argmin()
+    if dist2[k] >= threshold ** 2:
+        return None
+    return lo + int(k)
+
+
+def column_envelope(points):
+    """
+    Return the indices of the points needed to draw a polyline with at most
+    four vertices per pixel column.
+
+    `points` is an (n, 2) array of screen coordinates whose first column is
+    nondecreasing.  In each pixel column, the first, lowest, highest and last
+    points are kept (in their original order), so the reduced polyline
+    covers the same pixels as the full one.
+    """
+    n = len(points)
+    cols = np.floor(points[:, 0])
+    starts = np.flatnonzero(np.r_[True, cols[1:] != cols[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+    ys = points[:, 1]
+    lowest = _first_in_group(
+        ys == np.minimum.reduceat(ys, starts)[group], group)
+    highest = _first_in_group(
+        ys == np.maximum.reduceat(ys, starts)[group], group)
+    return np.unique(np.concatenate((starts, lowest, highest, ends)))
+
+
+def _first_in_group(mask, group):
+    """Return the first index where `mask` is True in each group."""
+    idx = np.flatnonzero(mask)
+    g = group[idx]
+    return idx[np.r_[True, g[1:] != g[:-1]]]
+
+
+def occupied_cells(points, cell_size):
+    """
+    Return the indices of one point in each square cell (with side
+    `cell_size`) that contains at least one of the points.
+    """
+    cells = np.floor(points / cell_size).astype(np.int64)
+    keys = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+    _, indices = np.unique(keys, return_index=True)
+    indices.sort()
+    return indices